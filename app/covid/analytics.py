@@ -0,0 +1,179 @@
+"""
+    Optional DuckDB backend for analytical queries
+
+    DuckDB is an in-process columnar engine. Wide aggregations such as
+    the map pivot, the FL DEM death match and grouping by state scan
+    a few columns of many rows, which it does much faster than SQLite.
+    DuckDataBase has the table API of DataBase and the views in sql.py
+    run on both backends, so a stage can move between them by changing
+    the engine of database.open_database.
+
+    DuckDB is not a requirement of the app, install it to use it:
+        pip install duckdb
+
+        Example:
+        duck = DuckDataBase()
+        duck.copy_tables([US_MAP_TABLE, STATE_MAP_TABLE, NYTIMES_COUNTIES_TABLE])
+        duck.update(US_MAP_VIEW)
+        duck.update(US_MAP_PIVOT_VIEW)
+        pivot = duck.get_table(US_MAP_PIVOT_VIEW_TABLE)
+        duck.close()
+"""
+
+from os.path import join
+import logging
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # optional backend
+    duckdb = None
+
+from utilities import cwd
+from database import DataBase, schema, typed
+from sql import DUCKDB_TABLE_EXISTS
+
+log = logging.getLogger(__name__)
+
+DUCKDB_PATH = join(cwd(), 'data', 'covid19.duckdb')
+
+
+class DuckDataBase:
+    """Interface with DuckDB database, same table API as DataBase
+
+        Example:
+        duck = DuckDataBase()
+        duck.add_table(table_name, df)
+        df = duck.get_table(table_name, parse_dates=['date'])
+        duck.close()
+    """
+    def __init__(self, path=None, readonly=False):
+        """Connect to DuckDB database
+
+        Keyword Arguments:
+            path {String} -- database file, ':memory:' for in memory (default: {DUCKDB_PATH})
+            readonly {bool} -- read-only connection (default: {False})
+        """
+        if duckdb is None:
+            raise ImportError('duckdb backend is not installed: pip install duckdb')
+
+        self.path = path or DUCKDB_PATH
+        self.readonly = readonly
+        self.conn = duckdb.connect(self.path, read_only=readonly)
+
+        log.debug('duckdb connection started')
+
+    def update(self, sql_query):
+        """Update database
+
+        Arguments:
+            sql_query {String} -- SQL query
+        """
+        self.conn.execute(sql_query)
+
+        log.debug('update executed')
+
+    def fetch(self, sql_query):
+        """Fetch data from database
+
+        Arguments:
+            sql_query {String} -- SQL query
+
+        Returns:
+            list -- database records
+        """
+        return self.conn.execute(sql_query).fetchall()
+
+    def add_table(self, name, data, index=True):
+        """Add a pandas table to database
+
+        Arguments:
+            name {String} -- table name
+            data {DataFrame} -- table data
+            index {bool} -- add index to table (default: {True})
+        """
+        _data = data.reset_index() if index else data
+        self.conn.register('_frame', _data)
+        try:
+            self.conn.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM _frame")
+        finally:
+            self.conn.unregister('_frame')
+
+        log.debug('table: %s added', name)
+
+    def has_table(self, name):
+        """Return True if table exists
+
+        Arguments:
+            name {String} -- table name
+
+        Returns:
+            bool -- table exists
+        """
+        return bool(self.fetch(DUCKDB_TABLE_EXISTS.format(name=name)))
+
+    def copy_tables(self, names, source=None):
+        """Copy tables as stored from a SQLite database
+
+        Arguments:
+            names {list} -- table names
+
+        Keyword Arguments:
+            source {DataBase} -- open SQLite database (default: {DataBase()})
+        """
+        _source = source or DataBase()
+        try:
+            for name in names:
+                data = pd.read_sql_query(sql=f"select * from {name};", con=_source.conn)
+                self.add_table(name, data, index=False)
+        finally:
+            if source is None:
+                _source.close()
+
+        log.debug('tables: %s copied', ', '.join(names))
+
+    def get_table(self, name, index_col=None, parse_dates=None, columns=None):
+        """Return dataframe from database
+
+        Arguments:
+            name {String} -- table name
+            columns {list} -- column name(s) to read from table (default: {None})
+            index_col {String or list} -- column name(s) (default: {None})
+            parse_dates {list or dict} -- column name(s) (default: {None})
+
+        Returns:
+            {DataFrame} -- table data typed as declared in SCHEMAS
+        """
+        _dates, _dtypes = schema(name, parse_dates)
+        _cols = ', '.join(columns) if columns else '*'
+
+        _result = self.conn.sql(f"select {_cols} from {name}")
+        _data = _result.df()
+
+        # blobs as bytes like sqlite3, duckdb returns bytearray
+        for _col, _type in zip(_result.columns, _result.types):
+            if str(_type) == 'BLOB':
+                _data[_col] = [None if _value is None else bytes(_value)
+                               for _value in _data[_col]]
+
+        for _col, _format in _dates.items():
+            if _col in _data.columns:
+                _data[_col] = pd.to_datetime(_data[_col], format=_format or None)
+        _data = typed(_data, _dtypes)
+
+        if index_col is not None:
+            _data = _data.set_index(index_col)
+
+        log.debug('table: %s returned', name)
+        return _data
+
+    def close(self):
+        """Close database connection
+        """
+        if self.conn is None:
+            return
+        self.conn.close()
+        self.conn = None
+
+        log.debug('duckdb connection closed')
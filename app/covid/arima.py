@@ -4,16 +4,17 @@
 
 import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt
 import pmdarima as pm
 
 from database import DataBase
+from metrics import METRICS
+from nytimes import states_view_hash
+from stages import ARIMA_STAGE, content_hash, unchanged, save_stage
 from sql import STATES_VIEW_TABLE
-
-
-# output - database
-ARIMA_CASES_TABLE = 'arima_cases'
-ARIMA_DEATHS_TABLE = 'arima_deaths'
+from tables import (
+    ARIMA_CASES_TABLE,
+    ARIMA_DEATHS_TABLE
+)
 
 
 def arima_model(data, y_var):
@@ -28,17 +29,19 @@ def arima_model(data, y_var):
     """
     results = dict(index=[], state_id=[], state=[], upper=[], lower=[], predict=[])
 
-    for state_id, state in zip(data['state_id'].unique(), data['state'].unique()):
-        # select state data
-        data_state = data[data['state'] == state]
-        data_state = data_state.sort_values('date').reset_index(drop=True)
+    # one pass grouping instead of a filter per state
+    data = data.sort_values(['state_id', 'date'], kind='stable')
+    for (state_id, state), data_state in data.groupby(['state_id', 'state'], sort=False,
+                                                      observed=True):
+        data_state = data_state.reset_index(drop=True)
 
-        # Create Training and Test
-        train = []
-        train.append(0)
-        for i in range(len(data_state) - 1):
-            x = data_state[y_var][i + 1] - data_state[y_var][i]
-            train.append(x)
+        # Create Training and Test, daily new values starting at zero
+        if 'new_' + y_var in data_state.columns:
+            train = data_state['new_' + y_var].to_numpy(dtype='float64', copy=True)
+        else:
+            train = np.diff(data_state[y_var].to_numpy(dtype='float64'), prepend=np.nan)
+        train[0] = 0
+        train = list(train)
 
         # auto arima
         model = pm.auto_arima(train, start_p=1, start_q=1,
@@ -90,10 +93,10 @@ def run_arima(data, y_var, show_results=False):
     Returns:
         DataFrame -- prediction results
     """
-    result = data.copy(deep=True)
+    result = data.drop(columns=[_col for _col in METRICS if _col in data.columns])
 
     # run arima model
-    arima = arima_model(result, y_var)
+    arima = arima_model(data, y_var)
 
     # merge prediction with data and plotted
     arima['start'] = arima['state'].map(data.groupby(['state']).min()['date'])
@@ -110,6 +113,8 @@ def run_arima(data, y_var, show_results=False):
     result = pd.concat([result, arima], axis=0, ignore_index=True)
 
     if show_results:
+        from matplotlib import pyplot as plt  # pylint: disable=import-outside-toplevel
+
         for state in ['Florida', 'Georgia', 'Alabama', 'New York']:
             result_state = result[result['state'] == state]
             plt.plot(result_state['date'], result_state['actual'], color='blue')
@@ -123,9 +128,37 @@ def run_arima(data, y_var, show_results=False):
     return result
 
 
-def predict():
+def predictions(data):
+    """Predict covid19 cases and deaths, without database access
+
+    Arguments:
+        data {DataFrame} -- STATES_VIEW rows with parsed dates
+
+    Returns:
+        dict -- table name: prediction results
+    """
+    tables = dict()
+    for table, y_var in [(ARIMA_CASES_TABLE, 'cases'), (ARIMA_DEATHS_TABLE, 'deaths')]:
+        result = run_arima(data, y_var)
+
+        # only data after 3/15/2020
+        slicer = result['date'] > pd.to_datetime('3/15/2020')
+        result = result.loc[slicer, :].copy(deep=True)
+        result.sort_values(['date', 'state'], inplace=True)
+        tables[table] = result.round(0)
+
+    return tables
+
+
+def predict(data=None, force=False):
     """main module function to predict covid19 cases and deaths
 
+    Skipped if data is the same as in the last prediction.
+
+    Keyword Arguments:
+        data {DataFrame} -- STATES_VIEW rows (default: {read from database})
+        force {bool} -- predict even if data is unchanged (default: {False})
+
     Inputs from databae:
         US_STATES_TABLE {database table} -- nytimes covid19 data
 
@@ -133,35 +166,23 @@ def predict():
         ARIMA_CASES_TABLE {database table} -- cases[predict, upper, lower]
         ARIMA_DEATHS_TABLE {database table } -- deaths[predict, upper, lower]
     """
-    _db = DataBase()
-    data = _db.get_table(STATES_VIEW_TABLE, parse_dates=['date'])
-    _db.close()
+    if data is None:
+        _db = DataBase()
+        data = _db.get_table(STATES_VIEW_TABLE, parse_dates=['date'])
+        _db.close()
 
-    # predict cases
-    result = run_arima(data, 'cases')
+    inputs = states_view_hash(data)
+    if not force and unchanged(ARIMA_STAGE, inputs):
+        return
 
-    # only data after 3/15/2020
-    slicer = result['date'] > pd.to_datetime('3/15/2020')
-    result = result.loc[slicer, :].copy(deep=True)
-    result.sort_values(['date', 'state'], inplace=True)
-    result = result.round(0)
+    tables = predictions(data)
 
     _db = DataBase()
-    _db.add_table(ARIMA_CASES_TABLE, data=result, index=False)
+    for table, result in tables.items():
+        _db.add_table(table, data=result, index=False)
     _db.close()
 
-    # predict deaths
-    result = run_arima(data, 'deaths')
-
-     # only data after 3/15/2020
-    slicer = result['date'] > pd.to_datetime('3/15/2020')
-    result = result.loc[slicer, :].copy(deep=True)
-    result.sort_values(['date', 'state'], inplace=True)
-    result = result.round(0)
-
-    _db = DataBase()
-    _db.add_table(ARIMA_DEATHS_TABLE, data=result, index=False)
-    _db.close()
+    save_stage(ARIMA_STAGE, inputs, content_hash(*tables.values()))
 
 
 if __name__ == "__main__":
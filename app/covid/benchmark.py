@@ -0,0 +1,497 @@
+"""
+    Benchmark pipeline stages on deterministic synthetic data
+
+    Each scale (days x counties) builds a temporary database with
+    synthetic maps, NY Times and FL DEM data, then times every stage.
+    Every run of a stage starts cold, with an empty result cache and
+    its output tables dropped. Cached reads are also timed warm, as
+    <stage>.warm. Results are printed (or saved) as JSON.
+
+    Usage:
+        python benchmark.py --days 30 365 730 --counties 300 3000 \
+                            --repeat 3 --output bench.json
+
+    With --backends, analytical queries also run on the optional
+    DuckDB backend (pip install duckdb) to compare it with SQLite.
+"""
+
+import json
+import time
+import argparse
+from io import BytesIO
+from os.path import join, dirname
+from contextlib import ExitStack
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from bokeh.palettes import Purples
+
+import cache
+import generations
+import nytimes
+import arima
+import clf
+import fldem
+import wrangler
+from database import DataBase, open_database
+from utilities import cwd
+from sql import (
+    STATES_VIEW_TABLE,
+    STATES_VIEW,
+    FLDEM_VIEW,
+    DROP_FLDEM_VIEW,
+    US_MAP_VIEW,
+    US_MAP_PIVOT_VIEW,
+    DROP_TABLE
+)
+
+
+START_DATE = '2020-03-01'
+
+# states required by get_maps and by the app defaults
+REQUIRED_STATES = ['02', '12', '15', '48']
+
+# analytical queries compared across backends
+BACKEND_TABLES = [wrangler.US_MAP_TABLE, wrangler.STATE_MAP_TABLE,
+                  nytimes.NYTIMES_COUNTIES_TABLE, nytimes.NYTIMES_STATES_TABLE,
+                  fldem.FLDEM_CASES_TABLE, fldem.FLDEM_DEATHS_TABLE]
+BACKEND_VIEWS = [STATES_VIEW, FLDEM_VIEW, US_MAP_VIEW, US_MAP_PIVOT_VIEW]
+BACKEND_QUERIES = {
+    'us_map_pivot': 'SELECT * FROM us_map_pivot_view',
+    'fldem_death_match': 'SELECT died, COUNT(*) AS n FROM fldem_view GROUP BY died',
+    'states_grouping': ('SELECT state_id, state, COUNT(*) AS n, MAX(cases) AS cases, '
+                        'MAX(deaths) AS deaths FROM states_view GROUP BY state_id, state')
+}
+
+
+def county_sample(n_counties):
+    """Select counties round-robin by state so every state is present
+
+    Arguments:
+        n_counties {int} -- number of counties
+
+    Returns:
+        DataFrame -- fips, county, state, state_id
+    """
+    pop = pd.read_csv(join(cwd(), 'input', 'fips_county_pop.csv'))
+    pop['state_id'] = (pop['fips'] // 1000).map('{:02d}'.format)
+    pop = pop[~pop['state_id'].isin(['72', '78', '69', '66', '60'])]
+
+    pop['rank'] = pop.groupby('state_id').cumcount()
+    pop['required'] = ~pop['state_id'].isin(REQUIRED_STATES)
+    pop = pop.sort_values(['rank', 'required', 'fips']).head(n_counties)
+
+    return pop.sort_values('fips').reset_index(drop=True)
+
+
+def synthetic_shapes(counties):
+    """Build raw shapefile-like county and state geodataframes
+
+    Every state is a cell of a lon/lat grid covering the continental
+    US, counties are squares inside their state cell.
+
+    Arguments:
+        counties {DataFrame} -- output of county_sample
+
+    Returns:
+        tuple -- county and state geodataframes (EPSG:4269)
+    """
+    states = counties.drop_duplicates('state_id')[['state_id', 'state']]
+    states = states.reset_index(drop=True)
+
+    ncols = 8
+    width, height = 58.0 / ncols, 24.0 / int(np.ceil(len(states) / ncols))
+    states['x0'] = -125.0 + (states.index % ncols) * width
+    states['y0'] = 25.0 + (states.index // ncols) * height
+
+    cells = states.set_index('state_id')[['x0', 'y0']]
+    counties = counties.join(cells, on='state_id')
+    counties['rank'] = counties.groupby('state_id').cumcount()
+    side = counties.groupby('state_id')['rank'].transform('max') + 1
+    side = np.ceil(np.sqrt(side))
+    size_x, size_y = width / side, height / side
+
+    xmin = counties['x0'] + (counties['rank'] % side) * size_x
+    ymin = counties['y0'] + (counties['rank'] // side) * size_y
+    geometry = [box(x, y, x + 0.9 * dx, y + 0.9 * dy)
+                for x, y, dx, dy in zip(xmin, ymin, size_x, size_y)]
+
+    us_map = gpd.GeoDataFrame({
+        'GEOID': counties['fips'].map('{:05d}'.format),
+        'STATEFP': counties['state_id'],
+        'NAME': counties['county'],
+        'ALAND': np.int64(size_x * size_y * 1e10),
+        'AWATER': np.int64(size_x * size_y * 1e8)}, geometry=geometry, crs='EPSG:4269')
+
+    geometry = [box(x, y, x + width, y + height)
+                for x, y in zip(states['x0'], states['y0'])]
+    state_map = gpd.GeoDataFrame({
+        'STATEFP': states['state_id'],
+        'NAME': states['state'],
+        'STUSPS': states['state'].str[:2].str.upper(),
+        'ALAND': np.int64(width * height * 1e10),
+        'AWATER': np.int64(width * height * 1e8)}, geometry=geometry, crs='EPSG:4269')
+
+    return us_map, state_map
+
+
+def synthetic_nytimes(counties, days, seed=0):
+    """Build NY Times like cumulative county and state data
+
+    Arguments:
+        counties {DataFrame} -- output of county_sample
+        days {int} -- number of reported days
+
+    Keyword Arguments:
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        tuple -- us counties and us states raw data
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range(START_DATE, periods=days, freq='D')
+
+    rate = rng.uniform(0.5, 50.0, size=(len(counties), 1)) * np.linspace(0.1, 1.0, days)
+    cases = rng.poisson(rate).cumsum(axis=1)
+    deaths = rng.binomial(cases, 0.02)
+    deaths = np.maximum.accumulate(deaths, axis=1)
+
+    data = pd.DataFrame({
+        'date': np.tile(dates, len(counties)),
+        'county': np.repeat(counties['county'].values, days),
+        'state': np.repeat(counties['state'].values, days),
+        'fips': np.repeat(counties['fips'].map('{:05d}'.format).values, days),
+        'cases': cases.ravel(),
+        'deaths': deaths.ravel()})
+
+    states = data.groupby(['date', 'state'], as_index=False)[['cases', 'deaths']].sum()
+    ids = counties.drop_duplicates('state')[['state', 'state_id']]
+    states = states.merge(ids, on='state').rename(columns={'state_id': 'fips'})
+
+    data['date'] = data['date'].dt.strftime('%Y-%m-%d')
+    states['date'] = states['date'].dt.strftime('%Y-%m-%d')
+
+    return data, states[['date', 'state', 'fips', 'cases', 'deaths']]
+
+
+def synthetic_fldem(counties, days, seed=0):
+    """Build FL DEM like cleaned cases and deaths
+
+    Arguments:
+        counties {DataFrame} -- output of county_sample
+        days {int} -- number of reported days
+
+    Keyword Arguments:
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        tuple -- fldem cases and fldem deaths
+    """
+    rng = np.random.RandomState(seed)
+    county_ids = counties.loc[counties['state_id'] == '12', 'fips'].map('{:05d}'.format)
+    n_cases = 50 * days
+
+    day = rng.randint(0, days, n_cases)
+    cases = pd.DataFrame({
+        'case_id': np.arange(n_cases),
+        'county_id': rng.choice(county_ids.values, n_cases),
+        'state_id': '12',
+        'date': pd.Timestamp(START_DATE) + pd.to_timedelta(day, 'days'),
+        'day': day,
+        'male': rng.randint(0, 2, n_cases),
+        'age': rng.randint(0, 100, n_cases),
+        'traveled': rng.randint(0, 2, n_cases),
+        'place': rng.choice(['FL', 'NY', 'NA'], n_cases),
+        'contacted': rng.randint(0, 2, n_cases),
+        'resident': rng.randint(0, 2, n_cases)})
+
+    deaths = cases.sample(frac=0.03, random_state=seed)
+
+    return cases, deaths
+
+
+def synthetic_arima(states):
+    """Build ARIMA like table from cleaned states data
+
+    Arguments:
+        states {DataFrame} -- states view data
+
+    Returns:
+        DataFrame -- table in ARIMA_CASES_TABLE format
+    """
+    data = states.rename(columns={'cases': 'actual'})
+    data = data[['date', 'state_id', 'state', 'actual']].copy(deep=True)
+    data['upper'] = data['actual'] * 1.1
+    data['lower'] = data['actual'] * 0.9
+    data['predict'] = data['actual']
+    return data
+
+
+def timed(function, repeat, reset=None):
+    """Time a function call
+
+    Arguments:
+        function {callable} -- function without arguments
+        repeat {int} -- number of runs
+
+    Keyword Arguments:
+        reset {callable} -- untimed call before each run (default: {None})
+
+    Returns:
+        tuple -- seconds of each run and result of last run
+    """
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return seconds, result
+
+
+def drop_tables(*names):
+    """Return reset dropping tables, so each run writes them from scratch
+
+    Arguments:
+        names {String} -- table names
+
+    Returns:
+        callable -- reset for timed
+    """
+    def _reset():
+        _db = DataBase()
+        for _name in names:
+            _db.update(DROP_TABLE.format(name=_name))
+        _db.close()
+    return _reset
+
+
+class Benchmark:
+    """Benchmark pipeline stages for one synthetic scale
+
+        Example:
+        bench = Benchmark(days=365, counties=3000, repeat=3)
+        results = bench.run()
+    """
+    def __init__(self, days, counties, repeat=3, arima_states=3, seed=0, backends=False):
+        self.days = days
+        self.n_counties = counties
+        self.repeat = repeat
+        self.arima_states = arima_states
+        self.seed = seed
+        self.backends = backends
+        self.results = []
+        self.raw_rows = dict()
+        self.csv = None
+
+        self.tmpdir = None
+        self.stack = ExitStack()
+        self.counties = county_sample(counties)
+        self.shapes = synthetic_shapes(self.counties)
+
+    def _record(self, stage, rows, seconds):
+        self.results.append(dict(stage=stage,
+                                 days=self.days,
+                                 counties=len(self.counties),
+                                 rows=int(rows),
+                                 repeat=self.repeat,
+                                 min_s=round(min(seconds), 6),
+                                 mean_s=round(float(np.mean(seconds)), 6)))
+
+    def _stage(self, stage, function, rows, reset=None, warm=False):
+        """Time a stage, every run starts cold
+
+        The result cache is emptied and reset is called before each
+        run, so repeated runs do the same work as the first one.
+
+        Arguments:
+            stage {String} -- stage name
+            function {callable} -- stage without arguments
+            rows {int} -- input rows
+
+        Keyword Arguments:
+            reset {callable} -- restores stage inputs, like drop_tables (default: {None})
+            warm {bool} -- also record runs on a filled cache as <stage>.warm (default: {False})
+
+        Returns:
+            object -- result of last run
+        """
+        def _cold():
+            cache.RESULT_CACHE.invalidate(generations.current_path())
+            if reset is not None:
+                reset()
+
+        seconds, result = timed(function, self.repeat, _cold)
+        self._record(stage, rows, seconds)
+        if warm:
+            seconds, result = timed(function, self.repeat)
+            self._record(stage + '.warm', rows, seconds)
+        return result
+
+    def setup(self):
+        """Build temporary database with synthetic inputs
+        """
+        self.tmpdir = dirname(self.stack.enter_context(generations.temporary_database()))
+
+        us_map, state_map = wrangler.get_maps(*[shape.copy() for shape in self.shapes])
+        counties, states = synthetic_nytimes(self.counties, self.days, self.seed)
+        cases, deaths = synthetic_fldem(self.counties, self.days, self.seed)
+
+        _db = DataBase()
+        _db.add_geotable(wrangler.US_MAP_TABLE, us_map.set_index('county_id'))
+        _db.add_geotable(wrangler.STATE_MAP_TABLE, state_map.set_index('state_id'))
+        _db.add_table(wrangler.COUNTY_LOOKUP_TABLE, nytimes.county_index(us_map, state_map),
+                      index=False)
+        _db.add_table(nytimes.US_COUNTIES_TABLE, counties, index=False)
+        _db.add_table(nytimes.US_STATES_TABLE, states, index=False)
+        _db.close()
+
+        _db = DataBase()
+        _db.add_table(fldem.FLDEM_CASES_TABLE, cases, index=False)
+        _db.add_table(fldem.FLDEM_DEATHS_TABLE, deaths, index=False)
+        _db.add_table(fldem.FLDEM_FEATURES_TABLE, fldem.features(cases, deaths), index=False)
+        _db.close()
+
+        self.csv = counties.to_csv(index=False).encode()
+        self.raw_rows = dict(counties=len(counties), states=len(states),
+                             fldem=len(cases))
+
+    def teardown(self):
+        """Remove temporary database and restore the app database
+        """
+        self.stack.close()
+
+    def compare_backends(self):
+        """Time analytical queries on SQLite and DuckDB
+
+        Runs after the pipeline stages, which create the SQLite views
+        except fldem_view. Tables are copied once to a DuckDB file, the
+        copy is timed as its own stage.
+        """
+        _db = DataBase()
+        _db.update(DROP_FLDEM_VIEW)
+        _db.update(FLDEM_VIEW)
+        _db.close()
+
+        duck = open_database('duckdb', path=join(self.tmpdir, 'bench.duckdb'))
+        self._stage('DuckDataBase.copy_tables', lambda: duck.copy_tables(BACKEND_TABLES),
+                    sum(self.raw_rows.values()))
+        for view in BACKEND_VIEWS:
+            duck.update(view)
+
+        _db = DataBase()
+        for query, sql_query in BACKEND_QUERIES.items():
+            for engine, backend in [('sqlite', _db), ('duckdb', duck)]:
+                # pylint: disable=cell-var-from-loop
+                seconds, result = timed(lambda: backend.fetch(sql_query), self.repeat)
+                self._record(f'{engine}.{query}', len(result), seconds)
+        _db.close()
+        duck.close()
+
+    def run(self):
+        """Run all stages
+
+        Returns:
+            list -- one result record per stage
+        """
+        # pylint: disable=import-outside-toplevel
+        from trends import LinePlot
+        from maps import Map
+
+        self.setup()
+        try:
+            self._stage('wrangler.get_maps',
+                        lambda: wrangler.get_maps(*[shape.copy() for shape in self.shapes]),
+                        len(self.counties))
+
+            self._stage('nytimes.clean_counties_data', nytimes.clean_counties_data,
+                        self.raw_rows['counties'],
+                        reset=drop_tables(nytimes.NYTIMES_COUNTIES_TABLE))
+
+            self._stage('nytimes.ingest_counties',
+                        lambda: nytimes.ingest_counties(BytesIO(self.csv)),
+                        self.raw_rows['counties'],
+                        reset=drop_tables(nytimes.NYTIMES_COUNTIES_TABLE))
+
+            self._stage('nytimes.clean_states_data', nytimes.clean_states_data,
+                        self.raw_rows['states'],
+                        reset=drop_tables(nytimes.NYTIMES_STATES_TABLE))
+            nytimes.add_metadata()
+
+            _db = DataBase()
+            states = _db.get_table(STATES_VIEW_TABLE, parse_dates=['date'])
+            _db.add_table(arima.ARIMA_CASES_TABLE, synthetic_arima(states), index=False)
+            _db.close()
+
+            subset = states[states['state_id'].isin(states['state_id'].unique()[:self.arima_states])]
+            self._stage('arima.arima_model', lambda: arima.arima_model(subset, 'cases'),
+                        len(subset))
+
+            self._stage('clf.classify', clf.classify, self.raw_rows['fldem'],
+                        reset=drop_tables(clf.MODELS_ROC_TABLE, clf.IMPORTANCE_TABLE))
+
+            def geotable():
+                _db = DataBase()
+                data = _db.get_geotable(wrangler.US_MAP_TABLE)
+                _db.close()
+                return data
+            self._stage('DataBase.get_geotable', geotable, len(self.counties), warm=True)
+
+            def geometry():
+                _db = DataBase()
+                data = _db.get_geometry(wrangler.US_MAP_TABLE)
+                _db.close()
+                return data
+            self._stage('DataBase.get_geometry', geometry, len(self.counties), warm=True)
+
+            self._stage('LinePlot', lambda: LinePlot(arima.ARIMA_CASES_TABLE), len(states),
+                        warm=True)
+
+            palette = list(reversed(Purples[8]))
+            self._stage('Map', lambda: Map(plot_width=800, plot_height=400, palette=palette),
+                        len(self.counties), warm=True)
+
+            if self.backends:
+                self.compare_backends()
+        finally:
+            self.teardown()
+
+        return self.results
+
+
+def main():
+    """Parse command line and run benchmarks
+    """
+    parser = argparse.ArgumentParser(description='Pipeline stage benchmarks')
+    parser.add_argument('--days', type=int, nargs='+', default=[30, 180, 365])
+    parser.add_argument('--counties', type=int, nargs='+', default=[300, 3000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--arima-states', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='json output file')
+    parser.add_argument('--backends', action='store_true',
+                        help='compare sqlite and duckdb on analytical queries')
+    args = parser.parse_args()
+
+    results = []
+    for counties in args.counties:
+        for days in args.days:
+            bench = Benchmark(days, counties, repeat=args.repeat,
+                              arima_states=args.arima_states, seed=args.seed,
+                              backends=args.backends)
+            results += bench.run()
+
+    report = dict(params=vars(args), results=results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,16 @@
 
 import os
 import time
+import queue
 import asyncio
 import logging
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 
+import pandas as pd
 from bokeh import __version__
 from bokeh.palettes import Greens
 from bokeh.models import Div
@@ -29,12 +32,16 @@ from distros import age_gender_histograms
 from maps import Map
 from trends import Trends
 from fits import models_result
-from database import DataBase
+from database import DataBase, sample_tables
+from generations import temporary_database
 from utilities import cwd
-from sql import FLDEM_VIEW_TABLE
-from clf import (
+from sql import STATES_VIEW_TABLE
+from tables import (
+    FLDEM_FEATURES_TABLE,
     IMPORTANCE_TABLE,
-    MODELS_ROC_TABLE
+    MODELS_ROC_TABLE,
+    ARIMA_CASES_TABLE,
+    ARIMA_DEATHS_TABLE
 )
 from config import (
     set_bokeh_port,
@@ -48,6 +55,10 @@ from config import (
 logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
+# sessions read and prepare data in these threads, not on the io loop
+LOAD_WORKERS = 4
+EXECUTOR = ThreadPoolExecutor(max_workers=LOAD_WORKERS)
+
 
 class BokehApp:
     """
@@ -58,13 +69,6 @@ class BokehApp:
         self.count = 0
         self.id_base = id_base
 
-        _db = DataBase()
-        self.data = _db.get_table(FLDEM_VIEW_TABLE)
-        self.roc = _db.get_table(MODELS_ROC_TABLE)
-        self.importance = _db.get_table(IMPORTANCE_TABLE)
-        _db.close()
-        LOG.info('data loaded')
-
         self.palette = dict()
         self.palette['theme'] = list(reversed(Greens[8]))
         self.palette['color'] = self.palette['theme'][2]
@@ -96,6 +100,79 @@ class BokehApp:
         doc.add_root(Div(text=text_update, **attributes))
         return doc
 
+    def add_deferred(self, load, build, doc=None):
+        """Add a loading placeholder, filled when data is ready
+
+        load runs in EXECUTOR, build runs on the session's next tick
+        with the loaded data, so the io loop never waits for the
+        database.
+
+        Arguments:
+            load {callable} -- returns data, no bokeh models
+            build {callable} -- returns layout from data
+
+        Keyword Arguments:
+            doc {Document} -- current bokeh document (default: {None})
+
+        Returns:
+            Document -- updated bokeh document
+        """
+        if doc is None:
+            doc = self.doc
+
+        attributes = dict(height=30, width=800, align=None,
+                          style={'width': '800px',
+                                 'font-style': 'italic',
+                                 'color': 'darkgrey',
+                                 'text-align': 'center'})
+        placeholder = column(Div(text='<b>Loading...</b>', **attributes))
+        doc.add_root(placeholder)
+
+        future = EXECUTOR.submit(load)
+
+        def _populate():
+            try:
+                placeholder.children = [build(future.result())]
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception('session data failed')
+                placeholder.children = [Div(text='<b>Data not available</b>',
+                                            **attributes)]
+
+        def _schedule(_future):
+            try:
+                doc.add_next_tick_callback(_populate)
+            except Exception:  # pylint: disable=broad-except
+                # session closed before data was ready
+                LOG.debug('session gone, data dropped')
+
+        future.add_done_callback(_schedule)
+        return doc
+
+    @staticmethod
+    def load_histograms():
+        """Read histogram data
+
+        Returns:
+            DataFrame -- fldem features
+        """
+        _db = DataBase(cache=True, readonly=True)
+        data = _db.get_table(FLDEM_FEATURES_TABLE)
+        _db.close()
+        return data
+
+    @staticmethod
+    def load_models():
+        """Read models data
+
+        Returns:
+            dict -- roc curves and feature importance
+        """
+        _db = DataBase(cache=True, readonly=True)
+        data = dict(roc=_db.get_table(MODELS_ROC_TABLE),
+                    importance=_db.get_table(IMPORTANCE_TABLE))
+        _db.close()
+        return data
+
     def add_text(self, text, doc=None):
         """Add footer to current document
 
@@ -178,16 +255,13 @@ class BokehApp:
         Returns:
             Document -- updated bokeh document
         """
-        if doc is None:
-            doc = self.doc
+        def _build(data):
+            LOG.info('histograms added')
+            return age_gender_histograms(data,
+                                         self.palette['color'],
+                                         self.palette['hover'])
 
-        doc.add_root(age_gender_histograms(
-            self.data,
-            self.palette['color'],
-            self.palette['hover']
-        ))
-        LOG.info('histograms added')
-        return doc
+        return self.add_deferred(self.load_histograms, _build, doc)
 
     def add_map(self, doc=None):
         """Add interactive map to current document
@@ -198,19 +272,18 @@ class BokehApp:
         Returns:
             Document -- updated bokeh document
         """
-        if doc is None:
-            doc = self.doc
-
-        plot = Map(plot_width=800,
-                   plot_height=400,
-                   palette=self.palette['theme'])
-        layout = column(plot.controls['select'],
-                        plot.plot,
-                        row(plot.controls['slider'],
-                            plot.controls['button']))
-        doc.add_root(layout)
-        LOG.info('us_map added')
-        return doc
+        def _build(data):
+            plot = Map(data,
+                       plot_width=800,
+                       plot_height=400,
+                       palette=self.palette['theme'])
+            LOG.info('us_map added')
+            return column(plot.controls['select'],
+                          plot.plot,
+                          row(plot.controls['slider'],
+                              plot.controls['button']))
+
+        return self.add_deferred(Map.load, _build, doc)
 
     def add_models(self, doc=None):
         """Add covid-19 models to current document
@@ -221,18 +294,15 @@ class BokehApp:
         Returns:
             Document -- updated bokeh document
         """
-        if doc is None:
-            doc = self.doc
+        def _build(data):
+            LOG.info('modeling added')
+            return models_result(data['roc'],
+                                 data['importance'],
+                                 self.palette['theme'][2:],
+                                 self.palette['color'],
+                                 self.palette['hover'])
 
-        doc.add_root(models_result(
-            self.roc,
-            self.importance,
-            self.palette['theme'][2:],
-            self.palette['color'],
-            self.palette['hover']
-        ))
-        LOG.info('modeling added')
-        return doc
+        return self.add_deferred(self.load_models, _build, doc)
 
     def add_trends(self, doc=None):
         """Add covid-19 trends to current document
@@ -243,13 +313,11 @@ class BokehApp:
         Returns:
             Document -- updated bokeh document
         """
-        if doc is None:
-            doc = self.doc
+        def _build(data):
+            LOG.info('trends added')
+            return Trends(self.palette['trends'], data).layout()
 
-        trend = Trends(self.palette['trends'])
-        doc.add_root(trend.layout())
-        LOG.info('trends added')
-        return doc
+        return self.add_deferred(Trends.load, _build, doc)
 
 
 def bkapp_maps(doc):
@@ -326,6 +394,100 @@ def bkapp_models(doc):
     return doc
 
 
+class PageDocument:
+    """Document stand-in for utest_pages
+
+    Next tick callbacks are queued instead of run by a session, so the
+    test can wait for deferred data and build it like the io loop.
+    """
+    def __init__(self):
+        self.roots = []
+        self.theme = None
+        self.callbacks = queue.Queue()
+
+    def add_root(self, model):
+        """Add a root model
+        """
+        self.roots.append(model)
+
+    def add_next_tick_callback(self, callback):
+        """Queue callback, run by populate
+        """
+        self.callbacks.put(callback)
+
+    def populate(self, timeout=60):
+        """Run callbacks of all deferred placeholders
+
+        Keyword Arguments:
+            timeout {float} -- seconds to wait for each one (default: {60})
+
+        Returns:
+            bool -- every placeholder got its layout
+        """
+        placeholders = [_root for _root in self.roots
+                        if getattr(_root, 'children', None) and
+                        'Loading' in getattr(_root.children[0], 'text', '')]
+        for _ in placeholders:
+            self.callbacks.get(timeout=timeout)()
+        return all(not isinstance(_root.children[0], Div) for _root in placeholders)
+
+
+def utest_pages():
+    """Build every page twice, on a cache miss then a cache hit
+
+    Pages read sample tables of a temporary database through the
+    result cache, as in production.
+
+    Returns:
+        list -- names of pages that failed
+    """
+    from nytimes import add_metadata  # pylint: disable=import-outside-toplevel
+
+    failed = []
+    with temporary_database():
+        sample_tables()
+        add_metadata()
+
+        _db = DataBase()
+        states = _db.get_table(STATES_VIEW_TABLE, parse_dates=['date'])
+        arima = states[['date', 'state_id', 'state']].assign(
+            actual=states['cases'], upper=states['cases'] * 1.1,
+            lower=states['cases'] * 0.9, predict=states['cases'])
+        _db.add_table(ARIMA_CASES_TABLE, arima, index=False)
+        _db.add_table(ARIMA_DEATHS_TABLE, arima, index=False)
+        _db.add_table(FLDEM_FEATURES_TABLE, pd.DataFrame({
+            'date': pd.date_range('2020-03-01', periods=6, freq='D'),
+            'day': range(6),
+            'gender': [1, 0, 1, 0, 1, 0],
+            'age': [25, 40, 61, 72, 85, 33],
+            'land_area': 2266,
+            'water_area': 242,
+            'population': 269043,
+            'density': 119.0,
+            'died': [0, 0, 1, 1, 1, 0]}), index=False)
+        _db.add_table(MODELS_ROC_TABLE, pd.DataFrame({
+            'model': ['Random', 'Random', 'Forest', 'Forest'],
+            'fpr': [0.0, 1.0, 0.0, 1.0],
+            'tpr': [0.0, 1.0, 0.8, 1.0],
+            'auc': [0.5, 0.5, 0.9, 0.9],
+            'logloss': [0.69, 0.69, 0.3, 0.3]}), index=False)
+        _db.add_table(IMPORTANCE_TABLE, pd.DataFrame({
+            'feature': ['age', 'gender'], 'importance': [0.8, 0.2]}), index=False)
+        _db.close()
+
+        for page in [bkapp_maps, bkapp_trends, bkapp_histograms, bkapp_models]:
+            for _ in range(2):
+                doc = PageDocument()
+                page(doc)
+                if not doc.populate() and page.__name__ not in failed:
+                    failed.append(page.__name__)
+
+    for page in failed:
+        print(f"PAGE FAILED: {page}")
+
+    return failed
+
+
 def  get_sockets():
     """bind to available socket in this system
 
@@ -364,6 +526,10 @@ def bk_worker(sockets, port):
 
 
 if __name__ == '__main__':
+
+    # unit testing
+    assert not utest_pages()
+
     BK_SOCKETS, BK_PORT = get_sockets()
 
     THREAD = Thread(target=bk_worker, args=[BK_SOCKETS, BK_PORT], daemon=True)
@@ -0,0 +1,142 @@
+"""
+    Memory budgeted cache of query results
+
+    DataBase(cache=True) reads tables through RESULT_CACHE. Results are
+    keyed by database file, so a new generation is read again and the
+    results of the old one are invalidated when it is retired.
+"""
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+import pandas as pd
+from config import CONFIG
+
+# memory budget of query result cache in MiB, see DataBase(cache=True)
+CACHE_MB = CONFIG.get('database.cache_mb', None) or 256
+
+
+def _freeze(frame):
+    """Make numeric numpy arrays of a dataframe read-only
+
+    Object arrays stay writeable, pandas < 2 compares them through
+    memoryviews that fail on read-only buffers, see ResultCache._share.
+    """
+    # pylint: disable=protected-access
+    _manager = getattr(frame, '_mgr', None)
+    if _manager is None:
+        _manager = frame._data
+    for _block in _manager.blocks:
+        if isinstance(_block.values, np.ndarray) and _block.values.dtype != object:
+            _block.values.flags.writeable = False
+    _index = frame.index.values
+    if isinstance(_index, np.ndarray) and _index.dtype != object:
+        _index.flags.writeable = False
+    return frame
+
+
+def _nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(_item) for _item in value)
+    return sum(_nbytes(_item) for _item in vars(value).values())
+
+
+class ResultCache:
+    """LRU cache of query results with a memory budget
+
+    Keys start with the database file, so a new generation never
+    hits results of the previous one. Numeric columns of cached
+    frames are read-only and shared, object columns are copied on each
+    hit, so callers can add, drop or reindex columns but not write
+    numeric values in place.
+
+        Example:
+        value = RESULT_CACHE.get(key)
+        if value is None:
+            value = RESULT_CACHE.put(key, read(query))
+    """
+    def __init__(self, budget_mb=CACHE_MB):
+        self.budget = int(budget_mb * 2**20)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    @staticmethod
+    def _share(value):
+        if isinstance(value, pd.DataFrame):
+            _copy = value.copy(deep=False)
+            for _column in _copy.columns[(_copy.dtypes == object).values]:
+                _copy[_column] = _copy[_column].copy()
+            return _copy
+        if isinstance(value, tuple):
+            return tuple(ResultCache._share(_item) for _item in value)
+        return value
+
+    def get(self, key):
+        """Return cached result or None
+
+        Arguments:
+            key {tuple} -- (database file, ...) hashable key
+
+        Returns:
+            object -- shallow copy of cached result
+        """
+        with self._lock:
+            _item = self._items.get(key)
+            if _item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        return self._share(_item[0])
+
+    def put(self, key, value):
+        """Cache result and evict least recently used results
+
+        Arguments:
+            key {tuple} -- (database file, ...) hashable key
+            value {object} -- DataFrame, GeoBuffers or tuple of them
+
+        Returns:
+            object -- shallow copy of cached result
+        """
+        for _item in value if isinstance(value, tuple) else [value]:
+            if isinstance(_item, pd.DataFrame):
+                _freeze(_item)
+            elif not isinstance(_item, np.ndarray):
+                for _array in vars(_item).values():
+                    _array.flags.writeable = False
+
+        _size = _nbytes(value)
+        if _size > self.budget:
+            return value
+
+        with self._lock:
+            _old = self._items.pop(key, None)
+            self.size -= _old[1] if _old else 0
+            while self._items and self.size + _size > self.budget:
+                _, (_, _evicted) = self._items.popitem(last=False)
+                self.size -= _evicted
+            self._items[key] = (value, _size)
+            self.size += _size
+        return self._share(value)
+
+    def invalidate(self, path):
+        """Drop cached results of a database file
+
+        Arguments:
+            path {String} -- database file
+        """
+        with self._lock:
+            for _key in [_key for _key in self._items if _key[0] == path]:
+                self.size -= self._items.pop(_key)[1]
+
+
+RESULT_CACHE = ResultCache()
@@ -8,7 +8,6 @@
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import (
@@ -24,12 +23,11 @@ from sklearn.pipeline import make_pipeline
 from sklearn import metrics
 
 from database import DataBase
-from sql import FLDEM_VIEW_TABLE
-
-
-# outputs
-MODELS_ROC_TABLE = 'models_roc'
-IMPORTANCE_TABLE = 'importance'
+from tables import (
+    FLDEM_FEATURES_TABLE,
+    MODELS_ROC_TABLE,
+    IMPORTANCE_TABLE
+)
 
 
 np.random.seed(10)
@@ -239,7 +237,7 @@ def classify():
         5) Random Forest
 
     Input from database:
-        FDEM_VIEW_TABLE {database table} -- fldem cleaned data
+        FLDEM_FEATURES_TABLE {database table} -- fldem features
 
     Output to database:
         MODELS_ROC_TABLE {database table} -- models' ROC, LogLoss and AUC
@@ -253,7 +251,7 @@ def classify():
     cols = ['died', 'age', 'population', 'land_area', 'water_area', 'gender',
             'density']
 
-    data = _db.get_table(FLDEM_VIEW_TABLE, columns=cols)
+    data = _db.get_table(FLDEM_FEATURES_TABLE, columns=cols)
     data.dropna(inplace=True)
     _db.close()
 
@@ -308,6 +306,8 @@ def classify():
 def utest_models():
     """Plot model results
     """
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
     _db = DataBase()
     data = _db.get_table(MODELS_ROC_TABLE)
     _db.close()
@@ -332,6 +332,8 @@ def utest_models():
 def utest_feature_importance():
     """Plot feature importance
     """
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
     _db = DataBase()
     data = _db.get_table(IMPORTANCE_TABLE)
     _db.close()
@@ -66,7 +66,7 @@ def load_config():
     Returns:
         dictionary -- dictionary with configuration values
     """
-    config_file = open(os.path.join(cwd(), "config.yaml"))
+    config_file = open(os.path.join(cwd(), "config.yaml"), encoding="utf-8")
     config = yaml.load(config_file, Loader=yaml.FullLoader)
     return config
 
@@ -115,7 +115,7 @@ def set_bokeh_port(port):
         port {int} -- bokeh port number
     """
     if CONFIG.environment == 'local':
-        with open(os.path.join(cwd(), ".env"), 'w') as env_file:
+        with open(os.path.join(cwd(), ".env"), 'w', encoding='utf-8') as env_file:
             env_file.write(str(port))
     elif CONFIG.environment == 'heroku':
         os.environ['BOKEH_PORT'] = str(port)
@@ -138,7 +138,7 @@ def get_bokeh_port():
         str -- bokeh port number
     """
     if CONFIG.environment == 'local':
-        with open(os.path.join(cwd(), ".env"), 'r') as env_file:
+        with open(os.path.join(cwd(), ".env"), 'r', encoding='utf-8') as env_file:
             port = env_file.read()
     elif CONFIG.environment == 'heroku':
         port = os.environ.get('BOKEH_PORT')
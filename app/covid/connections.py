@@ -0,0 +1,286 @@
+"""
+    SQLite connections of each thread
+
+    One connection per thread, database file and mode, with pragmas
+    from config.yaml. DataBase leases connections, so an old database
+    generation is closed once no DataBase of this process uses it.
+
+        Example:
+        conn = CONNECTIONS.acquire(path)
+        ...
+        CONNECTIONS.release(path)
+"""
+
+import os
+from collections import Counter
+from contextlib import contextmanager
+from urllib.request import pathname2url
+import threading
+import logging
+
+import sqlite3
+from config import CONFIG
+
+log = logging.getLogger(__name__)
+
+# connection pragmas, override in config.yaml under database.pragmas
+PRAGMAS = dict(journal_mode='WAL',
+               synchronous='NORMAL',
+               temp_store='MEMORY',
+               cache_size=-65536,       # KiB, negative means size not pages
+               mmap_size=268435456)
+PRAGMAS.update(CONFIG.get('database.pragmas', None) or {})
+
+# read-only connection pragmas, override under database.readonly_pragmas
+READONLY_PRAGMAS = dict(query_only=1,
+                        temp_store='MEMORY',
+                        cache_size=-65536,
+                        mmap_size=1073741824)
+READONLY_PRAGMAS.update(CONFIG.get('database.readonly_pragmas', None) or {})
+
+
+def readonly_uri(path, immutable=False):
+    """Return sqlite URI to open a database file read-only
+
+    Immutable files are opened without locks and change checks.
+
+    Arguments:
+        path {String} -- database file
+
+    Keyword Arguments:
+        immutable {bool} -- file is never written again (default: {False})
+
+    Returns:
+        String -- sqlite URI
+    """
+    _query = 'mode=ro&immutable=1' if immutable else 'mode=ro'
+    return f"file:{pathname2url(path)}?{_query}"
+
+
+class ConnectionManager:
+    """Keep one SQLite connection per thread and database file
+
+    Bokeh, Flask and refresh threads each get their own connection,
+    so no connection is shared across threads. Connections live for
+    the life of the thread and are reopened after a fork.
+
+    Leases count DataBase instances using each file in this process,
+    a retired file (old generation) is closed by each thread on its
+    next database access, or on release of its last lease on the file.
+
+    Read-only connections are kept apart from read-write ones. They
+    open immutable files, published generations (see generations.py),
+    as immutable, so sqlite takes no locks and reads pages through the
+    memory map. Read-write connections keep immutable files out of WAL
+    mode.
+
+        Examples:
+        conn = CONNECTIONS.connect(path)
+        with CONNECTIONS.cursor(path, readonly=True) as cursor:
+            cursor.execute(sql_query)
+    """
+    def __init__(self, pragmas=None, readonly_pragmas=None, immutable=None):
+        """Keep connection pragmas
+
+        Keyword Arguments:
+            pragmas {dict} -- read-write pragmas (default: {PRAGMAS})
+            readonly_pragmas {dict} -- read-only pragmas (default: {READONLY_PRAGMAS})
+            immutable {function} -- True for a database file never written
+                                    again (default: {no file})
+        """
+        self.pragmas = PRAGMAS if pragmas is None else pragmas
+        self.readonly_pragmas = READONLY_PRAGMAS if readonly_pragmas is None \
+                                else readonly_pragmas
+        self.immutable = immutable or (lambda path: False)
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._leases = Counter()
+        self._retired = set()
+
+    def _connections(self):
+        if self._pid != os.getpid():
+            # forked process: never reuse parent connections
+            self._local = threading.local()
+            self._pid = os.getpid()
+        if not hasattr(self._local, 'conns'):
+            self._local.conns = dict()
+            self._local.leases = Counter()
+        for _key in [_key for _key in self._local.conns if _key[0] in self._retired]:
+            if self._local.leases[_key[0]] > 0:
+                # still used by a DataBase of this thread, closed on release
+                continue
+            self._local.conns.pop(_key).close()
+            log.debug('retired connection closed: %s', _key[0])
+        return self._local.conns
+
+    def connect(self, path, readonly=False):
+        """Return this thread's connection to database file
+
+        Arguments:
+            path {String} -- database file
+
+        Keyword Arguments:
+            readonly {bool} -- read-only connection (default: {False})
+
+        Returns:
+            Connection -- sqlite3 connection
+        """
+        conns = self._connections()
+        conn = conns.get((path, readonly))
+        if conn is None:
+            if readonly:
+                conn = sqlite3.connect(readonly_uri(path, self.immutable(path)), uri=True)
+                pragmas = self.readonly_pragmas
+            else:
+                conn = sqlite3.connect(path)
+                pragmas = self.pragmas
+                if self.immutable(path):
+                    # immutable files stay in rollback journal mode, so
+                    # readers find every page in the database file
+                    pragmas = {_pragma: _value for _pragma, _value in pragmas.items()
+                               if _pragma != 'journal_mode'}
+            for pragma, value in pragmas.items():
+                conn.execute(f"PRAGMA {pragma} = {value};")
+            conns[(path, readonly)] = conn
+            log.debug('connection opened: %s', path)
+        return conn
+
+    def _transactions(self):
+        self._connections()
+        if not hasattr(self._local, 'transactions'):
+            self._local.transactions = Counter()
+        return self._local.transactions
+
+    def in_transaction(self, path):
+        """Return True if this thread writes database file in a transaction
+
+        Arguments:
+            path {String} -- database file
+
+        Returns:
+            bool -- commits are left to the outermost transaction
+        """
+        return self._transactions()[path] > 0
+
+    @contextmanager
+    def transaction(self, path):
+        """Commit all writes of this thread to database file at once
+
+        Cursors and DataBase.close do not commit inside, the outermost
+        transaction commits on success and rolls back on error. Tables
+        written by pandas to_sql are committed by pandas.
+
+        Arguments:
+            path {String} -- database file
+        """
+        conn = self.connect(path)
+        transactions = self._transactions()
+        transactions[path] += 1
+        try:
+            yield conn
+            if transactions[path] == 1:
+                conn.commit()
+        except Exception:
+            if transactions[path] == 1:
+                conn.rollback()
+            raise
+        finally:
+            transactions[path] -= 1
+
+    @contextmanager
+    def cursor(self, path, readonly=False):
+        """Yield a cursor, commit on success and rollback on error
+
+        Inside a transaction both are left to the transaction.
+
+        Arguments:
+            path {String} -- database file
+
+        Keyword Arguments:
+            readonly {bool} -- read-only connection (default: {False})
+        """
+        conn = self.connect(path, readonly)
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            if readonly or not self.in_transaction(path):
+                conn.commit()
+        except Exception:
+            if readonly or not self.in_transaction(path):
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def acquire(self, path, readonly=False):
+        """Lease database file and return this thread's connection
+
+        Arguments:
+            path {String} -- database file
+
+        Keyword Arguments:
+            readonly {bool} -- read-only connection (default: {False})
+
+        Returns:
+            Connection -- sqlite3 connection
+        """
+        with self._lock:
+            self._leases[path] += 1
+        self._connections()
+        self._local.leases[path] += 1
+        return self.connect(path, readonly)
+
+    def release(self, path):
+        """Release a lease taken with acquire
+
+        A retired file is closed by this thread once it holds no more
+        leases on it.
+
+        Arguments:
+            path {String} -- database file
+        """
+        with self._lock:
+            self._leases[path] -= 1
+            if self._leases[path] <= 0:
+                del self._leases[path]
+        self._connections()
+        self._local.leases[path] -= 1
+        if self._local.leases[path] <= 0:
+            del self._local.leases[path]
+            # closes connections of path if it is retired
+            self._connections()
+
+    def leased(self, path):
+        """Return True if database file is in use in this process
+
+        Arguments:
+            path {String} -- database file
+
+        Returns:
+            bool -- file has leases
+        """
+        with self._lock:
+            return self._leases[path] > 0
+
+    def retire(self, path):
+        """Mark database file as replaced by a newer generation
+
+        Arguments:
+            path {String} -- database file
+        """
+        with self._lock:
+            self._retired.add(path)
+
+    def close(self, path=None):
+        """Close this thread's connection(s)
+
+        Keyword Arguments:
+            path {String} -- database file, all if None (default: {None})
+        """
+        conns = self._connections()
+        for _key in [_key for _key in conns if path in (None, _key[0])]:
+            conns.pop(_key).close()
+
+
+CONNECTIONS = ConnectionManager()
@@ -1,21 +1,171 @@
 """App DataBase Interface
 """
 
-from os.path import join
+import os
+import time
+import struct
+from os.path import exists
 import logging
 
 import sqlite3
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely import wkb
-from utilities import cwd
+from geometry import decode
+from snapshot import (
+    snapshot_dir,
+    has_snapshot,
+    drop_snapshot,
+    write_snapshot,
+    read_snapshot
+)
+from config import CONFIG
+from connections import CONNECTIONS
+from cache import RESULT_CACHE
+from generations import (
+    current_path,
+    published_path,
+    generation_paths,
+    new_generation,
+    prune,
+    temporary_database
+)
+from tables import SCHEMAS
+from sql import (
+    INDEXES,
+    UNIQUE_INDEXES,
+    CREATE_INDEX,
+    CREATE_UNIQUE_INDEX,
+    DROP_INDEX,
+    EXPLAIN_QUERY_PLAN,
+    QUERY_PLAN_CHECKS,
+    COUNTIES_VIEW,
+    STATES_VIEW,
+    US_MAP_VIEW,
+    US_MAP_PIVOT_VIEW,
+    TABLE_EXISTS,
+    TABLE_COLUMNS,
+    INDEX_NAMES,
+    UPSERT,
+    DEDUPLICATE
+)
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
-DATABASE_PATH = join(cwd(), 'data', 'covid19.sqlite3')
 TRACING = True
 
+# rows per chunk of iter_table and chunked pipeline stages
+CHUNKSIZE = 100000
+
+# backend of open_database: 'sqlite' or 'duckdb' (optional, see analytics.py)
+ENGINE = CONFIG.get('database.engine', None) or 'sqlite'
+
+
+# pylint: disable=import-outside-toplevel
+# shapely is only needed by map refresh code
+
+def to_wkb(geometries):
+    """Encode shapely geometries as WKB blobs, in one call on shapely 2
+
+    Shapely 1.7 has no array functions, so geometries are encoded in a
+    python loop there, with one GEOS writer instead of one per geometry.
+
+    Arguments:
+        geometries {array} -- shapely geometries
+
+    Returns:
+        array -- WKB bytes
+    """
+    import shapely
+
+    if hasattr(shapely, 'to_wkb'):
+        return shapely.to_wkb(geometries)
+
+    from shapely.geos import WKBWriter, lgeos  # pylint: disable=no-name-in-module
+
+    _writer = WKBWriter(lgeos)
+    return np.array([_writer.write(_geom) for _geom in geometries], dtype=object)
+
+
+def from_wkb(values):
+    """Decode WKB blobs or hex WKB text into shapely geometries
+
+    Like to_wkb, a python loop with one GEOS reader on shapely 1.7.
+
+    Arguments:
+        values {array} -- WKB bytes or hex WKB text (older databases)
+
+    Returns:
+        array -- shapely geometries
+    """
+    import shapely
+
+    if hasattr(shapely, 'from_wkb'):
+        return shapely.from_wkb(values)
+
+    from shapely.geos import WKBReader, lgeos  # pylint: disable=no-name-in-module
+
+    _reader = WKBReader(lgeos)
+    return np.array([_reader.read_hex(_value) if isinstance(_value, str)
+                     else _reader.read(_value) for _value in values], dtype=object)
+
+
+def schema(name, parse_dates=None):
+    """Return date formats and dtypes of a table, see SCHEMAS
+
+    Arguments:
+        name {String} -- table name
+
+    Keyword Arguments:
+        parse_dates {list or dict} -- more date column(s) (default: {None})
+
+    Returns:
+        tuple -- {dict} date column: format, {dict} column: dtype
+    """
+    _schema = SCHEMAS.get(name, dict(dates=dict(), dtypes=dict()))
+    _dates = dict(_schema['dates'])
+    if isinstance(parse_dates, dict):
+        _dates.update(parse_dates)
+    elif parse_dates:
+        _dates.update({_col: _dates.get(_col) for _col in parse_dates})
+    return _dates, _schema['dtypes']
+
+
+def typed(data, dtypes):
+    """Cast columns to declared dtypes
+
+    Arguments:
+        data {DataFrame} -- table data
+        dtypes {dict} -- column: dtype name, missing columns are skipped
+
+    Returns:
+        DataFrame -- typed data
+    """
+    for _col, _dtype in dtypes.items():
+        if _col in data.columns and str(data[_col].dtype) != _dtype:
+            data[_col] = data[_col].astype(_dtype)
+    return data
+
+
+def records(data):
+    """Return dataframe rows as tuples of python values for sqlite
+
+    Arguments:
+        data {DataFrame} -- table data
+
+    Returns:
+        iterator -- row tuples, missing values as None and dates as text
+    """
+    _columns = []
+    for _col in data.columns:
+        _values = data[_col]
+        if pd.api.types.is_datetime64_any_dtype(_values):
+            _values = _values.dt.strftime('%Y-%m-%d %H:%M:%S')
+        _values = _values.astype(object).where(_values.notna(), None)
+        _columns.append(_values.tolist())
+    return zip(*_columns)
+
+
 class DataBase:
     """Interface with sqlite database
 
@@ -26,27 +176,62 @@ class DataBase:
         gdf = gpd.read_file(path_to_shapes)
         database.add_geotable(table_name, gdf)
         gdf = database.get_geotable(table_name)
+        df, geo = database.get_geometry(table_name)
         database.close()
+
+        Serving code reads through the result cache, read-only:
+        database = DataBase(cache=True, readonly=True)
+        df = database.get_table(table_name)  # read-only arrays
         """
-    def __init__(self, path=DATABASE_PATH):
+    def __init__(self, path=None, cache=False, readonly=False):
         """Connect to SQLite database
 
         Keyword Arguments:
-            path {String} -- database file (default: {DATABASE_PATH})
+            path {String} -- database file (default: {current_path()})
+            cache {bool} -- read tables through RESULT_CACHE (default: {False})
+            readonly {bool} -- read-only connection, see connections.py (default: {False})
         """
-        self.conn = sqlite3.connect(path)
+        self.path = path or current_path()
+        self.readonly = readonly
+        self.conn = CONNECTIONS.acquire(self.path, readonly)
+        self.cache = cache
 
         log.debug('database connection started')
 
+    def cursor(self):
+        """Return a cursor context manager on this thread's connection
+
+        Returns:
+            contextmanager -- yields sqlite3 cursor, commits on exit
+        """
+        return CONNECTIONS.cursor(self.path, self.readonly)
+
+    def transaction(self):
+        """Return a context manager writing this thread's changes at once
+
+            Example:
+            with database.transaction():
+                database.upsert_table(name, first, keys)
+                database.upsert_table(name, second, keys)
+
+        Returns:
+            contextmanager -- commits on exit, see ConnectionManager.transaction
+        """
+        return CONNECTIONS.transaction(self.path)
+
+    def _cache_key(self, kind, name, *options):
+        return (self.path, kind, name) + tuple(repr(_option) for _option in options)
+
     def update(self, sql_query):
         """Update database
 
         Arguments:
             sql_query {String} -- SQL query
         """
-        cursor = self.conn.cursor()
-        cursor.execute(sql_query + ';')
-        self.conn.commit()
+        with self.cursor() as cursor:
+            cursor.execute(sql_query + ';')
+        drop_snapshot(self.path)
+        RESULT_CACHE.invalidate(self.path)
 
         log.debug('update executed')
 
@@ -59,9 +244,9 @@ class DataBase:
         Returns:
             list -- datbase records
         """
-        cursor = self.conn.cursor()
-        cursor.execute(sql_query + ';')
-        return cursor.fetchall()
+        with self.cursor() as cursor:
+            cursor.execute(sql_query + ';')
+            return cursor.fetchall()
 
     def add_table(self, name, data, index=True):
         """Add a pandas table to database
@@ -72,9 +257,187 @@ class DataBase:
             index {bool} -- add index to table (default: {True})
         """
         data.to_sql(name, con=self.conn, if_exists='replace', index=index)
+        self.create_indexes(name)
+        drop_snapshot(self.path, name)
+        RESULT_CACHE.invalidate(self.path)
 
         log.debug('table: %s added', name)
 
+    def create_indexes(self, name):
+        """(Re)build declared indexes of a table
+
+        Arguments:
+            name {String} -- table name
+        """
+        with self.cursor() as cursor:
+            for _index, _columns in INDEXES.get(name, []):
+                cursor.execute(DROP_INDEX.format(name=_index))
+                cursor.execute(CREATE_INDEX.format(name=_index, table=name,
+                                                   columns=', '.join(_columns)))
+            for _index, _columns in UNIQUE_INDEXES.get(name, []):
+                cursor.execute(CREATE_UNIQUE_INDEX.format(name=_index, table=name,
+                                                          columns=', '.join(_columns)))
+
+        log.debug('indexes: %s created', name)
+
+    def has_table(self, name):
+        """Return True if table exists
+
+        Arguments:
+            name {String} -- table name
+
+        Returns:
+            bool -- table exists
+        """
+        return bool(self.fetch(TABLE_EXISTS.format(name=name)))
+
+    def table_columns(self, name):
+        """Return column names of a table
+
+        Arguments:
+            name {String} -- table name
+
+        Returns:
+            list -- column names, empty if table does not exist
+        """
+        return [_row[1] for _row in self.fetch(TABLE_COLUMNS.format(name=name))]
+
+    def add_chunks(self, name, chunks, index=True, keys=None):
+        """Replace a table with dataframe chunks, one chunk in memory
+
+        Arguments:
+            name {String} -- table name
+            chunks {iterable} -- DataFrame chunks with same columns
+
+        Keyword Arguments:
+            index {bool} -- add index to table (default: {True})
+            keys {list} -- unique key, last row of a key is kept (default: {None})
+
+        Returns:
+            int -- number of rows written
+        """
+        rows = 0
+        for _chunk in chunks:
+            _chunk.to_sql(name, con=self.conn, index=index,
+                          if_exists='append' if rows else 'replace')
+            rows += len(_chunk)
+
+        if keys:
+            with self.cursor() as cursor:
+                cursor.execute(DEDUPLICATE.format(table=name, keys=', '.join(keys)))
+        self.create_indexes(name)
+        drop_snapshot(self.path, name)
+        RESULT_CACHE.invalidate(self.path)
+
+        log.debug('table: %s added in chunks', name)
+
+        return rows
+
+    def upsert_table(self, name, data, keys, compare=None, statements=None,
+                     where=None):
+        """Insert new rows and update changed rows in one transaction
+
+        Rows are compared with the stored table first, so unchanged
+        rows are never written. The table needs a unique index on keys
+        (see UNIQUE_INDEXES), a missing table is created from data.
+
+        Arguments:
+            name {String} -- table name
+            data {DataFrame} -- table data with keys as columns
+            keys {list} -- column names of unique key
+
+        Keyword Arguments:
+            compare {list} -- columns to compare (default: {all but keys})
+            statements {list} -- SQL run first in same transaction (default: {None})
+            where {String} -- SQL filter of stored rows to compare (default: {None})
+
+        Returns:
+            int -- number of rows inserted or updated
+        """
+        if not self.has_table(name):
+            self.add_table(name, data, index=False)
+            return len(data)
+
+        compare = compare or [_col for _col in data.columns if _col not in keys]
+        _dates = [_col for _col in keys + compare
+                  if pd.api.types.is_datetime64_any_dtype(data[_col])]
+
+        _where = f" where {where}" if where else ''
+        _stored = pd.read_sql_query(sql=f"select {', '.join(keys + compare)} from {name}{_where};",
+                                    con=self.conn, parse_dates=_dates)
+        _merged = data[keys + compare].merge(_stored, on=keys, how='left',
+                                             suffixes=('', '_stored'), indicator=True)
+
+        _write = (_merged['_merge'] == 'left_only').to_numpy()
+        for _col in compare:
+            _new, _old = _merged[_col], _merged[_col + '_stored']
+            # nullable integers compare to NA where either value is missing
+            _missing_new, _missing_old = pd.isna(_new).to_numpy(), pd.isna(_old).to_numpy()
+            _differ = (_new != _old).astype(object).where(~(_missing_new | _missing_old), False)
+            _write = _write | _differ.to_numpy(dtype=bool) | (_missing_new != _missing_old)
+        _rows = data[_write]
+
+        _columns = list(_rows.columns)
+        _query = UPSERT.format(table=name,
+                               columns=', '.join(_columns),
+                               values=', '.join(['?'] * len(_columns)),
+                               keys=', '.join(keys),
+                               updates=', '.join(f"{_col} = excluded.{_col}"
+                                                 for _col in _columns if _col not in keys))
+
+        with self.cursor() as cursor:
+            for _index, _cols in UNIQUE_INDEXES.get(name, []):
+                cursor.execute(CREATE_UNIQUE_INDEX.format(name=_index, table=name,
+                                                          columns=', '.join(_cols)))
+            for _statement in statements or []:
+                cursor.execute(_statement)
+            cursor.executemany(_query, records(_rows))
+        drop_snapshot(self.path, name)
+        RESULT_CACHE.invalidate(self.path)
+
+        log.debug('table: %s upserted %s rows', name, len(_rows))
+
+        return len(_rows)
+
+    def explain(self, sql_query):
+        """Return query plan
+
+        Arguments:
+            sql_query {String} -- SQL query
+
+        Returns:
+            list -- query plan details
+        """
+        with self.cursor() as cursor:
+            cursor.execute(EXPLAIN_QUERY_PLAN.format(query=sql_query))
+            return [_row[-1] for _row in cursor.fetchall()]
+
+    def full_scans(self, sql_query):
+        """Return full table scans in query plan
+
+        Arguments:
+            sql_query {String} -- SQL query
+
+        Returns:
+            list -- query plan details that scan a table or build an
+                    automatic index on it
+        """
+        _plan = self.explain(sql_query)
+
+        # views and subqueries evaluated as co-routines or materialized
+        _derived = {_detail.split()[-1] for _detail in _plan
+                    if _detail.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+
+        _scans = []
+        for _detail in _plan:
+            _words = _detail.replace('SCAN TABLE ', 'SCAN ').split()
+            if _words[0] == 'SCAN' and _words[1] not in _derived | {'SUBQUERY'}:
+                _scans.append(_detail)
+            elif ' AUTOMATIC ' in _detail:
+                # sqlite scans the table to build a temporary index
+                _scans.append(_detail)
+        return _scans
+
     def add_geotable(self, name, geodata, index=True):
         """Add a geopandas table to database
 
@@ -83,15 +446,35 @@ class DataBase:
             data {GeoDataFrame} -- table data
             index {bool} -- add index to table (default: {True})
         """
-        _geo = geodata.copy(deep=True)
-        _geo['geometry'] = _geo['geometry'].apply(lambda x: x.wkb_hex)
+        _geo = pd.DataFrame(geodata.drop(columns='geometry'))
+        _geo['geometry'] = to_wkb(geodata['geometry'].values)
         _geo.to_sql(name, con=self.conn, if_exists='replace', index=index)
+        self.create_indexes(name)
+        drop_snapshot(self.path, name)
+        RESULT_CACHE.invalidate(self.path)
 
         log.debug('geotable: %s added', name)
 
+    def snapshot_table(self, name):
+        """Write columnar snapshot of a table, see snapshot.py
+
+        Columns are written typed as declared in SCHEMAS, so reads
+        memory-map them as they are. Snapshots are removed whenever the
+        table is written again.
+
+        Arguments:
+            name {String} -- table name
+        """
+        write_snapshot(self.path, name, self._read(name, None, None, None,
+                                                   snapshot=False))
+
+        log.debug('table: %s snapshot written', name)
+
     def get_table(self, name, index_col=None, parse_dates=None, columns=None):
         """Return dataframe from database
 
+        Tables with a columnar snapshot are memory-mapped from it.
+
         Arguments:
             name {String} -- table name
             columns {list} -- column name(s) to read from table (default: {None})
@@ -99,21 +482,84 @@ class DataBase:
             parse_dates {list or dict} -- column name(s) (default: {None})
 
         Returns:
-            {DataFrame} -- table data
+            {DataFrame} -- table data typed as declared in SCHEMAS
         """
-        if columns:
-            _cols = ', '.join(columns)
-        else:
-            _cols = '*'
+        if self.cache:
+            _key = self._cache_key('table', name, index_col, parse_dates, columns)
+            _cached = RESULT_CACHE.get(_key)
+            if _cached is not None:
+                log.debug('table: %s returned from cache', name)
+                return _cached
 
-        _query = pd.read_sql_query(sql=f"select {_cols} from {name};",
-                                   con=self.conn,
-                                   index_col=index_col,
-                                   parse_dates=parse_dates)
+        _data = self._read(name, index_col, parse_dates, columns)
 
         log.debug('table: %s returned', name)
 
-        return pd.DataFrame(_query)
+        if self.cache:
+            return RESULT_CACHE.put(_key, _data)
+        return _data
+
+    def iter_table(self, name, columns=None, parse_dates=None, where=None,
+                   chunksize=CHUNKSIZE):
+        """Yield table in typed chunks, see SCHEMAS
+
+        Chunks are read on a separate connection, so this thread can
+        write other tables while iterating.
+
+            Example:
+            for chunk in database.iter_table(US_COUNTIES_TABLE, columns=cols):
+                ...
+
+        Arguments:
+            name {String} -- table name
+
+        Keyword Arguments:
+            columns {list} -- column name(s) to read from table (default: {None})
+            parse_dates {list or dict} -- column name(s) (default: {None})
+            where {String} -- SQL filter (default: {None})
+            chunksize {int} -- rows per chunk (default: {CHUNKSIZE})
+
+        Yields:
+            DataFrame -- table chunk
+        """
+        _dates, _dtypes = schema(name, parse_dates)
+        _cols = ', '.join(columns) if columns else '*'
+        _where = f" where {where}" if where else ''
+
+        _conn = sqlite3.connect(self.path)
+        try:
+            for _chunk in pd.read_sql_query(sql=f"select {_cols} from {name}{_where};",
+                                            con=_conn,
+                                            parse_dates=_dates,
+                                            chunksize=chunksize):
+                yield typed(_chunk, _dtypes)
+        finally:
+            _conn.close()
+
+    def _read(self, name, index_col, parse_dates, columns, snapshot=True):
+        _dates, _dtypes = schema(name, parse_dates)
+
+        if snapshot and has_snapshot(self.path, name):
+            log.debug('table: %s read from %s', name, snapshot_dir(self.path))
+            _data = read_snapshot(self.path, name, columns=columns,
+                                  parse_dates=_dates, dtypes=_dtypes)
+        else:
+            if columns:
+                _cols = ', '.join(columns)
+            else:
+                _cols = '*'
+
+            _data = pd.read_sql_query(sql=f"select {_cols} from {name};",
+                                      con=self.conn,
+                                      parse_dates=_dates)
+
+        # no-op on snapshots, written typed
+        _data = typed(_data, _dtypes)
+
+        if index_col is not None:
+            # in place, a copy would read every memory-mapped column
+            _data.set_index(index_col, inplace=True)
+        return pd.DataFrame(_data)
 
     def get_geotable(self, name, index_col=None, parse_dates=None, columns=None):
         """Return geodataframe from database
@@ -127,16 +573,331 @@ class DataBase:
         Returns:
             {GeoDataFrame} -- table data
         """
+        # pylint: disable=import-outside-toplevel
+        # geopandas is only needed by map refresh code
+        import geopandas as gpd
+
         _geo = self.get_table(name, index_col=index_col,
                               parse_dates=parse_dates, columns=columns)
-        _geo['geometry'] = _geo['geometry'].apply(lambda x: wkb.loads(x, hex=True))
+        _geo['geometry'] = from_wkb(_geo['geometry'].values)
 
         log.debug('geotable: %s returned', name)
         return gpd.GeoDataFrame(_geo)
 
-    def close(self):
-        """Close database connection
+    def get_geometry(self, name, index_col=None, parse_dates=None, columns=None):
+        """Return dataframe and decoded geometry without geopandas
+
+        Arguments:
+            name {String} -- table name
+            columns {list} -- column name(s) to read from table (default: {None})
+            index_col {String or list} -- column name(s) (default: {None})
+            parse_dates {list or dict} -- column name(s) (default: {None})
+
+        Returns:
+            tuple -- {DataFrame} table data without geometry,
+                     {GeoBuffers} flat coordinate buffers
         """
-        self.conn.close()
+        if self.cache:
+            _key = self._cache_key('geometry', name, index_col, parse_dates, columns)
+            _cached = RESULT_CACHE.get(_key)
+            if _cached is not None:
+                log.debug('geometry: %s returned from cache', name)
+                return _cached
+
+        _data = self._read(name, index_col, parse_dates, columns)
+        _geometry = decode(_data.pop('geometry'))
+
+        log.debug('geometry: %s returned', name)
 
-        log.debug('database connection closed')
+        if self.cache:
+            return RESULT_CACHE.put(_key, (_data, _geometry))
+        return _data, _geometry
+
+    def close(self):
+        """Release database connection
+
+        The connection stays open for reuse by this thread, only
+        pending changes are committed, unless in a transaction, and
+        the lease is released.
+        """
+        if self.conn is None:
+            return
+        if not CONNECTIONS.in_transaction(self.path):
+            self.conn.commit()
+        self.conn = None
+        CONNECTIONS.release(self.path)
+
+        log.debug('database connection released')
+
+
+def open_database(engine=None, **kwargs):
+    """Return a database of the selected backend
+
+    Both backends have the same update, fetch, add_table, has_table,
+    get_table and close methods, so analytical code can run on either.
+
+    Keyword Arguments:
+        engine {String} -- 'sqlite' or 'duckdb' (default: {ENGINE})
+        kwargs -- DataBase or DuckDataBase arguments
+
+    Returns:
+        DataBase or DuckDataBase -- open database
+    """
+    engine = engine or ENGINE
+    if engine == 'sqlite':
+        return DataBase(**kwargs)
+    if engine == 'duckdb':
+        # pylint: disable=import-outside-toplevel
+        from analytics import DuckDataBase
+        return DuckDataBase(**kwargs)
+    raise ValueError(f"unknown database engine: {engine}")
+
+
+def square_wkb(x, y, size):
+    """Return WKB of a square polygon, for sample geometry
+
+    Arguments:
+        x {float} -- lower left x
+        y {float} -- lower left y
+        size {float} -- side length
+
+    Returns:
+        bytes -- little endian WKB polygon
+    """
+    _points = [(x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)]
+    return struct.pack('<BIII', 1, 3, 1, len(_points)) + \
+        b''.join(struct.pack('<dd', *_point) for _point in _points)
+
+
+def sample_tables(days=20):
+    """Build small map and NY Times tables with their views, for unit tests
+
+    Keyword Arguments:
+        days {int} -- reported days (default: {20})
+    """
+    _dates = pd.date_range('2020-03-01', periods=days, freq='D')
+    _counties = pd.DataFrame({'county_id': ['01001', '01003', '12001', '34001', '36001'],
+                              'state_id': ['01', '01', '12', '34', '36'],
+                              'name': ['Autauga', 'Baldwin', 'Alachua', 'Atlantic', 'Albany'],
+                              'geometry': [square_wkb(0, 0, 1), square_wkb(1, 0, 1),
+                                           square_wkb(3, 0, 1), square_wkb(6, 0, 1),
+                                           square_wkb(9, 0, 1)],
+                              'pop': [55869, 223234, 269043, 263670, 305506],
+                              'aland': [1539, 4118, 2266, 1438, 1354],
+                              'awater': [25, 1133, 242, 301, 28]})
+    _states = pd.DataFrame({'state_id': ['01', '12', '34', '36'],
+                            'name': ['Alabama', 'Florida', 'New Jersey', 'New York'],
+                            'abbr': ['AL', 'FL', 'NJ', 'NY'],
+                            'pop': [4903185, 21477737, 8882190, 19453561],
+                            'geometry': [square_wkb(0, 0, 2), square_wkb(3, 0, 2),
+                                         square_wkb(6, 0, 2), square_wkb(9, 0, 2)]})
+
+    _rows = pd.DataFrame({'county_id': np.repeat(_counties['county_id'].values, days),
+                          'state_id': np.repeat(_counties['state_id'].values, days),
+                          'date': np.tile(_dates.values, len(_counties))})
+    # days since nytimes.DAY_EPOCH
+    _rows['day'] = (_rows['date'] - pd.Timestamp('2020-01-01')).dt.days
+    _rows['cases'] = _rows['day'] - _rows['day'].min()
+    _rows['deaths'] = _rows['cases'] // 10
+    _rows['case_level'] = 1
+
+    _totals = _rows.groupby(['state_id', 'date'], as_index=False)[['cases', 'deaths']].sum()
+    _totals['new_cases'] = _totals.groupby('state_id')['cases'].diff().fillna(0)
+    _totals['new_deaths'] = _totals.groupby('state_id')['deaths'].diff().fillna(0)
+
+    _db = DataBase()
+    _db.add_table('us_map', _counties.set_index('county_id'))
+    _db.add_table('state_map', _states.set_index('state_id'))
+    _db.add_table('nytimes_counties', _rows, index=False)
+    _db.add_table('nytimes_states', _totals, index=False)
+    for _view in [COUNTIES_VIEW, STATES_VIEW, US_MAP_VIEW, US_MAP_PIVOT_VIEW]:
+        _db.update(_view)
+    _db.close()
+
+
+def utest_query_plans(path=None):
+    """Check hot queries use their indexes and no more full scans than driving tables
+
+    Every declared index must exist and be used by a hot query plan.
+
+    Keyword Arguments:
+        path {String} -- database file to check, None checks tables
+                         built by sample_tables in a temporary
+                         database (default: {None})
+
+    Returns:
+        list -- (query or index, problems) of failed checks
+    """
+    if path is None:
+        with temporary_database():
+            sample_tables()
+            return utest_query_plans(current_path())
+
+    _db = DataBase(path)
+    failed = []
+    _plans = []
+    for _query, _allowed, _uses in QUERY_PLAN_CHECKS:
+        _plan = _db.explain(_query)
+        _plans += _plan
+        _scans = _db.full_scans(_query)
+        _missing = [f"no {_use}" for _use in _uses
+                    if not any(_use in _detail for _detail in _plan)]
+        if len(_scans) > _allowed or _missing:
+            failed.append((_query, _scans + _missing))
+
+    _stored = {_row[0] for _row in _db.fetch(INDEX_NAMES)}
+    _db.close()
+
+    for _indexes in INDEXES.values():
+        for _index, _ in _indexes:
+            if _index not in _stored:
+                failed.append((_index, ['missing']))
+            elif not any(_detail.endswith(f" INDEX {_index}") or f" INDEX {_index} " in _detail
+                         for _detail in _plans):
+                failed.append((_index, ['not used by any hot query']))
+
+    for _query, _problems in failed:
+        print(f"QUERY PLAN: {_query}: {_problems}")
+
+    return failed
+
+
+def utest_retire():
+    """Test a retired file stays open while this thread leases it
+
+    Returns:
+        bool -- True if test failed
+    """
+    # pylint: disable=protected-access
+    failed = False
+    with temporary_database() as path:
+        _db = DataBase()
+        _db.add_table('utest', pd.DataFrame({'value': [1]}), index=False)
+        CONNECTIONS.retire(path)
+
+        _other = DataBase(path)
+        failed |= _other.fetch('SELECT value FROM utest') != [(1,)]
+        _other.close()
+        failed |= _db.fetch('SELECT value FROM utest') != [(1,)]
+        _db.close()
+
+        # closed on release of the last lease
+        failed |= any(_key[0] == path for _key in CONNECTIONS._connections())
+        CONNECTIONS._retired.discard(path)
+
+    return failed
+
+
+def utest_prune():
+    """Test old generations and the legacy file wait min age, in a temporary database
+
+    Returns:
+        bool -- True if test failed
+    """
+    def _generation(value):
+        with new_generation():
+            _db = DataBase()
+            _db.add_table('utest', pd.DataFrame({'value': [value]}), index=False)
+            _db.close()
+
+    def _age(path, seconds):
+        _time = time.time() - seconds
+        os.utime(path, (_time, _time))
+
+    failed = False
+    with temporary_database() as legacy:
+        _db = DataBase()
+        _db.add_table('utest', pd.DataFrame({'value': [0]}), index=False)
+        _db.close()
+        failed |= prune(min_age=0) != []
+
+        # legacy file replaced by first published generation
+        _generation(1)
+        _generation(2)
+        _generation(3)
+        first, second, third = generation_paths()
+        failed |= prune() != []
+        failed |= not exists(legacy)
+
+        _age(first, 3600)
+        failed |= prune() != [legacy]
+
+        _age(second, 3600)
+        _age(third, 3600)
+        failed |= prune() != [first]
+        failed |= generation_paths() != [second, third]
+        failed |= published_path() != third
+
+        # reads of other threads never switch it back to WAL
+        _db = DataBase()
+        _db.has_table('utest')
+        _db.close()
+        _conn = sqlite3.connect(third)
+        failed |= _conn.execute('PRAGMA journal_mode').fetchone()[0] != 'delete'
+        _conn.close()
+        failed |= exists(third + '-wal')
+
+    return failed
+
+
+def utest_upsert():
+    """Test upserts write rows whose nullable integers change to or from NA
+
+    Returns:
+        bool -- True if test failed
+    """
+    data = pd.DataFrame({'key': [1, 2, 3], 'day': pd.array([1, None, 3], dtype='Int32')})
+    update = pd.DataFrame({'key': [1, 2, 3, 4],
+                           'day': pd.array([None, None, 4, 5], dtype='Int32')})
+
+    failed = False
+    with temporary_database():
+        _db = DataBase()
+        _db.add_table('utest', data, index=False)
+        _db.update(CREATE_UNIQUE_INDEX.format(name='ix_utest_key', table='utest',
+                                              columns='key'))
+        failed |= _db.upsert_table('utest', update, ['key']) != 3
+        failed |= _db.fetch('SELECT key, day FROM utest ORDER BY key') != \
+            [(1, None), (2, None), (3, 4), (4, 5)]
+        failed |= _db.upsert_table('utest', update, ['key']) != 0
+        _db.close()
+
+    return failed
+
+
+def utest_snapshot():
+    """Test snapshot reads equal sqlite reads and keep columns memory-mapped
+
+    Returns:
+        bool -- True if test failed
+    """
+    def _mapped(values):
+        while values is not None and not isinstance(values, np.memmap):
+            values = values.base
+        return values is not None
+
+    failed = False
+    with temporary_database():
+        sample_tables()
+        _db = DataBase()
+        stored = _db.get_table('nytimes_counties', index_col='county_id')
+        _db.snapshot_table('nytimes_counties')
+        data = _db.get_table('nytimes_counties', index_col='county_id')
+        _db.close()
+
+        for _col in ['date', 'day', 'cases', 'deaths', 'case_level']:
+            failed |= not _mapped(data[_col].values)
+        # after, pandas < 1.3 consolidates blocks to compare them
+        failed |= not stored.equals(data)
+
+    return failed
+
+
+if __name__ == "__main__":
+
+    # unit test
+    assert not utest_query_plans()
+    assert not utest_retire()
+    assert not utest_prune()
+    assert not utest_snapshot()
+    assert not utest_upsert()
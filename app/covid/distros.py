@@ -14,7 +14,7 @@ from utilities import (
     vbar
 )
 from database import DataBase
-from sql import FLDEM_VIEW_TABLE
+from tables import FLDEM_FEATURES_TABLE
 
 
 THEME = join(cwd(), "theme.yaml")
@@ -132,7 +132,7 @@ if __name__[:9] == 'bokeh_app':
 
     # dataset for models)
     database = DataBase()
-    data_in = database.get_table(FLDEM_VIEW_TABLE)
+    data_in = database.get_table(FLDEM_FEATURES_TABLE)
     database.close()
 
     curdoc().add_root(age_gender_histograms(data_in, palette_in[2], palette_in[4]))
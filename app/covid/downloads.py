@@ -0,0 +1,304 @@
+"""
+    Conditional downloads of source files
+
+    ETag and Last-Modified validators of each url are kept in the
+    downloads table and sent back as If-None-Match and
+    If-Modified-Since. A 304 response means the file has not changed,
+    so it is neither downloaded nor processed again. Jobs, sources
+    whose url is found by a first request, get the stored validators
+    to send with their file request.
+
+    All sources are fetched at once with aiohttp, each with its own
+    timeout and retries. A source is parsed in a worker thread as
+    soon as it arrives, while the others are still downloading.
+
+        Example:
+        files = fetch([URL_COUNTIES, URL_STATES], parsers={URL_STATES: parse})
+        if not changed(files):
+            return
+        states = files[URL_STATES].parsed
+        ...
+        save_validators(files)
+"""
+
+import asyncio
+import threading
+from datetime import datetime
+from functools import partial
+from collections import namedtuple
+
+import pandas as pd
+import aiohttp
+
+from database import DataBase
+from generations import temporary_database
+from tables import DOWNLOADS_TABLE
+
+# seconds to wait for the server
+TIMEOUT = 60
+
+# attempts after a failed request, waiting BACKOFF * 2 ** attempt seconds
+RETRIES = 3
+BACKOFF = 1.0
+
+# content is None if file is unchanged, parsed is set by fetch parsers
+Download = namedtuple('Download', ['url', 'content', 'etag', 'last_modified', 'parsed'],
+                      defaults=[None])
+
+
+def validators(urls=None):
+    """Return stored validators of urls
+
+    Keyword Arguments:
+        urls {list} -- file urls, None for all stored urls (default: {None})
+
+    Returns:
+        dict -- url: (etag, last_modified), missing urls are not included
+    """
+    _db = DataBase()
+    if not _db.has_table(DOWNLOADS_TABLE):
+        _db.close()
+        return dict()
+    data = _db.get_table(DOWNLOADS_TABLE)
+    _db.close()
+
+    if urls is not None:
+        data = data[data['url'].isin(urls)]
+    data = data.astype(object).where(data.notna(), None)
+    return {_url: (_etag, _modified) for _url, _etag, _modified
+            in zip(data['url'], data['etag'], data['last_modified'])}
+
+
+def _headers(etag, last_modified):
+    headers = dict()
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+async def get_async(session, url, etag=None, last_modified=None, timeout=TIMEOUT,
+                    retries=RETRIES):
+    """Download url unless it matches the validators, retry on failure
+
+    Connection errors, timeouts and server errors (5xx) are retried,
+    client errors (4xx) are raised at once.
+
+    Arguments:
+        session {aiohttp.ClientSession} -- http session
+        url {String} -- file url
+
+    Keyword Arguments:
+        etag {String} -- stored ETag (default: {None})
+        last_modified {String} -- stored Last-Modified (default: {None})
+        timeout {float} -- seconds per attempt (default: {TIMEOUT})
+        retries {int} -- attempts after a failure (default: {RETRIES})
+
+    Returns:
+        Download -- content is None if the file has not changed
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url, headers=_headers(etag, last_modified),
+                                   timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status == 304:
+                    return Download(url, None, etag, last_modified)
+                response.raise_for_status()
+                return Download(url, await response.read(),
+                                response.headers.get('ETag'),
+                                response.headers.get('Last-Modified'))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            if attempt == retries or \
+               (isinstance(error, aiohttp.ClientResponseError) and error.status < 500):
+                raise
+            print(f'retrying {url}: {type(error).__name__} {error}')
+            await asyncio.sleep(BACKOFF * 2 ** attempt)
+    return None
+
+
+async def _fetch(sources, parsers):
+    _loop = asyncio.get_event_loop()
+
+    async def _source(name, get):
+        _file = await get(session)
+        _parse = parsers.get(name)
+        if _parse is not None and _file.content is not None:
+            # parse in a worker thread while other sources download
+            _file = _file._replace(parsed=await _loop.run_in_executor(None, _parse,
+                                                                      _file.content))
+        return name, _file
+
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*[_source(_name, _get)
+                                         for _name, _get in sources.items()])
+    return dict(results)
+
+
+def fetch(urls, parsers=None, jobs=None, timeout=TIMEOUT, retries=RETRIES, validate=True):
+    """Conditional download of urls at once, with their stored validators
+
+    Parsers must not use the database, they run in worker threads.
+
+    Arguments:
+        urls {list} -- file urls
+
+    Keyword Arguments:
+        parsers {dict} -- url or job name: function of content (default: {None})
+        jobs {dict} -- name: coroutine function(session, timeout, retries,
+                       validators) returning a Download, for sources needing
+                       more than one request, validators are all stored
+                       url: (etag, last_modified) (default: {None})
+        timeout {float or dict} -- seconds per attempt, or by url or job name
+                                   (default: {TIMEOUT})
+        retries {int} -- attempts after a failure (default: {RETRIES})
+        validate {bool} -- send stored validators, False downloads every url
+                           (default: {True})
+
+    Returns:
+        dict -- url or job name: Download
+    """
+    def _timeout(name):
+        if isinstance(timeout, dict):
+            return timeout.get(name, TIMEOUT)
+        return timeout
+
+    _stored = validators() if validate else dict()
+    sources = dict()
+    for _url in urls:
+        _etag, _modified = _stored.get(_url, (None, None))
+        sources[_url] = partial(get_async, url=_url, etag=_etag, last_modified=_modified,
+                                timeout=_timeout(_url), retries=retries)
+    for _name, _job in (jobs or dict()).items():
+        sources[_name] = partial(_job, timeout=_timeout(_name), retries=retries,
+                                 validators=_stored)
+
+    return asyncio.run(_fetch(sources, parsers or dict()))
+
+
+def changed(files):
+    """Return True if any file was downloaded
+
+    Arguments:
+        files {dict} -- url: Download, see fetch
+
+    Returns:
+        bool -- some file changed
+    """
+    return any(_file.content is not None for _file in files.values())
+
+
+def save_validators(files):
+    """Store validators of downloaded files
+
+    Call after the files are loaded, so a failed load is retried.
+
+    Arguments:
+        files {dict} -- url: Download, see fetch
+    """
+    _files = [_file for _file in files.values() if _file.content is not None]
+    if not _files:
+        return
+
+    data = pd.DataFrame({'url': [_file.url for _file in _files],
+                         'etag': [_file.etag for _file in _files],
+                         'last_modified': [_file.last_modified for _file in _files],
+                         'downloaded': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')})
+
+    _db = DataBase()
+    _db.upsert_table(DOWNLOADS_TABLE, data, ['url'], compare=['etag', 'last_modified'])
+    _db.close()
+
+
+def utest_conditional_get():
+    """Test conditional downloads and jobs against a local http server
+
+    Returns:
+        bool -- True if test failed
+    """
+    # pylint: disable=import-outside-toplevel
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serve one csv file with ETag and Last-Modified validators
+        """
+        body = b'date,county,state,fips,cases,deaths\n'
+        etag = '"v1"'
+        last_modified = 'Mon, 01 Jun 2020 00:00:00 GMT'
+        failures = 1
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Return 304 if validators match, fail first /flaky request
+            """
+            if self.path == '/flaky' and Handler.failures:
+                Handler.failures -= 1
+                self.send_response(503)
+                self.end_headers()
+                return
+            if self.headers.get('If-None-Match') == self.etag or \
+               self.headers.get('If-Modified-Since') == self.last_modified:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', self.etag)
+            self.send_header('Last-Modified', self.last_modified)
+            self.send_header('Content-Length', str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}/us-counties.csv'
+    flaky = f'http://127.0.0.1:{server.server_port}/flaky'
+
+    async def _get(*args, **kwargs):
+        async with aiohttp.ClientSession() as session:
+            return await get_async(session, *args, **kwargs)
+
+    async def _job(session, timeout, retries, validators):
+        # file url found by a first request
+        _etag, _modified = validators.get(url, (None, None))
+        return await get_async(session, url, _etag, _modified, timeout=timeout,
+                               retries=retries)
+
+    failed = False
+    try:
+        first = asyncio.run(_get(url))
+        failed |= first.content != Handler.body or first.etag != Handler.etag
+
+        second = asyncio.run(_get(url, first.etag, first.last_modified))
+        failed |= second.content is not None
+
+        third = asyncio.run(_get(url, etag='"v0"'))
+        failed |= third.content != Handler.body
+
+        global BACKOFF  # pylint: disable=global-statement
+        BACKOFF, _backoff = 0.0, BACKOFF
+        fourth = asyncio.run(_get(flaky, retries=1))
+        BACKOFF = _backoff
+        failed |= fourth.content != Handler.body
+
+        # jobs send the stored validators of their file
+        with temporary_database():
+            fifth = fetch([], jobs={'job': _job})['job']
+            save_validators({'job': fifth})
+            sixth = fetch([], jobs={'job': _job})['job']
+            failed |= fifth.content != Handler.body or sixth.content is not None
+            seventh = fetch([], jobs={'job': _job}, validate=False)['job']
+            failed |= seventh.content != Handler.body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return failed
+
+
+if __name__ == "__main__":
+
+    # unit testing
+    assert not utest_conditional_get()
@@ -14,7 +14,7 @@ from bokeh.themes import Theme
 
 from utilities import cwd, vbar
 from database import DataBase
-from clf import (
+from tables import (
     MODELS_ROC_TABLE,
     IMPORTANCE_TABLE
 )
@@ -4,6 +4,7 @@
 """
 # %%
 from io import BytesIO
+from os.path import join
 import re
 
 import numpy as np
@@ -12,21 +13,25 @@ import requests
 from bs4 import BeautifulSoup
 import PyPDF2
 
-from database import DataBase
-from wrangler import US_MAP_TABLE
+from utilities import cwd
+from database import DataBase, sample_tables
+from generations import temporary_database
+from downloads import get_async, TIMEOUT, RETRIES
+from tables import (
+    US_MAP_TABLE,
+    FL_CASES_TABLE,
+    FL_DEATHS_TABLE,
+    FLDEM_CASES_TABLE,
+    FLDEM_DEATHS_TABLE,
+    FLDEM_FEATURES_TABLE
+)
 from sql import (
     DROP_FLDEM_VIEW,
-    FLDEM_VIEW
+    FLDEM_KEY
 )
 
-
-# inputs
-FL_CASES_TABLE = 'fl_cases'
-FL_DEATHS_TABLE = 'fl_deaths'
-
-# outputs
-FLDEM_CASES_TABLE = 'fldem_cases'
-FLDEM_DEATHS_TABLE = 'fldem_deaths'
+# name of the fldem source in downloads.fetch
+FLDEM_SOURCE = 'fldem'
 
 
 class PdfScraper:
@@ -38,25 +43,39 @@ class PdfScraper:
     BASE_URL = 'https://floridadisaster.org'
     COVID19_URL = 'https://floridadisaster.org/covid19/'
 
-    def __init__(self):
+    def __init__(self, pages=None):
+        """Get pdf file url, unless its pages are already extracted
+
+        Keyword Arguments:
+            pages {list} -- text pages, see pdf_pages (default: {None})
+        """
         self.url = None
-        self.pages = None
+        self.pages = pages
         self.lines = None
         self.data = None
 
         # get pdf file url
-        self._get_url()
+        if pages is None:
+            self._get_url()
 
     def _get_url(self):
         """Extract pdf file url
-
-        Arguments:
-            url {String} -- url to extract pdf file url
         """
         # get html
         _response = requests.get(self.COVID19_URL)
-        _html = _response.text
-        _soup = BeautifulSoup(_html, features='html.parser')
+        self.url = self.pdf_url(_response.text)
+
+    @classmethod
+    def pdf_url(cls, html):
+        """Extract pdf file url from covid19 page
+
+        Arguments:
+            html {String} -- covid19 page
+
+        Returns:
+            String -- pdf file url, 'NA' if not found
+        """
+        _soup = BeautifulSoup(html, features='html.parser')
         _body = _soup.find('div', {'class': 'panel-body'})
         _paragraphs = _body.find_all('p')
 
@@ -70,24 +89,15 @@ class PdfScraper:
         # find sub url of pdf file
         _match = re.search(r'\"(.+?)\"', _line)
         if _match:
-            self.url = self.BASE_URL + _match.group(1)
-        else:
-            self.url = 'NA'
+            return cls.BASE_URL + _match.group(1)
+        return 'NA'
 
     def get_pages(self):
         """Extract text pages from pdf file
         """
         # read pdf file from url
         _response = requests.get(self.url)
-        _pdffile = _response.content
-
-        # read pdf content
-        _reader = PyPDF2.PdfFileReader(BytesIO(_pdffile))
-
-        # extract text from each pdf page
-        self.pages = []
-        for _page in range(_reader.numPages):
-            self.pages.append(_reader.getPage(_page).extractText())
+        self.pages = pdf_pages(_response.content)
 
     def _get_lines(self, marker):
         """Extract text lines from pdf pages
@@ -172,20 +182,57 @@ class PdfScraper:
 
         return self.data
 
+def pdf_pages(content):
+    """Extract text pages from pdf file
+
+    Arguments:
+        content {bytes} -- pdf file
+
+    Returns:
+        list -- text of each page
+    """
+    _reader = PyPDF2.PdfFileReader(BytesIO(content))
+    return [_reader.getPage(_page).extractText() for _page in range(_reader.numPages)]
+
+
+async def fetch_pdf(session, timeout=TIMEOUT, retries=RETRIES, validators=None):
+    """Download pdf file unless it matches its validators, a downloads.fetch job
+
+    The pdf url is read from the covid19 page, so it takes two requests.
+
+    Arguments:
+        session {aiohttp.ClientSession} -- http session
+
+    Keyword Arguments:
+        timeout {float} -- seconds per attempt (default: {TIMEOUT})
+        retries {int} -- attempts after a failure (default: {RETRIES})
+        validators {dict} -- url: stored (etag, last_modified) (default: {None})
+
+    Returns:
+        Download -- pdf file, content is None if it has not changed
+    """
+    _page = await get_async(session, PdfScraper.COVID19_URL, timeout=timeout, retries=retries)
+    _url = PdfScraper.pdf_url(_page.content.decode('utf-8', errors='replace'))
+    _etag, _modified = (validators or dict()).get(_url, (None, None))
+    return await get_async(session, _url, _etag, _modified, timeout=timeout, retries=retries)
+
+
 # %%
-def get_data(download=False):
+def get_data(download=False, pages=None):
     """Download data from web or from file
 
     Keyword Arguments:
         download {bool} -- get data from source (default: {False})
+        pages {list} -- pdf text pages already downloaded (default: {None})
 
     Returns:
         DataFrame -- florida covid19 cases and deaths data
     """
     if download:
         # instantiate covid19 pdf scraper
-        pdf = PdfScraper()
-        pdf.get_pages()
+        pdf = PdfScraper(pages)
+        if pages is None:
+            pdf.get_pages()
 
         # covid19 cases
         cases = pdf.get_data(marker=r'Case[^s]')
@@ -218,7 +265,7 @@ def clean_data(table):
     """
     _db = DataBase()
     data = _db.get_table(table, parse_dates=['date'])
-    counties = _db.get_geotable(US_MAP_TABLE)
+    counties = _db.get_table(US_MAP_TABLE, columns=['county_id', 'state_id', 'name'])
     _db.close()
 
     data.loc[data['county'] == 'Dade', 'county'] = 'Miami-Dade'
@@ -233,8 +280,8 @@ def clean_data(table):
     data = data[~data['county_id'].isna() & ~data['age'].isna()].copy(deep=True)
     data['age'] = np.int32(data['age'])
 
-    # drop data of unknown gender
-    data = data[data['gender'] != 'Unknown'].copy(deep=True)
+    # drop data of unknown, blank or other gender
+    data = data[data['gender'].isin(['Male', 'Female'])].copy(deep=True)
     data['male'] = data['gender'].map({'Male': 1, 'Female': 0})
 
     # traveled related and contact with known covid19 patient
@@ -263,29 +310,189 @@ def clean_data(table):
     return data
 
 
-def download_fldem():
+def features(cases, deaths):
+    """Match deaths to cases and build classification features
+
+    A case died when a death has the same FLDEM_KEY values. Like the
+    SQL join it replaces, keys with missing values never match.
+
+    Arguments:
+        cases {DataFrame} -- cleaned fldem cases
+        deaths {DataFrame} -- cleaned fldem deaths
+
+    Returns:
+        DataFrame -- one row per case with died flag and county features
+    """
+    _db = DataBase()
+    counties = _db.get_table(US_MAP_TABLE, columns=['county_id', 'aland', 'awater', 'pop'])
+    _db.close()
+
+    # cases stored by older versions may lack gender or age
+    cases = cases.dropna(subset=['male', 'age'])
+
+    # hash join on death match key
+    keys = deaths[FLDEM_KEY].dropna().drop_duplicates()
+    died = cases.merge(keys, on=FLDEM_KEY, how='inner')['case_id'].unique()
+
+    data = cases.merge(counties, on='county_id', how='inner')
+
+    return pd.DataFrame({
+        'date': data['date'],
+        'day': data['day'].astype('int32'),
+        'gender': data['male'].astype('uint8'),
+        'age': data['age'].astype('uint8'),
+        'land_area': data['aland'].astype('int32'),
+        'water_area': data['awater'].astype('int32'),
+        'population': data['pop'],
+        'density': np.round(data['pop'] / data['aland'], 0),
+        'died': data['case_id'].isin(died).astype('uint8')})
+
+
+def download_fldem(pages=None):
     """Get, clean and store covid19 data from FL DEM
+
+    Keyword Arguments:
+        pages {list} -- pdf text pages, see fetch_pdf and pdf_pages (default: {None})
     """
-    get_data(True)
+    get_data(True, pages)
+
+    cases = clean_data(FL_CASES_TABLE)
+    deaths = clean_data(FL_DEATHS_TABLE)
 
     _db = DataBase()
+    _db.add_table(FLDEM_CASES_TABLE, cases.set_index('case_id'))
+    _db.add_table(FLDEM_DEATHS_TABLE, deaths.set_index('case_id'))
+
+    # features replace fldem view, death matches resolved once here
+    _db.add_table(FLDEM_FEATURES_TABLE, features(cases, deaths), index=False)
+    _db.update(DROP_FLDEM_VIEW)
+    _db.close()
 
-    # cases
-    data = clean_data(FL_CASES_TABLE)
-    _db.add_table(FLDEM_CASES_TABLE, data.set_index('case_id'))
 
-    # deaths
-    data = clean_data(FL_DEATHS_TABLE)
-    _db.add_table(FLDEM_DEATHS_TABLE, data.set_index('case_id'))
+def missing_features():
+    """Return True if fldem cases are stored without their features
 
-    # view
-    _db.update(DROP_FLDEM_VIEW)
-    _db.update(FLDEM_VIEW)
+    Returns:
+        bool -- features must be backfilled, see backfill_features
+    """
+    _db = DataBase()
+    missing = (not _db.has_table(FLDEM_FEATURES_TABLE) and
+               _db.has_table(FLDEM_CASES_TABLE) and
+               _db.has_table(FLDEM_DEATHS_TABLE))
+    _db.close()
+    return missing
+
+
+def backfill_features():
+    """Build fldem features from stored cases and deaths if missing
 
+    Databases loaded before features were stored at ingest have the
+    cases and deaths tables only. Call it in a database generation,
+    serving code reads the features table and never writes it.
+
+    Returns:
+        bool -- True if features were built
+    """
+    if not missing_features():
+        return False
+
+    _db = DataBase()
+    cases = _db.get_table(FLDEM_CASES_TABLE, parse_dates=['date'])
+    deaths = _db.get_table(FLDEM_DEATHS_TABLE, parse_dates=['date'])
+    _db.add_table(FLDEM_FEATURES_TABLE, features(cases, deaths), index=False)
+    _db.update(DROP_FLDEM_VIEW)
     _db.close()
 
+    return True
+
+
+def utest_pdf_url():
+    """Test pdf url is found in a saved covid19 page
+
+    Returns:
+        bool -- True if test failed
+    """
+    with open(join(cwd(), 'input', 'fldem_covid19.html'), encoding='utf-8') as page:
+        url = PdfScraper.pdf_url(page.read())
+
+    return url != PdfScraper.BASE_URL + '/globalassets/covid19/dailies/state_reports_latest.pdf'
+
+
+def utest_backfill_features():
+    """Test features are backfilled from stored cases and deaths once
+
+    Returns:
+        bool -- True if test failed
+    """
+    cases = pd.DataFrame({'case_id': [1, 2, 3, 4],
+                          'county_id': '12001',
+                          'state_id': '12',
+                          'date': pd.to_datetime(['2020-03-01', '2020-03-02', '2020-03-02',
+                                                  '2020-03-03']),
+                          'day': [0, 1, 1, 2],
+                          'male': [1, 0, 1, None],
+                          'age': [45, 80, 62, None],
+                          'traveled': 0,
+                          'place': 'USA',
+                          'contacted': [1, 0, 0, 0],
+                          'resident': 1})
+    deaths = cases.iloc[[1]].assign(case_id=7)
+
+    failed = False
+    with temporary_database():
+        sample_tables()
+        _db = DataBase()
+        _db.add_table(FLDEM_CASES_TABLE, cases.set_index('case_id'))
+        _db.add_table(FLDEM_DEATHS_TABLE, deaths.set_index('case_id'))
+        _db.close()
+
+        failed |= not backfill_features()
+        failed |= backfill_features()
+
+        _db = DataBase()
+        data = _db.get_table(FLDEM_FEATURES_TABLE)
+        _db.close()
+
+        failed |= list(data['died']) != [0, 1, 0]
+        failed |= list(data['population']) != [269043] * 3
+
+    return failed
+
+
+def utest_clean_data():
+    """Test cases of blank gender or missing age are dropped
+
+    Returns:
+        bool -- True if test failed
+    """
+    raw = pd.DataFrame({'case': [1, 2, 3, 4],
+                        'county': 'Alachua',
+                        'age': [45, 80, None, 30],
+                        'gender': ['Male', '', 'Female', 'Female'],
+                        'traveled': 'No',
+                        'place': 'USA',
+                        'contacted': 'Yes',
+                        'resident': 'FL resident',
+                        'date': pd.to_datetime(['2020-03-01', '2020-03-02', '2020-03-02',
+                                                '2020-03-03'])})
+
+    with temporary_database():
+        sample_tables()
+        _db = DataBase()
+        _db.add_table(FL_CASES_TABLE, raw, index=False)
+        _db.close()
+
+        data = clean_data(FL_CASES_TABLE)
+        failed = list(data['case_id']) != [1, 4]
+        failed |= list(features(data, data.iloc[:0])['gender']) != [1, 0]
+
+    return failed
+
 
 if __name__ == "__main__":
 
     # unit test
+    assert not utest_pdf_url()
+    assert not utest_backfill_features()
+    assert not utest_clean_data()
     download_fldem()
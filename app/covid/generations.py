@@ -0,0 +1,296 @@
+"""
+    Database generations
+
+    Refresh builds a copy of the database, a generation, and publishes
+    it by writing its file name to a pointer file, so readers switch
+    files atomically. Old generations are removed once no reader uses
+    them, see prune.
+
+    Layout:
+        data/covid19.current                  (pointer file)
+        data/covid19.<timestamp>.sqlite3      (generations)
+"""
+
+import os
+import glob
+import time
+import shutil
+import tempfile
+from os.path import join, dirname, basename, splitext, exists
+from contextlib import contextmanager
+from datetime import datetime
+import threading
+import logging
+
+import sqlite3
+from utilities import cwd
+from snapshot import drop_snapshot
+from config import CONFIG
+from connections import CONNECTIONS
+from cache import RESULT_CACHE
+from sql import (
+    WAL_CHECKPOINT,
+    JOURNAL_DELETE
+)
+
+log = logging.getLogger(__name__)
+
+DATABASE_PATH = join(cwd(), 'data', 'covid19.sqlite3')
+
+# generations kept on disk: current and previous, so readers in other
+# processes can finish on the previous file while a new one is published
+GENERATIONS_KEEP = 2
+
+# seconds a replaced generation is kept after its successor was
+# published, override under database.generation_min_age. Leases only
+# see readers of this process, readers in other processes switch files
+# on their next database access and may still be reading the old one.
+GENERATION_MIN_AGE = CONFIG.get('database.generation_min_age', None) or 600
+
+# refresh thread writes to a new generation, see new_generation()
+_BUILD = threading.local()
+_PUBLISHED = dict(path=None)
+
+
+def pointer_path():
+    """Return path of generation pointer file
+
+    Returns:
+        String -- text file with current generation file name
+    """
+    return splitext(DATABASE_PATH)[0] + '.current'
+
+
+def generation_paths():
+    """Return database files of all generations, oldest first
+
+    Returns:
+        list -- database files
+    """
+    _base, _ext = splitext(DATABASE_PATH)
+    return sorted(glob.glob(f"{_base}.*{_ext}"))
+
+
+def is_generation(path):
+    """Return True if path is a generation file, see new_generation()
+
+    Arguments:
+        path {String} -- database file
+
+    Returns:
+        bool -- file is named <database>.<generation><ext>
+    """
+    _base, _ext = splitext(DATABASE_PATH)
+    return path != DATABASE_PATH and path.startswith(_base + '.') \
+        and path.endswith(_ext)
+
+
+def immutable(path):
+    """Return True if path is a published generation, never written again
+
+    Connections open it immutable when read-only and keep it out of WAL
+    mode when read-write, see connections.py.
+
+    Arguments:
+        path {String} -- database file
+
+    Returns:
+        bool -- file is a generation and is not being built
+    """
+    return is_generation(path) and path != getattr(_BUILD, 'path', None)
+
+
+CONNECTIONS.immutable = immutable
+
+
+def published_path():
+    """Return database file of published generation
+
+    When the pointer moved (maybe published by another process) the
+    previous file is retired, so threads drop their old connections.
+
+    Returns:
+        String -- database file, DATABASE_PATH if nothing published yet
+    """
+    try:
+        with open(pointer_path(), 'r', encoding='utf-8') as pointer:
+            _name = pointer.read().strip()
+    except FileNotFoundError:
+        _name = None
+
+    path = join(dirname(DATABASE_PATH), _name) if _name else DATABASE_PATH
+
+    _previous, _PUBLISHED['path'] = _PUBLISHED['path'], path
+    if _previous and _previous != path:
+        CONNECTIONS.retire(_previous)
+        RESULT_CACHE.invalidate(_previous)
+
+    return path
+
+
+def current_path():
+    """Return database file this thread should use
+
+    The refresh thread gets the generation it is building, other
+    threads get the published generation.
+
+    Returns:
+        String -- database file
+    """
+    return getattr(_BUILD, 'path', None) or published_path()
+
+
+def _remove(path):
+    for _path in [path, path + '-wal', path + '-shm', path + '-journal']:
+        try:
+            os.remove(_path)
+        except FileNotFoundError:
+            pass
+    drop_snapshot(path)
+
+
+def publish(path):
+    """Atomically switch readers to a database file
+
+    Arguments:
+        path {String} -- database file of new generation
+    """
+    _previous = published_path()
+
+    # fold WAL into database file and leave WAL mode, so immutable
+    # readers find every page in the database file
+    with CONNECTIONS.cursor(path) as cursor:
+        cursor.execute(WAL_CHECKPOINT)
+    CONNECTIONS.close(path)
+    _conn = sqlite3.connect(path)
+    try:
+        _conn.execute(JOURNAL_DELETE)
+    finally:
+        _conn.close()
+
+    _pointer = pointer_path()
+    with open(_pointer + '.tmp', 'w', encoding='utf-8') as pointer:
+        pointer.write(basename(path))
+        pointer.flush()
+        os.fsync(pointer.fileno())
+    os.replace(_pointer + '.tmp', _pointer)
+
+    if _previous and _previous != path:
+        CONNECTIONS.retire(_previous)
+        RESULT_CACHE.invalidate(_previous)
+
+    log.info('database generation published: %s', basename(path))
+
+
+def prune(keep=GENERATIONS_KEEP, min_age=GENERATION_MIN_AGE):
+    """Remove old generations not used by this process
+
+    A file is removed min_age seconds after the generation replacing
+    it was published, so readers in other processes, which leases do
+    not see, have moved on. Once a generation is published the legacy
+    DATABASE_PATH file is never read again and is removed the same way.
+    Newer files, like a generation being built, are never removed.
+
+    Keyword Arguments:
+        keep {int} -- newest generations kept (default: {GENERATIONS_KEEP})
+        min_age {float} -- seconds since a file was replaced (default: {GENERATION_MIN_AGE})
+
+    Returns:
+        list -- removed database files
+    """
+    _current = published_path()
+    _chain = [_path for _path in [DATABASE_PATH] if exists(_path)] + generation_paths()
+    if _current == DATABASE_PATH or _current not in _chain:
+        return []
+    _old = _chain[:_chain.index(_current)]
+
+    removed = []
+    for _index, _path in enumerate(_old[:max(len(_old) - keep + 1, 0)]):
+        try:
+            _age = time.time() - os.path.getmtime(_chain[_index + 1])
+        except OSError:
+            continue
+        if _age < min_age or CONNECTIONS.leased(_path):
+            continue
+        CONNECTIONS.retire(_path)
+        CONNECTIONS.close(_path)
+        try:
+            _remove(_path)
+        except OSError as e:
+            log.warning('generation %s not removed: %r', _path, e)
+            continue
+        removed.append(_path)
+
+    return removed
+
+
+@contextmanager
+def new_generation():
+    """Build a new database generation beside the live one
+
+    The live database is copied with the sqlite backup API, then all
+    DataBase instances of this thread use the copy. On success the
+    copy is published and old generations are pruned, on error it is
+    removed and readers never see it.
+
+        Example:
+        with new_generation():
+            download_nytimes()
+            predict()
+
+    Yields:
+        String -- database file of new generation
+    """
+    _live = current_path()
+    _base, _ext = splitext(DATABASE_PATH)
+    path = f"{_base}.{datetime.now().strftime('%Y%m%d%H%M%S%f')}{_ext}"
+
+    if exists(_live):
+        _src, _dst = sqlite3.connect(_live), sqlite3.connect(path)
+        try:
+            _src.backup(_dst)
+        finally:
+            _dst.close()
+            _src.close()
+
+    _BUILD.path = path
+    try:
+        yield path
+    except BaseException:
+        CONNECTIONS.close(path)
+        _remove(path)
+        raise
+    finally:
+        _BUILD.path = None
+
+    publish(path)
+    prune()
+
+
+@contextmanager
+def temporary_database():
+    """Point DataBase at an empty database in a temporary directory
+
+    Unit tests use it, so they never read or write the app database.
+
+        Example:
+        with temporary_database():
+            _db = DataBase()
+            ...
+
+    Yields:
+        String -- database file
+    """
+    global DATABASE_PATH  # pylint: disable=global-statement
+
+    _path = DATABASE_PATH
+    _dir = tempfile.mkdtemp(prefix='covid-test-')
+    DATABASE_PATH = join(_dir, 'test.sqlite3')
+    try:
+        yield DATABASE_PATH
+    finally:
+        for _file in [DATABASE_PATH] + generation_paths():
+            CONNECTIONS.close(_file)
+            RESULT_CACHE.invalidate(_file)
+        DATABASE_PATH = _path
+        shutil.rmtree(_dir, ignore_errors=True)
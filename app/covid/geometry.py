@@ -0,0 +1,174 @@
+"""
+    Decode WKB geometry into flat numpy coordinate buffers
+
+    Serving code only needs coordinates to draw patches, so stored
+    geometry is decoded here without shapely or geopandas.
+"""
+
+import struct
+
+import numpy as np
+
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+
+class GeoBuffers:
+    """Flat coordinate buffers of polygon geometries
+
+        coords[ring_offsets[r]:ring_offsets[r + 1]] -- points of ring r
+        ring_offsets[polygon_offsets[p]] -- exterior ring of polygon p
+        polygon_offsets[geometry_offsets[g]:geometry_offsets[g + 1]] -- polygons
+                                                                       of geometry g
+    """
+    def __init__(self, coords, ring_offsets, polygon_offsets, geometry_offsets):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+        self.geometry_offsets = geometry_offsets
+
+    def __len__(self):
+        return len(self.geometry_offsets) - 1
+
+
+def _as_bytes(value):
+    """Return WKB bytes from a stored geometry value
+
+    Arguments:
+        value {bytes or String} -- WKB blob or hex WKB text
+
+    Returns:
+        bytes -- WKB
+    """
+    if isinstance(value, str):
+        return bytes.fromhex(value)
+    return bytes(value)
+
+
+def _polygon(buffer, pos, rings):
+    """Walk a WKB polygon header and its rings
+
+    Arguments:
+        buffer {bytes} -- joined WKB
+        pos {int} -- polygon start (byte order flag)
+        rings {list} -- (coords start, points, little endian) appended per ring
+
+    Returns:
+        int -- position after polygon
+    """
+    order = '<' if buffer[pos] == 1 else '>'
+    kind, nrings = struct.unpack_from(order + 'II', buffer, pos + 1)
+    if kind != WKB_POLYGON:
+        raise ValueError(f'unsupported wkb geometry type: {kind}')
+
+    pos += 9
+    for _ in range(nrings):
+        npoints, = struct.unpack_from(order + 'I', buffer, pos)
+        rings.append((pos + 4, npoints, order == '<'))
+        pos += 4 + 16 * npoints
+    return pos
+
+
+def decode(values):
+    """Decode WKB polygons and multipolygons into flat buffers
+
+    Headers are walked once to locate every ring, then all coordinates
+    are gathered from the joined buffer in one vectorized pass.
+
+    Arguments:
+        values {iterable} -- WKB blobs or hex WKB text
+
+    Returns:
+        GeoBuffers -- flat coordinate buffers
+    """
+    blobs = [_as_bytes(value) for value in values]
+    buffer = b''.join(blobs)
+
+    rings = []
+    polygon_rings = [0]
+    geometry_polygons = [0]
+
+    pos = 0
+    for blob in blobs:
+        end = pos + len(blob)
+        order = '<' if buffer[pos] == 1 else '>'
+        kind, = struct.unpack_from(order + 'I', buffer, pos + 1)
+
+        if kind == WKB_POLYGON:
+            pos = _polygon(buffer, pos, rings)
+            polygon_rings.append(len(rings))
+        elif kind == WKB_MULTIPOLYGON:
+            npolygons, = struct.unpack_from(order + 'I', buffer, pos + 5)
+            pos += 9
+            for _ in range(npolygons):
+                pos = _polygon(buffer, pos, rings)
+                polygon_rings.append(len(rings))
+        else:
+            raise ValueError(f'unsupported wkb geometry type: {kind}')
+
+        geometry_polygons.append(len(polygon_rings) - 1)
+        pos = end
+
+    starts = np.array([ring[0] for ring in rings], dtype=np.int64)
+    npoints = np.array([ring[1] for ring in rings], dtype=np.int64)
+    little = np.array([ring[2] for ring in rings], dtype=bool)
+
+    ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum(npoints, out=ring_offsets[1:])
+
+    # byte index of every coordinate byte, reversed per double if big endian
+    ndoubles = 2 * npoints
+    first = np.repeat(starts, ndoubles)
+    word = np.arange(ndoubles.sum()) - np.repeat(2 * ring_offsets[:-1], ndoubles)
+    byte = np.arange(8)
+    byte = np.where(np.repeat(little, ndoubles)[:, None], byte, 7 - byte)
+    index = (first + 8 * word)[:, None] + byte
+
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    coords = raw[index].view('<f8').reshape(-1, 2)
+
+    return GeoBuffers(coords,
+                      ring_offsets,
+                      np.array(polygon_rings, dtype=np.int64),
+                      np.array(geometry_polygons, dtype=np.int64))
+
+
+def _object_array(items):
+    """Return 1d object array of arrays (even when arrays have same length)
+    """
+    array = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        array[i] = item
+    return array
+
+
+def patches(buffers):
+    """Build bokeh patches xs and ys from exterior rings
+
+    Polygons of a multipolygon are separated by NaN, like
+    GeoJSONDataSource does for MultiPolygon geometries.
+
+    Arguments:
+        buffers {GeoBuffers} -- decoded geometry
+
+    Returns:
+        tuple -- xs and ys object arrays, one array per geometry
+    """
+    exterior = buffers.polygon_offsets[:-1]
+    starts = buffers.ring_offsets[exterior]
+    lengths = buffers.ring_offsets[exterior + 1] - starts
+
+    # one NaN slot after each polygon, dropped for last polygon of a geometry
+    slots = lengths + 1
+    index = np.repeat(starts - np.cumsum(slots) + slots, slots) + np.arange(slots.sum())
+    index[np.cumsum(slots) - 1] = len(buffers.coords)
+
+    coords = np.vstack([buffers.coords, [np.nan, np.nan]])[index]
+
+    ends = np.cumsum(slots)[buffers.geometry_offsets[1:] - 1] - 1
+    begins = np.concatenate([[0], ends[:-1] + 1])
+
+    xs = _object_array([coords[b:e, 0] for b, e in zip(begins, ends)])
+    ys = _object_array([coords[b:e, 1] for b, e in zip(begins, ends)])
+    return xs, ys
@@ -0,0 +1,404 @@
+"""
+    Load test the Flask + Bokeh server app
+
+    Drives real bokeh sessions through the flask routes and the
+    websocket proxy:
+    1) fetch server_document script from a flask page route
+    2) request autoload.js through the flask http proxy
+    3) open a bokeh websocket session through WebSocketProxy
+    4) pull the document and wait for the deferred data patch
+    5) optionally patch trends MultiSelect, timed until the server
+       answers each patch
+
+    Received counts bokeh messages (header, metadata, content and
+    buffers), not websocket frames.
+
+    Usage:
+        python loadtest.py --url http://127.0.0.1:8000 --page trends \
+                           --sessions 100 --concurrency 10 --pid 1234
+"""
+
+import re
+import json
+import uuid
+import time
+import random
+import asyncio
+import argparse
+import logging
+from urllib.parse import urlsplit, urlunsplit, urlencode
+
+import numpy as np
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+from config import FLASK_URL
+
+
+logging.basicConfig(level=logging.INFO)
+LOG = logging.getLogger(__name__)
+
+
+# flask page route -> bokeh app path
+PAGES = {'maps': '/bkapp-maps',
+         'trends': '/bkapp-trends',
+         'histograms': '/bkapp-histograms',
+         'models': '/bkapp-models'}
+
+# state ids offered by the trends multiselect
+STATE_IDS = ['01', '04', '06', '12', '13', '17', '34', '36', '42', '48']
+
+
+def rss_kb(pid):
+    """Return resident set size of a process
+
+    Arguments:
+        pid {int} -- process id
+
+    Returns:
+        int -- resident set size in kB or None if not available
+    """
+    try:
+        with open(f"/proc/{pid}/status", 'r', encoding='utf-8') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def autoload_url(script):
+    """Extract autoload.js url from a server_document script
+
+    Arguments:
+        script {String} -- html page with server_document script(s)
+
+    Returns:
+        String -- autoload.js url
+    """
+    match = re.search(r'src="([^"]*autoload\.js[^"]*)"', script)
+    if not match:
+        raise ValueError('autoload.js not found in page')
+    return match.group(1).replace('&amp;', '&')
+
+
+def websocket_url(base_url, app_path, session_id=None):
+    """Build bokeh websocket url served by the flask proxy
+
+    Arguments:
+        base_url {String} -- flask url
+        app_path {String} -- bokeh app path
+
+    Keyword Arguments:
+        session_id {String} -- bokeh session id (default: {None})
+
+    Returns:
+        String -- websocket url
+    """
+    parts = urlsplit(base_url)
+    scheme = 'wss' if parts.scheme == 'https' else 'ws'
+    query = dict()
+    if session_id:
+        query = {'bokeh-protocol-version': '1.0', 'bokeh-session-id': session_id}
+    return urlunsplit((scheme, parts.netloc, f"{app_path}/ws", urlencode(query), ''))
+
+
+def message(msgtype, content=None):
+    """Build bokeh protocol message frames
+
+    Arguments:
+        msgtype {String} -- bokeh message type
+
+    Keyword Arguments:
+        content {dict} -- message content (default: {None})
+
+    Returns:
+        list -- header, metadata and content frames
+    """
+    header = dict(msgid=uuid.uuid4().hex, msgtype=msgtype)
+    return [json.dumps(header), json.dumps({}), json.dumps(content or {})]
+
+
+class Session:
+    """One bokeh session opened through the flask proxy
+    """
+    def __init__(self, base_url, page):
+        self.base_url = base_url.rstrip('/')
+        self.page = page
+        self.app_path = PAGES[page]
+        self.conn = None
+        self.received = 0
+        self.select_times = []
+
+    async def open(self):
+        """Fetch page and autoload.js, then connect and pull document
+
+        Returns:
+            dict -- pulled bokeh document
+        """
+        client = AsyncHTTPClient()
+        page = await client.fetch(f"{self.base_url}/{self.page}")
+        script = page.body.decode('utf-8')
+
+        url = autoload_url(script)
+        if url.startswith('/'):
+            url = self.base_url + url
+        autoload = await client.fetch(url)
+        autoload = autoload.body.decode('utf-8')
+
+        token = re.search(r'"token"\s*:\s*"([^"]+)"', autoload)
+        session_id = re.search(r'"sessionid"\s*:\s*"([^"]+)"', autoload)
+
+        # bokeh sends session token as second websocket subprotocol
+        subprotocols = ['bokeh', token.group(1)] if token else None
+        session_id = None if token or not session_id else session_id.group(1)
+
+        self.conn = await websocket_connect(
+            websocket_url(self.base_url, self.app_path, session_id),
+            subprotocols=subprotocols,
+            max_message_size=512 * 1024 * 1024)
+
+        await self.read()  # ACK
+        await self.send('PULL-DOC-REQ')
+        _, content = await self.read()
+        return content.get('doc', {})
+
+    async def ready(self, timeout=60):
+        """Wait until the server fills the loading placeholder
+
+        Arguments:
+            timeout {float} -- seconds to wait (default: {60})
+
+        Returns:
+            list -- model references sent with the data patch
+        """
+        while True:
+            header, content = await asyncio.wait_for(self.read(), timeout=timeout)
+            if header.get('msgtype') == 'PATCH-DOC':
+                return content.get('references', [])
+
+    async def send(self, msgtype, content=None):
+        """Send bokeh message
+
+        Arguments:
+            msgtype {String} -- bokeh message type
+
+        Keyword Arguments:
+            content {dict} -- message content (default: {None})
+
+        Returns:
+            String -- message id, servers answer with it as reqid
+        """
+        frames = message(msgtype, content)
+        for frame in frames:
+            await self.conn.write_message(frame)
+        return json.loads(frames[0])['msgid']
+
+    async def read(self):
+        """Read one bokeh message with its buffers
+
+        Returns:
+            tuple -- message header and content
+        """
+        frames = []
+        while len(frames) < 3:
+            frame = await self.conn.read_message()
+            if frame is None:
+                raise ConnectionError('websocket closed')
+            frames.append(frame)
+
+        header = json.loads(frames[0])
+        for _ in range(2 * header.get('num_buffers', 0)):
+            await self.conn.read_message()
+        self.received += 1
+
+        return header, json.loads(frames[2])
+
+    async def reply(self, msgid, timeout=60):
+        """Read messages until the server answers a request
+
+        Patches made by server callbacks of a request are sent before
+        its answer.
+
+        Arguments:
+            msgid {String} -- request message id, see send
+
+        Keyword Arguments:
+            timeout {float} -- seconds to wait for each message (default: {60})
+
+        Returns:
+            dict -- answer header
+        """
+        while True:
+            header, content = await asyncio.wait_for(self.read(), timeout=timeout)
+            if header.get('reqid') == msgid:
+                if header.get('msgtype') == 'ERROR':
+                    raise RuntimeError(content.get('text', 'request failed'))
+                return header
+
+    async def select_states(self, refs, rounds=5):
+        """Simulate trends MultiSelect changes
+
+        Arguments:
+            refs {list} -- bokeh model references
+
+        Keyword Arguments:
+            rounds {int} -- number of selection changes (default: {5})
+        """
+        select = [ref['id'] for ref in refs if ref.get('type') == 'MultiSelect']
+        if not select:
+            return
+
+        for _ in range(rounds):
+            event = dict(kind='ModelChanged', model=dict(id=select[0]),
+                         attr='value', new=random.sample(STATE_IDS, 3), hint=None)
+            start = time.perf_counter()
+            msgid = await self.send('PATCH-DOC', dict(events=[event], references=[]))
+
+            # server patches visible glyphs and sources, then answers
+            await self.reply(msgid)
+            self.select_times.append(1000 * (time.perf_counter() - start))
+
+    def close(self):
+        """Close websocket connection
+        """
+        if self.conn is not None:
+            self.conn.close()
+
+
+class LoadTest:
+    """Run concurrent bokeh sessions and report results
+
+        Example:
+        test = LoadTest('http://127.0.0.1:8000', 'trends', sessions=50,
+                        concurrency=10, pid=1234)
+        report = test.run()
+    """
+    def __init__(self, base_url, page, sessions=10, concurrency=1, pid=None,
+                 select_rounds=5):
+        self.base_url = base_url
+        self.page = page
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.pid = pid
+        self.select_rounds = select_rounds
+
+        self.times = []
+        self.ready_times = []
+        self.select_times = []
+        self.errors = 0
+        self.received = 0
+        self.rss = []
+
+    async def _session(self, semaphore):
+        async with semaphore:
+            session = Session(self.base_url, self.page)
+            start = time.perf_counter()
+            try:
+                doc = await session.open()
+                self.times.append(1000 * (time.perf_counter() - start))
+                refs = doc.get('roots', {}).get('references', [])
+                refs += await session.ready()
+                self.ready_times.append(1000 * (time.perf_counter() - start))
+                if self.page == 'trends' and self.select_rounds:
+                    await session.select_states(refs, self.select_rounds)
+            except Exception as e:  # pylint: disable=broad-except
+                self.errors += 1
+                LOG.error("session failed %r", e)
+            finally:
+                self.received += session.received
+                self.select_times += session.select_times
+                session.close()
+
+    async def _sample_rss(self, done):
+        while not done.is_set():
+            kb = rss_kb(self.pid)
+            if kb is not None:
+                self.rss.append(kb)
+            await asyncio.sleep(0.25)
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done = asyncio.Event()
+        sampler = asyncio.ensure_future(self._sample_rss(done)) if self.pid else None
+
+        tasks = [self._session(semaphore) for _ in range(self.sessions)]
+        await asyncio.gather(*tasks)
+
+        done.set()
+        if sampler is not None:
+            await sampler
+
+    def run(self):
+        """Run load test
+
+        Returns:
+            dict -- load test report
+        """
+        start = time.perf_counter()
+        asyncio.get_event_loop().run_until_complete(self._run())
+        duration = time.perf_counter() - start
+        return self.report(duration)
+
+    def report(self, duration):
+        """Summarize load test results
+
+        Arguments:
+            duration {float} -- load test duration in seconds
+
+        Returns:
+            dict -- load test report
+        """
+        times = np.array(self.times) if self.times else np.array([np.nan])
+        p50, p95, p99 = np.percentile(times, [50, 95, 99])
+
+        ready = np.array(self.ready_times) if self.ready_times else np.array([np.nan])
+        r50, r95, r99 = np.percentile(ready, [50, 95, 99])
+
+        select = np.array(self.select_times) if self.select_times else np.array([np.nan])
+        s50, s95, s99 = np.percentile(select, [50, 95, 99])
+
+        return dict(page=self.page,
+                    sessions=self.sessions,
+                    concurrency=self.concurrency,
+                    errors=self.errors,
+                    duration_s=round(duration, 3),
+                    session_ms=dict(p50=round(p50, 1),
+                                    p95=round(p95, 1),
+                                    p99=round(p99, 1)),
+                    ready_ms=dict(p50=round(r50, 1),
+                                  p95=round(r95, 1),
+                                  p99=round(r99, 1)),
+                    select_ms=dict(p50=round(s50, 1),
+                                   p95=round(s95, 1),
+                                   p99=round(s99, 1)),
+                    messages_per_s=round(self.received / duration, 1),
+                    rss_kb=dict(start=self.rss[0] if self.rss else None,
+                                peak=max(self.rss) if self.rss else None,
+                                end=self.rss[-1] if self.rss else None))
+
+
+def main():
+    """Parse command line and run load test
+    """
+    parser = argparse.ArgumentParser(description='Bokeh session load test')
+    parser.add_argument('--url', default=FLASK_URL, help='flask server url')
+    parser.add_argument('--page', default='trends', choices=sorted(PAGES))
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--select-rounds', type=int, default=5,
+                        help='trends multiselect changes per session')
+    parser.add_argument('--pid', type=int, default=None,
+                        help='server process id to sample rss')
+    args = parser.parse_args()
+
+    test = LoadTest(args.url, args.page, sessions=args.sessions,
+                    concurrency=args.concurrency, pid=args.pid,
+                    select_rounds=args.select_rounds)
+
+    print(json.dumps(test.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
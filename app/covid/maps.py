@@ -10,8 +10,8 @@ import numpy as np
 from bokeh.plotting import figure
 from bokeh.models import DateSlider
 from bokeh.models import (
+    ColumnDataSource,
     CustomJS,
-    GeoJSONDataSource,
     HoverTool,
     Legend,
     LinearColorMapper,
@@ -27,16 +27,15 @@ from bokeh.palettes import Purples
 from bokeh.themes import Theme
 
 from database import DataBase
+from geometry import patches
 from utilities import cwd
-from sql import (
-    US_MAP_PIVOT_VIEW_TABLE,
-    OPTIONS_TABLE
-)
-from nytimes import (
+from sql import OPTIONS_TABLE
+from tables import (
+    US_MAP_PIVOT_TABLE,
     LEVELS_TABLE,
-    DATES_TABLE
+    DATES_TABLE,
+    STATE_MAP_TABLE
 )
-from wrangler import STATE_MAP_TABLE
 
 
 logging.basicConfig(level=logging.INFO)
@@ -48,30 +47,15 @@ class Map:
         Map Layout Class
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, data=None, **kwargs):
         self.palette = kwargs.pop('palette')
 
-        # init metadata dictionary
-        self.meta = dict()
-
         # get data and metadata from database
-        _db = DataBase()
-        self.counties = _db.get_geotable(US_MAP_PIVOT_VIEW_TABLE)
-
-        self.meta['levels'] = _db.get_table(LEVELS_TABLE)
-        self.meta['dates'] = _db.get_table(DATES_TABLE, parse_dates=['date'])
-        self.meta['options'] = _db.get_table(OPTIONS_TABLE)
-
-        _cols = ['state_id', 'geometry']
-        self.states = _db.get_geotable(STATE_MAP_TABLE, columns=_cols)
-        _db.close()
-
-        # format metadata
-        self.meta['levels'] = list(self.meta['levels']['level'])
-        self.meta['dates'] = list(self.meta['dates']['date'])
-
-        _id, _state = self.meta['options']['id'], self.meta['options']['state']
-        self.meta['options'] = list(zip(_id, _state))
+        if data is None:
+            data = self.load()
+        self.counties = data['counties']
+        self.states = data['states']
+        self.meta = data['meta']
 
         # init plot
         self.plot = figure(match_aspect=True, toolbar_location='right',
@@ -82,14 +66,50 @@ class Map:
 
         # init class variables
         self.controls = dict()
-        self.srcs = dict(counties=GeoJSONDataSource(geojson=self.counties.to_json()),
-                         states=GeoJSONDataSource(geojson=self.states.to_json()))
+        self.srcs = dict(counties=ColumnDataSource(self.counties),
+                         states=ColumnDataSource(self.states))
 
         # build map
         self.plot_map()
 
         log.debug('map init')
 
+    @staticmethod
+    def load():
+        """Read map data and metadata from database
+
+        No bokeh models are built here, so sessions can call it from
+        a worker thread.
+
+        Returns:
+            dict -- counties and states with patches, and metadata
+        """
+        # init metadata dictionary
+        meta = dict()
+
+        _db = DataBase(cache=True, readonly=True)
+        counties, _geometry = _db.get_geometry(US_MAP_PIVOT_TABLE)
+        counties['xs'], counties['ys'] = patches(_geometry)
+
+        meta['levels'] = _db.get_table(LEVELS_TABLE)
+        meta['dates'] = _db.get_table(DATES_TABLE, parse_dates=['date'])
+        meta['options'] = _db.get_table(OPTIONS_TABLE)
+
+        _cols = ['state_id', 'geometry']
+        states, _geometry = _db.get_geometry(STATE_MAP_TABLE, columns=_cols)
+        states['xs'], states['ys'] = patches(_geometry)
+        _db.close()
+
+        # format metadata
+        meta['levels'] = list(meta['levels']['level'])
+        meta['dates'] = list(meta['dates']['date'])
+
+        _id, _state = meta['options']['id'], meta['options']['state']
+        meta['options'] = list(zip(_id, _state))
+
+        log.debug('map data loaded')
+        return dict(counties=counties, states=states, meta=meta)
+
     def __add_counties(self):
         """Add county patches to figure
         """
@@ -0,0 +1,82 @@
+"""
+    Daily metrics derived from cumulative NY Times counts
+
+    Computed once at ingest and stored as columns, so consumers such
+    as arima read daily figures instead of differencing again. Rows
+    are sorted by key and date and every metric is computed on whole
+    arrays; group boundaries come from the sorted keys.
+
+    Columns:
+        new_cases, new_deaths -- daily new counts, first day is its total
+        new_cases_7d, new_deaths_7d -- mean of last 7 daily new counts
+        cases_100k, deaths_100k -- cumulative counts per 100k people
+"""
+
+import numpy as np
+import pandas as pd
+
+# rows of rolling means
+WINDOW = 7
+
+METRICS = ['new_cases', 'new_deaths', 'new_cases_7d', 'new_deaths_7d',
+           'cases_100k', 'deaths_100k']
+
+
+def _rolling_mean(values, first, window):
+    # mean of the last window values of each group, on a cumulative sum
+    _pos = np.arange(len(values))
+    _start = np.maximum.accumulate(np.where(first, _pos, 0))
+    _low = np.maximum(_pos - window + 1, _start)
+    _sum = np.concatenate([[0.0], np.cumsum(np.nan_to_num(values))])
+    return (_sum[_pos + 1] - _sum[_low]) / (_pos - _low + 1)
+
+
+def derived_metrics(data, key, population, history=None):
+    """Add daily new counts, rolling means and per 100k rates
+
+    Data read in chunks passes the history returned for the previous
+    chunk, so differences and means continue across chunks. Chunks
+    must be in date order, as NY Times files are.
+
+    Arguments:
+        data {DataFrame} -- clean rows with key, date, cases and deaths
+        key {String} -- group column, 'county_id' or 'state_id'
+        population {Series} -- population by key
+
+    Keyword Arguments:
+        history {DataFrame} -- last WINDOW rows of each key with metrics (default: {None})
+
+    Returns:
+        tuple -- {DataFrame} data with METRICS columns sorted by key and date,
+                 {DataFrame} history for the next chunk
+    """
+    _data = data.assign(_chunk=True)
+    if history is not None and len(history):
+        _data = pd.concat([history.assign(_chunk=False), _data], ignore_index=True, sort=False)
+    _data = _data.sort_values([key, 'date'], kind='mergesort').reset_index(drop=True)
+
+    _keys = _data[key].astype(str).to_numpy()
+    _first = np.concatenate([[True], _keys[1:] != _keys[:-1]])
+    _chunk = _data['_chunk'].to_numpy(dtype=bool)
+
+    _population = _data[key].astype(str).map(population).to_numpy(dtype='float64')
+    _population = np.where(_population > 0, _population, np.nan)
+
+    for _col in ['cases', 'deaths']:
+        _values = _data[_col].to_numpy(dtype='float64', na_value=np.nan)
+        _new = np.diff(_values, prepend=np.nan)
+        _new[_first] = _values[_first]
+
+        # history rows keep metrics computed with their own history
+        if not _chunk.all():
+            _new = np.where(_chunk, _new, _data['new_' + _col].to_numpy(dtype='float64'))
+
+        _data['new_' + _col] = _new
+        _data['new_' + _col + '_7d'] = _rolling_mean(_new, _first, WINDOW)
+        _data[_col + '_100k'] = _values / _population * 1e5
+
+    history = _data.groupby(key, sort=False, observed=True).tail(WINDOW)
+    history = history.drop(columns='_chunk')
+
+    data = _data[_chunk].drop(columns='_chunk').reset_index(drop=True)
+    return data, history
@@ -2,143 +2,519 @@
     Download COVID-19 data from NY Times
 """
 
+from io import BytesIO
+
 import numpy as np
 import pandas as pd
 
-from database import DataBase
-from wrangler import (
+from database import DataBase, CHUNKSIZE
+from generations import temporary_database
+from downloads import fetch, save_validators, TIMEOUT
+from metrics import derived_metrics, METRICS
+from stages import content_hash
+from tables import (
     US_MAP_TABLE,
-    STATE_MAP_TABLE
+    STATE_MAP_TABLE,
+    COUNTY_LOOKUP_TABLE,
+    US_COUNTIES_TABLE,
+    US_STATES_TABLE,
+    NYTIMES_COUNTIES_TABLE,
+    NYTIMES_STATES_TABLE,
+    LEVELS_TABLE,
+    DATES_TABLE
 )
 from sql import (
     COUNTIES_VIEW,
     DROP_COUNTIES_VIEW,
     STATES_VIEW,
     DROP_STATES_VIEW,
+    STATES_VIEW_TABLE,
+    US_MAP_VIEW,
+    DROP_US_MAP_VIEW,
     US_MAP_PIVOT_VIEW,
     DROP_US_MAP_PIVOT_VIEW,
+    CREATE_US_MAP_PIVOT_TABLE,
+    DROP_US_MAP_PIVOT_TABLE,
     CREATE_OPTIONS_TABLE,
-    INSERT_USA_OPTION,
-    DROP_OPTIONS_TABLE
+    DROP_OPTIONS_TABLE,
+    DROP_TABLE
 )
 
 
-# inputs
-US_COUNTIES_TABLE = 'us_counties'
-US_STATES_TABLE = 'us_states'
-
-# outputs
-NYTIMES_COUNTIES_TABLE = 'nytimes_counties'
-NYTIMES_STATES_TABLE = 'nytimes_states'
-LEVELS_TABLE = 'levels'
-DATES_TABLE = 'dates'
-
-
 # levels to map cases and deaths
 # LEVELS = [0, 1, 10, 100, 250, 500, 5000, 10000, np.inf]
 LEVELS = [0, 1, 500, 1000, 2500, 5000, 10000, 20000, np.inf]
 
+# day columns count days since DAY_EPOCH, before the first report, so
+# stored days never change when a new date arrives. Views take days
+# before the latest date from MAX(day).
+DAY_EPOCH = pd.Timestamp('2020-01-01')
+
 URL_COUNTIES = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv'
 URL_STATES = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv'
 
+# csv columns, dates are parsed with CSV_DATE_FORMAT
+CSV_DTYPES = {'date': 'str', 'county': 'str', 'state': 'str', 'fips': 'str',
+              'cases': 'Int64', 'deaths': 'Int64'}
+CSV_DATE_FORMAT = '%Y-%m-%d'
+
+
+def fetch_nytimes(parsers=None, jobs=None, timeout=None, validate=True):
+    """Conditional download of NY Times files, see downloads.fetch
+
+    Files are parsed as they arrive: the states file is read into a
+    frame, the counties file is only scanned for its latest date, its
+    rows are streamed into the database later.
+
+    Keyword Arguments:
+        parsers {dict} -- more parsers, of job sources (default: {None})
+        jobs {dict} -- more sources fetched at the same time (default: {None})
+        timeout {float or dict} -- seconds per attempt, or by source (default: {TIMEOUT})
+        validate {bool} -- send stored validators, False downloads all files
+                           (default: {True})
+
+    Returns:
+        dict -- url or job name: Download, content is None if file is unchanged
+    """
+    _parsers = {URL_COUNTIES: lambda content: latest_csv_date(BytesIO(content)),
+                URL_STATES: lambda content: read_nytimes_csv(BytesIO(content))}
+    _parsers.update(parsers or dict())
+
+    return fetch([URL_COUNTIES, URL_STATES], parsers=_parsers, jobs=jobs,
+                 timeout=timeout or TIMEOUT, validate=validate)
 
 
-def download_nytimes():
+def download_nytimes(incremental=False, files=None):
     """Read NY Times data from github
+
+    Only files changed since the last download are processed. Files
+    are parsed and cleaned in chunks straight into the final tables.
+
+    Keyword Arguments:
+        incremental {bool} -- upsert new and changed rows only (default: {False})
+        files {dict} -- output of fetch_nytimes (default: {fetch_nytimes()})
     """
-    # read covid19 county by county data from url
-    data = pd.read_csv(URL_COUNTIES, dtype={'fips': 'str'})
+    if files is None:
+        files = fetch_nytimes()
+    counties, states = files[URL_COUNTIES], files[URL_STATES]
 
-    _db = DataBase()
-    _db.add_table(US_COUNTIES_TABLE, data, index=False)
-    _db.close()
+    latest_date = None
+    if counties.content is not None:
+        latest_date = ingest_counties(BytesIO(counties.content), incremental,
+                                      latest_date=counties.parsed)
 
-    # read covid19 state by state data from url
-    data = pd.read_csv(URL_STATES, dtype={'fips': 'str'})
+    if states.content is not None:
+        if states.parsed is not None:
+            clean_states_data(incremental, data=states.parsed)
+        else:
+            ingest_states(BytesIO(states.content), incremental)
 
-    _db = DataBase()
-    _db.add_table(US_STATES_TABLE, data, index=False)
-    _db.close()
+    if counties.content is not None:
+        add_metadata(latest_date)
 
-    clean_counties_data()
-    clean_states_data()
-    add_metadata()
+    drop_staging()
+    save_validators(files)
 
 
-def clean_counties_data():
-    """Clean US Counties data from NY Times
+def read_nytimes_csv(file, chunksize=None, **kwargs):
+    """Read NY Times csv file with explicit dtypes and date format
+
+    Arguments:
+        file {file-like or String} -- csv file
+
+    Keyword Arguments:
+        chunksize {int} -- rows per chunk, None reads all rows (default: {None})
+        kwargs -- more pandas.read_csv arguments
 
     Returns:
-        DataFrame -- clean us counties data
+        DataFrame or iterator -- csv rows, chunks if chunksize is given
+    """
+    def _typed(data):
+        if 'date' in data.columns:
+            data['date'] = pd.to_datetime(data['date'], format=CSV_DATE_FORMAT)
+        return data
+
+    data = pd.read_csv(file, dtype=CSV_DTYPES, chunksize=chunksize, **kwargs)
+    if chunksize is None:
+        return _typed(data)
+    return (_typed(_chunk) for _chunk in data)
+
+
+def latest_csv_date(file):
+    """Return latest date of NY Times csv file
+
+    Only the date column is parsed, iso dates compare as text.
+
+    Arguments:
+        file {file-like} -- csv file, rewound after reading
+
+    Returns:
+        Timestamp -- latest reported date, None if file has no rows
+    """
+    dates = pd.read_csv(file, usecols=['date'], dtype={'date': 'str'})['date']
+    file.seek(0)
+    if dates.empty:
+        return None
+    return pd.to_datetime(dates.max(), format=CSV_DATE_FORMAT)
+
+
+def ingest_counties(file, incremental=False, chunksize=CHUNKSIZE, latest_date=None):
+    """Parse, clean and save NY Times counties csv file in chunks
+
+    Arguments:
+        file {file-like} -- us counties csv file
+
+    Keyword Arguments:
+        incremental {bool} -- upsert new and changed rows only (default: {False})
+        chunksize {int} -- rows per chunk (default: {CHUNKSIZE})
+        latest_date {Timestamp} -- latest date of file (default: {latest_csv_date(file)})
+
+    Returns:
+        Timestamp -- latest reported date
 
     Updates:
-        database table -- NYTIMES_COUNTIES_TABLEs
+        database table -- NYTIMES_COUNTIES_TABLE
         database view -- COUNTIES_VIEW
     """
+    if latest_date is None:
+        latest_date = latest_csv_date(file)
+    save_counties(read_nytimes_csv(file, chunksize=chunksize), latest_date, incremental)
+    return latest_date
+
+
+def ingest_states(file, incremental=False):
+    """Parse, clean and save NY Times states csv file
+
+    Arguments:
+        file {file-like} -- us states csv file
+
+    Keyword Arguments:
+        incremental {bool} -- upsert new and changed rows only (default: {False})
+
+    Returns:
+        DataFrame -- clean us states data
+    """
+    return clean_states_data(incremental, data=read_nytimes_csv(file))
+
+
+def epoch_days(dates):
+    """Return days since DAY_EPOCH
+
+    Arguments:
+        dates {Series} -- parsed dates
+
+    Returns:
+        Series -- Int32 day numbers
+    """
+    return ((dates - DAY_EPOCH) / pd.to_timedelta(1, unit='days')).astype('Int32')
+
+
+def has_epoch_days(database, table):
+    """Return True if stored day column counts days since DAY_EPOCH
+
+    Tables stored when day counted days before the latest date are
+    loaded in full once.
+
+    Arguments:
+        database {DataBase} -- open database
+        table {String} -- table with date and day columns
+
+    Returns:
+        bool -- stored day matches its date, True if table is empty
+    """
+    rows = database.fetch(f"SELECT date, day FROM {table} LIMIT 1")
+    if not rows:
+        return True
+
+    date, day = rows[0]
+    return (pd.to_datetime(date) - DAY_EPOCH) / pd.to_timedelta(1, unit='days') == day
+
+
+def has_columns(database, table, columns):
+    """Return True if stored table has all columns
+
+    Tables stored before columns were added are loaded in full once.
+
+    Arguments:
+        database {DataBase} -- open database
+        table {String} -- table name
+        columns {list} -- column names
+
+    Returns:
+        bool -- table exists and has the columns
+    """
+    return set(columns) <= set(database.table_columns(table))
+
+
+def save_incremental(data, table, keys, where=None):
+    """Upsert new and changed rows, full load if table is missing
+
+    Arguments:
+        data {DataFrame} -- cleaned data
+        table {String} -- table name
+        keys {list} -- unique key columns
+
+    Keyword Arguments:
+        where {String} -- SQL filter of stored rows to compare (default: {None})
+    """
     _db = DataBase()
-    data = _db.get_table(US_COUNTIES_TABLE, parse_dates=['date'])
-    counties = _db.get_geotable(US_MAP_TABLE)
-    states = _db.get_geotable(STATE_MAP_TABLE)
+    compare = [col for col in data.columns if col not in keys]
+    changed = _db.upsert_table(table, data, keys, compare=compare, where=where)
     _db.close()
 
-    start = len(data)
+    print(f'upserted lines: {changed}/{len(data)}')
 
-    # use new york county fips for new york city
-    data.loc[data['county'] == 'New York City', 'fips'] = '36061'
 
-    # add state ids
-    lookup = states.set_index('name')['state_id'].to_dict()
-    data['state_id'] = data['state'].map(lookup)
+def county_index(counties, states, aliases=None):
+    """Build county lookup index, see COUNTY_LOOKUP_TABLE
 
-    # add county ids - first attempt
-    data['id'] = data['county'].str.lower() + data['state_id']
-    counties['id'] = counties['name'].str.lower() + counties['state_id']
-    lookup = counties[['id', 'county_id']].set_index('id')['county_id'].to_dict()
-    data['county_id'] = data['id'].map(lookup)
+    Keys are 'name:<county>|<state>' in lowercase and 'fips:<fips>'.
 
-    # add county ids - last attempt
-    condition = (~data['fips'].isna()) & (data['county_id'].isna())
-    data.loc[condition, 'county_id'] = data.loc[condition, 'fips']
+    Arguments:
+        counties {DataFrame} -- county_id, state_id and name of us map
+        states {DataFrame} -- state_id and name of state map
 
-    # get rid of data that is not in county meta data
-    data = data[data['county_id'].isin(list(counties['county_id']))].copy(deep=True)
+    Keyword Arguments:
+        aliases {dict} -- more fips: county_id, like grouped NYC counties (default: {None})
 
-    # state ids base on county_ids
-    lookup = counties.set_index('county_id')['state_id'].to_dict()
-    data['state_id'] = data['county_id'].map(lookup)
+    Returns:
+        DataFrame -- key, county_id and state_id
+    """
+    state_names = counties['state_id'].map(states.set_index('state_id')['name'])
+    by_name = pd.DataFrame({
+        'key': 'name:' + counties['name'].str.lower() + '|' + state_names.str.lower(),
+        'county_id': counties['county_id'],
+        'state_id': counties['state_id']})
+    by_fips = pd.DataFrame({
+        'key': 'fips:' + counties['county_id'],
+        'county_id': counties['county_id'],
+        'state_id': counties['state_id']})
+
+    aliases = pd.Series(aliases or dict(), dtype=object)
+    aliases = aliases[aliases.isin(counties['county_id'])]
+    by_alias = pd.DataFrame({
+        'key': 'fips:' + aliases.index.astype(str),
+        'county_id': aliases.values,
+        'state_id': aliases.map(counties.set_index('county_id')['state_id']).values})
+
+    index = pd.concat([by_name, by_fips, by_alias], ignore_index=True)
+    index = index.dropna().drop_duplicates('key', keep='first')
+    return index.reset_index(drop=True)
+
+
+def load_county_index():
+    """Return county lookup index, built from maps if it is not stored
 
-    # days from lastest day
-    delta_day = pd.to_timedelta(1, unit='days')
-    data['day'] = (data['date'].max() - data['date']) / delta_day
-    data['day'] = data['day'].astype('Int32')
+    Returns:
+        DataFrame -- key, county_id and state_id
+    """
+    _db = DataBase()
+    if _db.has_table(COUNTY_LOOKUP_TABLE):
+        index = _db.get_table(COUNTY_LOOKUP_TABLE)
+    else:
+        index = county_index(
+            _db.get_table(US_MAP_TABLE, columns=['county_id', 'state_id', 'name']),
+            _db.get_table(STATE_MAP_TABLE, columns=['state_id', 'name']))
+    _db.close()
+    return index
 
-    end = len(data)
+
+def resolve_counties(data, index):
+    """Return county lookup index positions of NY Times rows
+
+    Each distinct county and state pair and each distinct fips is
+    looked up once, rows get their positions through factorize codes.
+    Names are tried first, fips last.
+
+    Arguments:
+        data {DataFrame} -- us counties rows
+        index {DataFrame} -- output of county_index
+
+    Returns:
+        ndarray -- index positions, -1 where unresolved
+    """
+    keys = pd.Index(index['key'])
+
+    codes, pairs = pd.MultiIndex.from_arrays([data['county'], data['state']]).factorize()
+    names = ('name:' + pairs.get_level_values(0).str.lower() + '|' +
+             pairs.get_level_values(1).str.lower())
+    by_name = np.append(keys.get_indexer(names), -1)[codes]
+
+    codes, fips = pd.factorize(data['fips'])
+    by_fips = np.append(keys.get_indexer('fips:' + pd.Index(fips).astype(str)), -1)[codes]
+
+    return np.where(by_name >= 0, by_name, by_fips)
+
+
+def clean_counties_chunk(data, index):
+    """Clean a chunk of US Counties data from NY Times
+
+    Arguments:
+        data {DataFrame} -- us counties rows
+        index {DataFrame} -- county lookup index, see county_index
+
+    Returns:
+        DataFrame -- clean us counties rows
+    """
+    # county and state ids, get rid of data that is not in county meta data
+    positions = resolve_counties(data, index)
+    found = positions >= 0
+    data = data[found].copy(deep=True)
+    data['county_id'] = index['county_id'].values[positions[found]]
+    data['state_id'] = index['state_id'].values[positions[found]]
+
+    # one row per county and date (unique key)
+    data = data.drop_duplicates(['county_id', 'date'], keep='last')
+
+    # days since epoch
+    data['day'] = epoch_days(data['date'])
 
     # ny times counties table
     cols = ['county_id', 'state_id', 'date', 'day', 'cases', 'deaths']
     data = data[cols].copy(deep=True)
     data.reset_index(drop=True, inplace=True)
 
-    data['case_level'] = pd.cut(data['cases'], LEVELS, labels=range(1, len(LEVELS)))
+    data['case_level'] = pd.cut(data['cases'].astype('float64'), LEVELS,
+                                labels=range(1, len(LEVELS)))
     data['case_level'] = pd.to_numeric(data['case_level'], 'coerce').fillna(0)
     data['case_level'] = data['case_level'].astype('Int32')
 
-    # ignored lines
-    print(f'ignored lines: {start-end}/{start} = {(100*(start-end)/start):.01f}%')
+    return data
+
+
+def check_staging(table):
+    """Check a raw staging table exists
+
+    Staging tables are dropped at the end of each refresh, see
+    drop_staging, so stage functions called alone need their rows.
+
+    Arguments:
+        table {String} -- staging table name
+
+    Raises:
+        ValueError -- staging table is missing
+    """
+    _db = DataBase()
+    exists = _db.has_table(table)
+    _db.close()
+    if not exists:
+        raise ValueError(f"staging table {table} not found, it is dropped after each "
+                         "refresh: pass the raw rows as data")
+
+
+def clean_counties_data(incremental=False, chunksize=CHUNKSIZE, data=None):
+    """Clean US Counties data from NY Times
+
+    Rows are read, cleaned and saved in chunks, so memory does not
+    grow with the length of the history.
+
+    Keyword Arguments:
+        incremental {bool} -- upsert new and changed rows only (default: {False})
+        chunksize {int} -- rows per chunk (default: {CHUNKSIZE})
+        data {DataFrame} -- raw us counties rows with parsed dates (default: {US_COUNTIES_TABLE})
+
+    Returns:
+        int -- number of clean us counties rows
+
+    Updates:
+        database table -- NYTIMES_COUNTIES_TABLEs
+        database view -- COUNTIES_VIEW
+    """
+    if data is not None:
+        chunks = (data.iloc[_start:_start + chunksize]
+                  for _start in range(0, len(data), chunksize))
+        latest_date = data['date'].max() if len(data) else None
+        return save_counties(chunks, latest_date, incremental)
+
+    check_staging(US_COUNTIES_TABLE)
+    _db = DataBase()
+    latest_date = _db.fetch(f"SELECT MAX(date) FROM {US_COUNTIES_TABLE}")[0][0]
+    _db.close()
+
+    if latest_date is not None:
+        latest_date = pd.to_datetime(latest_date)
+
+    _db = DataBase()
+    count = save_counties(_db.iter_table(US_COUNTIES_TABLE, parse_dates=['date'],
+                                         chunksize=chunksize),
+                          latest_date, incremental)
+    _db.close()
+    return count
+
+
+def save_counties(chunks, latest_date, incremental=False):
+    """Clean chunks of US Counties data from NY Times and save them
+
+    Arguments:
+        chunks {iterator} -- raw us counties chunks with parsed dates
+        latest_date {Timestamp} -- latest reported date of all rows
+
+    Keyword Arguments:
+        incremental {bool} -- upsert new and changed rows only (default: {False})
+
+    Returns:
+        int -- number of clean us counties rows
+
+    Updates:
+        database table -- NYTIMES_COUNTIES_TABLEs
+        database view -- COUNTIES_VIEW
+    """
+    if latest_date is None:
+        print('ignored lines: 0/0 = 0.0%')
+        return 0
+
+    index = load_county_index()
+    _db = DataBase()
+    population = _db.get_table(US_MAP_TABLE, columns=['county_id', 'pop'])
+    incremental = (incremental and has_columns(_db, NYTIMES_COUNTIES_TABLE, METRICS) and
+                   has_epoch_days(_db, NYTIMES_COUNTIES_TABLE))
+    _db.close()
+    population = population.set_index('county_id')['pop']
+
+    count = dict(start=0, end=0)
+
+    def _chunks():
+        history = None
+        for chunk in chunks:
+            count['start'] += len(chunk)
+            chunk = clean_counties_chunk(chunk, index)
+            chunk, history = derived_metrics(chunk, 'county_id', population, history)
+            count['end'] += len(chunk)
+            yield chunk
 
     # tables to database
+    keys = ['county_id', 'date']
     _db = DataBase()
-    _db.add_table(NYTIMES_COUNTIES_TABLE, data.set_index(['county_id', 'day']))
+    if incremental:
+        # all chunks or none, readers never see a partial file
+        with _db.transaction():
+            for chunk in _chunks():
+                dates = chunk['date'].min(), chunk['date'].max()
+                where = "date BETWEEN '{:%Y-%m-%d %H:%M:%S}' AND '{:%Y-%m-%d %H:%M:%S}'"
+                save_incremental(chunk, NYTIMES_COUNTIES_TABLE, keys,
+                                 where=where.format(*dates))
+    else:
+        _db.add_chunks(NYTIMES_COUNTIES_TABLE,
+                       (chunk.set_index(['county_id', 'day']) for chunk in _chunks()),
+                       keys=keys)
     _db.update(DROP_COUNTIES_VIEW)
     _db.update(COUNTIES_VIEW)
     _db.close()
 
-    return data
+    # ignored lines
+    start, end = count['start'], count['end']
+    print(f'ignored lines: {start-end}/{start} = {(100*(start-end)/max(start, 1)):.01f}%')
 
+    return end
 
-def clean_states_data():
+
+def clean_states_data(incremental=False, data=None):
     """Clean US States data from NY Times
 
+    Keyword Arguments:
+        incremental {bool} -- upsert new and changed rows only (default: {False})
+        data {DataFrame} -- raw us states rows (default: {US_STATES_TABLE})
+
     Returns:
         DataFrame -- clean us states data
 
@@ -147,25 +523,45 @@ def clean_states_data():
         database view -- STATES_VIEW
     """
     # covid19 data and metadata
+    if data is None:
+        check_staging(US_STATES_TABLE)
+        _db = DataBase()
+        data = _db.get_table(US_STATES_TABLE, parse_dates=['date'])
+        _db.close()
+
     _db = DataBase()
-    data = _db.get_table(US_STATES_TABLE, parse_dates=['date'])
-    states = _db.get_geotable(STATE_MAP_TABLE)
+    states = _db.get_table(STATE_MAP_TABLE, columns=['state_id', 'name', 'pop'])
     _db.close()
 
+    data = clean_states(data, states)
+    save_states(data, incremental)
+
+    return data
+
+
+def clean_states(data, states):
+    """Clean US States data from NY Times, without database access
+
+    Arguments:
+        data {DataFrame} -- raw us states rows
+        states {DataFrame} -- state_id, name and pop of state map
+
+    Returns:
+        DataFrame -- clean us states data with derived metrics
+    """
     start = len(data)
 
     # add state ids
-    states['name'] = states['name'].str.lower()
+    states = states.assign(name=states['name'].str.lower())
     lookup = states.set_index('name')['state_id'].to_dict()
     data['state_id'] = data['state'].str.lower().map(lookup)
 
     # get rid of data that is not in county meta data
     data = data[data['state_id'].isin(list(states['state_id']))].copy(deep=True)
+    data = data.drop_duplicates(['state_id', 'date'], keep='last')
 
-    # days from lastest reported date
-    delta_day = pd.to_timedelta(1, unit='days')
-    data['day'] = (data['date'].max() - data['date']) / delta_day
-    data['day'] = data['day'].astype('Int32')
+    # days since epoch
+    data['day'] = epoch_days(data['date'])
 
     end = len(data)
 
@@ -173,38 +569,118 @@ def clean_states_data():
     data = data[['state_id', 'date', 'day', 'cases', 'deaths']].copy(deep=True)
     data.reset_index(drop=True, inplace=True)
 
+    data, _ = derived_metrics(data, 'state_id', states.set_index('state_id')['pop'])
+
     # ignored lines
-    print(f'ignored lines: {start-end}/{start} = {(100*(start-end)/start):.01f}%')
+    print(f'ignored lines: {start-end}/{start} = {(100*(start-end)/max(start, 1)):.01f}%')
+
+    return data
+
+
+def save_states(data, incremental=False):
+    """Save clean US States data
+
+    Arguments:
+        data {DataFrame} -- output of clean_states
+
+    Keyword Arguments:
+        incremental {bool} -- upsert new and changed rows only (default: {False})
+
+    Updates:
+        database table -- NYTIMES_STATES_TABLEs
+        database view -- STATES_VIEW
+    """
+    _db = DataBase()
+    incremental = (incremental and has_columns(_db, NYTIMES_STATES_TABLE, METRICS) and
+                   has_epoch_days(_db, NYTIMES_STATES_TABLE))
+    _db.close()
+
+    if incremental:
+        save_incremental(data, NYTIMES_STATES_TABLE, ['state_id', 'date'])
+    else:
+        _db = DataBase()
+        _db.add_table(NYTIMES_STATES_TABLE, data.set_index('state_id'))
+        _db.close()
 
-    # table to database
     _db = DataBase()
-    _db.add_table(NYTIMES_STATES_TABLE, data.set_index('state_id'))
     _db.update(DROP_STATES_VIEW)
     _db.update(STATES_VIEW)
     _db.close()
 
-    return data
+
+def states_view(data, states):
+    """Return STATES_VIEW rows of clean US States data, in memory
+
+    Arguments:
+        data {DataFrame} -- output of clean_states
+        states {DataFrame} -- state_id and name of state map
+
+    Returns:
+        DataFrame -- date, state_id, state, cases, deaths, new_cases and new_deaths
+    """
+    names = states.set_index('state_id')['name']
+    view = data[['date', 'state_id']].copy(deep=True)
+    view['state'] = view['state_id'].map(names)
+    for _col in ['cases', 'deaths', 'new_cases', 'new_deaths']:
+        view[_col] = data[_col]
+    return view
+
+
+def states_view_hash(data):
+    """Return content hash of STATES_VIEW rows
+
+    Rows read from the database and rows built by states_view hash the
+    same, so predictions are skipped alike on both paths.
+
+    Arguments:
+        data {DataFrame} -- STATES_VIEW rows with parsed dates
+
+    Returns:
+        String -- hex digest, see stages.content_hash
+    """
+    _numbers = ['cases', 'deaths', 'new_cases', 'new_deaths']
+    data = data[['date', 'state_id', 'state'] + _numbers].dropna(subset=['state'])
+    data = data.astype(dict(date='datetime64[ns]', state_id=object, state=object,
+                            **{_col: 'float64' for _col in _numbers}))
+    data = data.sort_values(['state_id', 'date']).reset_index(drop=True)
+    return content_hash(data)
+
+
+def drop_staging():
+    """Drop raw staging tables, csv files are ingested without them
+    """
+    _db = DataBase()
+    _db.update(DROP_TABLE.format(name=US_COUNTIES_TABLE))
+    _db.update(DROP_TABLE.format(name=US_STATES_TABLE))
+    _db.close()
 
 
-def add_metadata():
-    """Updates options, dates and levels database tables
+def add_metadata(latest_date=None):
+    """Updates map pivot, options, dates and levels database tables
+
+    Keyword Arguments:
+        latest_date {Timestamp} -- latest reported date (default: {NYTIMES_COUNTIES_TABLE max})
 
     Updates:
+        database table -- US_MAP_PIVOT_TABLE
         database table -- OPTIONS
         database table -- DATES
         database table -- LEVELS
     """
     _db = DataBase()
     _db.update(DROP_US_MAP_PIVOT_VIEW)
+    _db.update(DROP_US_MAP_VIEW)
+    _db.update(US_MAP_VIEW)
     _db.update(US_MAP_PIVOT_VIEW)
-    data = _db.get_table(NYTIMES_COUNTIES_TABLE, parse_dates=['dates'])
+    _db.update(DROP_US_MAP_PIVOT_TABLE)
+    _db.update(CREATE_US_MAP_PIVOT_TABLE)
+    if latest_date is None:
+        latest_date = pd.to_datetime(
+            _db.fetch(f"SELECT MAX(date) FROM {NYTIMES_COUNTIES_TABLE}")[0][0])
     _db.close()
 
-    data['date'] = pd.to_datetime(data['date'])
-
     # last 15 days
     dates = []
-    latest_date = data['date'].max()
     for day in range(15):
         date = latest_date - pd.to_timedelta(day, 'days')
         dates.append(date)
@@ -215,11 +691,146 @@ def add_metadata():
     _db.add_table(DATES_TABLE, pd.DataFrame({'date': dates}), index=False)
     _db.update(DROP_OPTIONS_TABLE)
     _db.update(CREATE_OPTIONS_TABLE)
-    _db.update(INSERT_USA_OPTION)
     _db.close()
 
 
+def utest_incremental_counties(chunksize=4):
+    """Test incremental counties ingest in many chunks, in a temporary database
+
+    A second file with a new day and a revised row is upserted chunk
+    by chunk and must store the same rows as a full load of it. A
+    failing chunk must leave stored rows unchanged, and a table with
+    days counted before the latest date must be loaded in full. Without
+    staging tables, clean_counties_data must raise unless given rows.
+
+    Keyword Arguments:
+        chunksize {int} -- rows per chunk (default: {4})
+
+    Returns:
+        bool -- True if test failed
+    """
+    counties = pd.DataFrame({'county_id': ['01001', '01003', '12001'],
+                             'state_id': ['01', '01', '12'],
+                             'name': ['Autauga', 'Baldwin', 'Alachua'],
+                             'pop': [55869, 223234, 269043]})
+    states = pd.DataFrame({'state_id': ['01', '12'], 'name': ['Alabama', 'Florida'],
+                           'abbr': ['AL', 'FL'], 'pop': [4903185, 21477737]})
+
+    dates = pd.date_range('2020-03-01', periods=10, freq='D').strftime(CSV_DATE_FORMAT)
+    rows = pd.DataFrame({'date': np.repeat(dates, len(counties)),
+                         'county': np.tile(counties['name'], len(dates)),
+                         'state': np.tile(['Alabama', 'Alabama', 'Florida'], len(dates)),
+                         'fips': np.tile(counties['county_id'], len(dates)),
+                         'cases': np.arange(len(dates) * len(counties)) * 3,
+                         'deaths': np.arange(len(dates) * len(counties))})
+
+    # next file: one more day and a revised count
+    update = rows.copy()
+    update.loc[5, 'cases'] += 7
+    last = rows.tail(len(counties)).assign(date='2020-03-11')
+    update = pd.concat([update, last.assign(cases=last['cases'] + 5)], ignore_index=True)
+
+    def _csv(data):
+        return BytesIO(data.to_csv(index=False).encode())
+
+    def _stored():
+        _db = DataBase()
+        data = _db.get_table(NYTIMES_COUNTIES_TABLE, parse_dates=['date'])
+        _db.close()
+        data = data.sort_values(['county_id', 'date']).reset_index(drop=True)
+        return data.astype({'county_id': str, 'state_id': str})
+
+    def _failing(chunks):
+        # second chunk has the revised row
+        for _, _chunk in zip(range(2), chunks):
+            yield _chunk
+        raise ValueError('utest')
+
+    failed = False
+    with temporary_database():
+        _db = DataBase()
+        _db.add_table(US_MAP_TABLE, counties.set_index('county_id'))
+        _db.add_table(STATE_MAP_TABLE, states.set_index('state_id'))
+        _db.close()
+
+        ingest_counties(_csv(rows), chunksize=chunksize)
+        before = _stored()
+        try:
+            save_counties(_failing(read_nytimes_csv(_csv(update), chunksize=chunksize)),
+                          pd.Timestamp('2020-03-11'), incremental=True)
+        except ValueError:
+            pass
+        failed |= not before.equals(_stored())
+
+        ingest_counties(_csv(update), incremental=True, chunksize=chunksize)
+        incremental = _stored()
+
+        ingest_counties(_csv(update), chunksize=chunksize)
+        full = _stored()
+        failed |= not incremental.equals(full[incremental.columns])
+
+        # days before latest date, stored by older versions
+        _db = DataBase()
+        _db.update(f"UPDATE {NYTIMES_COUNTIES_TABLE} SET day = 0")
+        failed |= has_epoch_days(_db, NYTIMES_COUNTIES_TABLE)
+        _db.close()
+        ingest_counties(_csv(update), incremental=True, chunksize=chunksize)
+        failed |= not full.equals(_stored())
+
+        # stage functions after a refresh dropped staging
+        try:
+            clean_counties_data()
+            failed = True
+        except ValueError:
+            pass
+        clean_counties_data(chunksize=chunksize, data=read_nytimes_csv(_csv(update)))
+        failed |= not full.equals(_stored())
+
+    return failed
+
+
+def utest_states_view_hash():
+    """Test STATES_VIEW rows hash the same from the database and in memory
+
+    Row order depends on the query plan and numbers may be read as
+    floats, neither changes the hash.
+
+    Returns:
+        bool -- True if test failed
+    """
+    states = pd.DataFrame({'state_id': ['01', '12'], 'name': ['Alabama', 'Florida'],
+                           'abbr': ['AL', 'FL'], 'pop': [4903185, 21477737]})
+    dates = pd.date_range('2020-03-01', periods=5, freq='D').strftime(CSV_DATE_FORMAT)
+    rows = pd.DataFrame({'date': np.repeat(dates, 3),
+                         'state': np.tile(['Alabama', 'Florida', 'Guam'], len(dates)),
+                         'fips': np.tile(['01', '12', '66'], len(dates)),
+                         'cases': np.arange(len(dates) * 3) * 3,
+                         'deaths': np.arange(len(dates) * 3)})
+    content = rows.to_csv(index=False).encode()
+
+    failed = False
+    with temporary_database():
+        _db = DataBase()
+        _db.add_table(STATE_MAP_TABLE, states.set_index('state_id'))
+        _db.close()
+
+        ingest_states(BytesIO(content))
+        _db = DataBase()
+        stored = _db.get_table(STATES_VIEW_TABLE, parse_dates=['date'])
+        _db.close()
+
+        data = clean_states(read_nytimes_csv(BytesIO(content)), states)
+        failed |= states_view_hash(stored) != states_view_hash(states_view(data, states))
+        shuffled = stored.sample(frac=1, random_state=0).astype({'cases': 'float64'})
+        failed |= states_view_hash(stored) != states_view_hash(shuffled)
+        failed |= states_view_hash(stored) == states_view_hash(stored.assign(cases=0))
+
+    return failed
+
+
 if __name__ == "__main__":
 
     # unit testing
+    assert not utest_incremental_counties()
+    assert not utest_states_view_hash()
     download_nytimes()
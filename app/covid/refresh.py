@@ -3,19 +3,66 @@
 
 """
 import enum
+from io import BytesIO
 
-from nytimes import download_nytimes
-from fldem import download_fldem
-from arima import predict
+import numpy as np
+import pandas as pd
+
+from nytimes import (
+    URL_COUNTIES,
+    URL_STATES,
+    CSV_DATE_FORMAT,
+    fetch_nytimes,
+    latest_csv_date,
+    ingest_counties,
+    read_nytimes_csv,
+    clean_states,
+    save_states,
+    states_view,
+    states_view_hash,
+    add_metadata,
+    drop_staging
+)
+from fldem import (
+    FLDEM_SOURCE,
+    fetch_pdf,
+    pdf_pages,
+    download_fldem,
+    missing_features,
+    backfill_features
+)
+from arima import predictions
 from clf import classify
-from database import DataBase
-from wrangler import maps_to_database
+from database import DataBase, sample_tables
+from generations import new_generation, generation_paths, temporary_database
+from downloads import Download, changed, save_validators
+from stages import (
+    MAPS_STAGE,
+    ARIMA_STAGE,
+    content_hash,
+    file_hash,
+    table_hash,
+    last_stage,
+    unchanged,
+    save_stage
+)
 from utilities import ElapsedMilliseconds
+from tables import (
+    SNAPSHOT_TABLES,
+    US_MAP_TABLE,
+    STATE_MAP_TABLE,
+    COUNTY_LOOKUP_TABLE,
+    NYTIMES_COUNTIES_TABLE,
+    NYTIMES_STATES_TABLE
+)
 from sql import (
     VACUUM,
     REINDEX
 )
 
+# seconds per download attempt of each source
+TIMEOUTS = {URL_COUNTIES: 120, URL_STATES: 30, FLDEM_SOURCE: 60}
+
 class Status(enum.Enum):
     """Refresh Data Enumeration
 
@@ -72,40 +119,263 @@ class  RefreshData:
         return round(self.time.elapsed()/(60*1000), 1)
 
 
+class NyTimesPipeline:
+    """Refresh NY Times tables and predictions in one pass
 
-def refresh_data():
-    """
-        Refresh covid-19 data used by this app
+    Stages pass typed frames in memory and every output table is
+    written once by persist. Counties are the exception, they are too
+    large to hold and are streamed into their table by ingest_counties.
+    Stages of unchanged files are skipped, predictions only depend on
+    states. A stage also skips when the hash of its inputs matches its
+    last run (see stages.py), NY Times tables hash their file and the
+    maps, predictions hash the states view rows as arima.predict does.
+    Hashes are saved by persist. The nytimes and arima functions still work alone.
+
+        Example:
+        pipeline = NyTimesPipeline(fetch_nytimes(), incremental=True)
+        pipeline.run()
     """
-    print('downloading nytimes data...', end='')
-    download_nytimes()
-    # print('done.\ndownloading fldem data...', end='')
-    # download_fldem()
-    # print('done.\nclassifying with fldem data...', end='')
-    # classify()
-    print('done.\npredicting with nytimes data...', end='')
-    predict()
-    print('done.')
+    def __init__(self, files, incremental=False):
+        """Keep downloaded files of one refresh
+
+        Arguments:
+            files {dict} -- output of fetch_nytimes
+
+        Keyword Arguments:
+            incremental {bool} -- upsert new and changed rows only (default: {False})
+        """
+        self.files = files
+        self.incremental = incremental
+        self.latest_date = None
+        self.frames = dict()
+        self.hashes = dict()
+
+    def counties(self):
+        """Ingest counties file, written to database as it is read
+        """
+        _file = self.files[URL_COUNTIES]
+        if _file.content is None:
+            return
+
+        _inputs = content_hash(_file.content, last_stage(MAPS_STAGE)[1])
+        if unchanged(NYTIMES_COUNTIES_TABLE, _inputs):
+            return
+
+        self.latest_date = ingest_counties(BytesIO(_file.content), self.incremental,
+                                           latest_date=_file.parsed)
+        self.hashes[NYTIMES_COUNTIES_TABLE] = (_inputs, content_hash(self.latest_date))
+
+    def states(self):
+        """Clean states file and build states view rows
+        """
+        _file = self.files[URL_STATES]
+        if _file.content is None:
+            return
 
+        _inputs = content_hash(_file.content, last_stage(MAPS_STAGE)[1])
+        if unchanged(NYTIMES_STATES_TABLE, _inputs):
+            return
+
+        _db = DataBase()
+        _states = _db.get_table(STATE_MAP_TABLE, columns=['state_id', 'name', 'pop'])
+        _db.close()
+
+        _data = _file.parsed
+        if _data is None:
+            _data = read_nytimes_csv(BytesIO(_file.content))
+
+        self.frames['states'] = clean_states(_data, _states)
+        self.frames['states_view'] = states_view(self.frames['states'], _states)
+        self.hashes[NYTIMES_STATES_TABLE] = (_inputs, content_hash(self.frames['states']))
+
+    def predict(self):
+        """Predict cases and deaths from states view rows
+        """
+        if 'states_view' not in self.frames:
+            return
+
+        _inputs = states_view_hash(self.frames['states_view'])
+        if unchanged(ARIMA_STAGE, _inputs):
+            return
+
+        self.frames['predictions'] = predictions(self.frames['states_view'])
+        self.hashes[ARIMA_STAGE] = (_inputs,
+                                    content_hash(*self.frames['predictions'].values()))
+
+    def persist(self):
+        """Write stage outputs, metadata, stage hashes and download validators
+        """
+        if 'states' in self.frames:
+            save_states(self.frames['states'], self.incremental)
+
+        _db = DataBase()
+        for _table, _data in self.frames.get('predictions', dict()).items():
+            _db.add_table(_table, _data, index=False)
+        _db.close()
+
+        if self.latest_date is not None:
+            add_metadata(self.latest_date)
+
+        drop_staging()
+        for _stage, (_inputs, _outputs) in self.hashes.items():
+            save_stage(_stage, _inputs, _outputs)
+        save_validators(self.files)
+
+    def run(self):
+        """Run all stages and persist outputs
+        """
+        self.counties()
+        self.states()
+        self.predict()
+        self.persist()
+
+
+def compact():
+    """
+        Vacuum and reindex database, then snapshot hot tables
+    """
     _db = DataBase()
     _db.update(VACUUM)
     _db.update(REINDEX)
+    for _table in SNAPSHOT_TABLES:
+        if _db.has_table(_table):
+            _db.snapshot_table(_table)
     _db.close()
 
 
+def fetch_sources(fldem=False, validate=True):
+    """Download and parse all refresh sources at once
+
+    Keyword Arguments:
+        fldem {bool} -- fetch FL DEM pdf too (default: {False})
+        validate {bool} -- send stored validators, False downloads all files
+                           (default: {True})
+
+    Returns:
+        dict -- url or source name: Download, see downloads.fetch
+    """
+    if not fldem:
+        return fetch_nytimes(timeout=TIMEOUTS, validate=validate)
+
+    return fetch_nytimes(parsers={FLDEM_SOURCE: pdf_pages},
+                         jobs={FLDEM_SOURCE: fetch_pdf},
+                         timeout=TIMEOUTS, validate=validate)
+
+
+def refresh_data(fldem=False):
+    """
+        Refresh covid-19 data used by this app
+
+        Data is refreshed in a new database generation, readers
+        switch to it only when it is complete. Nothing is refreshed
+        if the source files have not changed since last refresh and
+        no fldem features are missing.
+
+        Keyword Arguments:
+            fldem {bool} -- refresh FL DEM data and classifier, if the pdf
+                            changed (default: {False})
+    """
+    print('downloading data...', end='')
+    files = fetch_sources(fldem)
+    backfill = missing_features()
+    if not changed(files) and not backfill:
+        print('unchanged.')
+        return
+
+    with new_generation():
+        print('done.\nrefreshing nytimes data...', end='')
+        NyTimesPipeline(files, incremental=True).run()
+        if fldem and files[FLDEM_SOURCE].content is not None:
+            print('done.\nrefreshing fldem data...', end='')
+            download_fldem(files[FLDEM_SOURCE].parsed)
+            print('done.\nclassifying with fldem data...', end='')
+            classify()
+        elif backfill:
+            print('done.\nbackfilling fldem features...', end='')
+            backfill_features()
+        print('done.')
+
+        compact()
+
+
 def refresh_maps():
     """
         Refresh database maps
         it needs geopandas install
+
+        Nothing is refreshed if the map input files have not changed
+        since last refresh. NY Times tables resolve counties and
+        states with the maps, so they are rebuilt from downloaded
+        files, unchanged ones included.
     """
-    print('refreshing database maps...')
-    maps_to_database()
-    print('done.')
+    # pylint: disable=import-outside-toplevel
+    from wrangler import maps_to_database, map_inputs
+
+    inputs = file_hash(map_inputs())
+    if unchanged(MAPS_STAGE, inputs):
+        print('maps unchanged.')
+        return
+
+    with new_generation():
+        print('refreshing database maps...')
+        maps_to_database()
+        save_stage(MAPS_STAGE, inputs,
+                   table_hash([US_MAP_TABLE, STATE_MAP_TABLE, COUNTY_LOOKUP_TABLE]))
+
+        _db = DataBase()
+        nytimes = _db.has_table(NYTIMES_COUNTIES_TABLE)
+        _db.close()
+        if nytimes:
+            print('refreshing nytimes data...')
+            NyTimesPipeline(fetch_sources(validate=False)).run()
+        print('done.')
+
+        compact()
+
+def utest_refresh_unchanged():
+    """Test a refresh of unchanged files builds no generation, in a temporary database
+
+    Fetches are stubbed: the first refresh downloads the counties file,
+    the second gets it unchanged.
+
+    Returns:
+        bool -- True if test failed
+    """
+    global fetch_sources  # pylint: disable=global-statement
+
+    dates = pd.date_range('2020-03-01', periods=3, freq='D').strftime(CSV_DATE_FORMAT)
+    rows = pd.DataFrame({'date': np.repeat(dates, 2),
+                         'county': np.tile(['Autauga', 'Alachua'], len(dates)),
+                         'state': np.tile(['Alabama', 'Florida'], len(dates)),
+                         'fips': np.tile(['01001', '12001'], len(dates)),
+                         'cases': np.arange(len(dates) * 2),
+                         'deaths': np.zeros(len(dates) * 2, dtype=int)})
+    content = rows.to_csv(index=False).encode()
+
+    files = [{URL_COUNTIES: Download(URL_COUNTIES, content, '"v1"', None,
+                                     latest_csv_date(BytesIO(content))),
+              URL_STATES: Download(URL_STATES, None, None, None)},
+             {URL_COUNTIES: Download(URL_COUNTIES, None, '"v1"', None),
+              URL_STATES: Download(URL_STATES, None, None, None)}]
+
+    failed = False
+    _fetch_sources = fetch_sources
+    fetch_sources = lambda fldem=False, validate=True: files.pop(0)
+    try:
+        with temporary_database():
+            sample_tables()
+            refresh_data()
+            first = generation_paths()
+            refresh_data()
+            failed |= len(first) != 1 or generation_paths() != first
+    finally:
+        fetch_sources = _fetch_sources
+
+    return failed
 
-    _db = DataBase()
-    _db.update(VACUUM)
-    _db.update(REINDEX)
-    _db.close()
 
 if __name__ == "__main__":
+
+    # unit testing
+    assert not utest_refresh_unchanged()
     refresh_data()
@@ -0,0 +1,225 @@
+"""
+    Columnar .npy snapshots of database tables
+
+    Refresh writes hot tables as one .npy file per column beside the
+    database file, numbers and dates in their final SCHEMAS dtype.
+    Readers memory-map those columns and build the frame without
+    consolidating them, so loading is near zero-copy and pages are
+    shared by all server processes. Text is stored as int32 codes plus
+    unique values, and blobs as one byte buffer plus offsets.
+
+    Layout:
+        <database>.snapshot/<table>/meta.json
+        <database>.snapshot/<table>/<column number>.npy
+        <database>.snapshot/<table>/<column number>.values.npy   (text)
+        <database>.snapshot/<table>/<column number>.offsets.npy  (blob)
+"""
+
+import os
+import json
+import shutil
+from os.path import join, isdir, exists
+
+import numpy as np
+import pandas as pd
+
+# pandas before 1.3 consolidates frames built from dicts, copying
+# every memory-mapped column, so frames are built from blocks there
+DICT_COPIES = tuple(int(_part) for _part in pd.__version__.split('.')[:2]) < (1, 3)
+
+
+def snapshot_dir(path, name=None):
+    """Return snapshot directory of a database file or one of its tables
+
+    Arguments:
+        path {String} -- database file
+
+    Keyword Arguments:
+        name {String} -- table name (default: {None})
+
+    Returns:
+        String -- directory
+    """
+    _dir = path + '.snapshot'
+    return join(_dir, name) if name else _dir
+
+
+def has_snapshot(path, name):
+    """Return True if table has a snapshot
+
+    Arguments:
+        path {String} -- database file
+        name {String} -- table name
+
+    Returns:
+        bool -- snapshot exists
+    """
+    return exists(join(snapshot_dir(path, name), 'meta.json'))
+
+
+def drop_snapshot(path, name=None):
+    """Remove snapshot of one table or of all tables
+
+    Arguments:
+        path {String} -- database file
+
+    Keyword Arguments:
+        name {String} -- table name, all tables if None (default: {None})
+    """
+    _dir = snapshot_dir(path, name)
+    if isdir(_dir):
+        shutil.rmtree(_dir, ignore_errors=True)
+
+
+def _kind(values):
+    if pd.api.types.is_numeric_dtype(values) or \
+       pd.api.types.is_datetime64_any_dtype(values):
+        return 'array'
+    _sample = values.dropna()
+    if len(_sample) and isinstance(_sample.iloc[0], (bytes, bytearray, memoryview)):
+        return 'blob'
+    return 'text'
+
+
+def write_snapshot(path, name, data):
+    """Write table data as a columnar snapshot
+
+    The snapshot is written to a temporary directory and moved in
+    place, so readers never see a partial snapshot.
+
+    Arguments:
+        path {String} -- database file
+        name {String} -- table name
+        data {DataFrame} -- table data typed as declared in SCHEMAS
+    """
+    _dir = snapshot_dir(path, name)
+    _tmp = _dir + '.tmp'
+    drop_snapshot(path, name + '.tmp')
+    os.makedirs(_tmp)
+
+    columns = []
+    for _index, _col in enumerate(data.columns):
+        _values = data[_col]
+        _type = _kind(_values)
+        _file = join(_tmp, f"{_index}")
+
+        if _type == 'array':
+            np.save(_file + '.npy', np.ascontiguousarray(_values.to_numpy()))
+        elif _type == 'text':
+            _codes, _uniques = pd.factorize(_values)
+            np.save(_file + '.npy', _codes.astype(np.int32))
+            np.save(_file + '.values.npy', np.asarray(_uniques, dtype=str))
+        else:
+            _blobs = [bytes(_blob) for _blob in _values]
+            _offsets = np.zeros(len(_blobs) + 1, dtype=np.int64)
+            np.cumsum([len(_blob) for _blob in _blobs], out=_offsets[1:])
+            np.save(_file + '.npy', np.frombuffer(b''.join(_blobs), dtype=np.uint8))
+            np.save(_file + '.offsets.npy', _offsets)
+
+        columns.append(dict(name=_col, kind=_type, file=f"{_index}"))
+
+    with open(join(_tmp, 'meta.json'), 'w', encoding='utf-8') as meta:
+        json.dump(dict(rows=len(data), columns=columns), meta)
+
+    drop_snapshot(path, name)
+    os.replace(_tmp, _dir)
+
+
+def _text(file, codes, parse, dtype):
+    _uniques = np.load(file + '.values.npy')
+    if dtype == 'category' and parse is None:
+        return pd.Categorical.from_codes(codes, categories=_uniques.astype(object))
+    if parse is not None:
+        _uniques = pd.to_datetime(_uniques, format=parse or None).values
+        _missing = np.datetime64('NaT')
+    else:
+        _uniques = _uniques.astype(object)
+        _missing = None
+
+    # append missing value so code -1 maps to it
+    _uniques = np.append(_uniques, np.array([_missing], dtype=_uniques.dtype))
+    return _uniques[codes]
+
+
+def _blob(file, buffer):
+    _offsets = np.load(file + '.offsets.npy')
+    _values = np.empty(len(_offsets) - 1, dtype=object)
+    _values[:] = [buffer[_start:_end].tobytes()
+                  for _start, _end in zip(_offsets[:-1], _offsets[1:])]
+    return _values
+
+
+def _frame(data, rows):
+    if not DICT_COPIES:
+        return pd.DataFrame(data, copy=False)
+
+    # pylint: disable=import-outside-toplevel
+    from pandas.core.internals import BlockManager, make_block
+
+    _blocks = []
+    for _index, _values in enumerate(data.values()):
+        if isinstance(_values, np.ndarray):
+            _values = _values.reshape(1, -1)
+        _blocks.append(make_block(_values, placement=[_index], ndim=2))
+    return pd.DataFrame(BlockManager(_blocks, [pd.Index(list(data)), pd.RangeIndex(rows)]))
+
+
+def read_snapshot(path, name, columns=None, index_col=None, parse_dates=None,
+                  dtypes=None):
+    """Read table from its snapshot, numbers and dates memory-mapped
+
+    Each column keeps its own block, so memory-mapped columns are not
+    copied. Text columns of category dtype are built from the stored
+    codes.
+
+    Arguments:
+        path {String} -- database file
+        name {String} -- table name
+
+    Keyword Arguments:
+        columns {list} -- column name(s) to read (default: {None})
+        index_col {String or list} -- column name(s) (default: {None})
+        parse_dates {list or dict} -- column name(s) or name: format (default: {None})
+        dtypes {dict} -- column name: dtype, only category is used (default: {None})
+
+    Returns:
+        {DataFrame} -- table data
+    """
+    _dir = snapshot_dir(path, name)
+    with open(join(_dir, 'meta.json'), 'r', encoding='utf-8') as meta:
+        meta = json.load(meta)
+
+    _parse = dict()
+    if isinstance(parse_dates, dict):
+        _parse = dict(parse_dates)
+    elif parse_dates:
+        _parse = {_col: '' for _col in parse_dates}
+    _parse = {_col: _format if isinstance(_format, str) else ''
+              for _col, _format in _parse.items()}
+
+    _dtypes = dtypes or dict()
+
+    _columns = {_col['name']: _col for _col in meta['columns']}
+    if columns:
+        _missing = [_col for _col in columns if _col not in _columns]
+        if _missing:
+            raise KeyError(f"{name} snapshot has no columns {_missing}")
+        _columns = {_col: _columns[_col] for _col in columns}
+
+    data = dict()
+    for _col, _meta in _columns.items():
+        _file = join(_dir, _meta['file'])
+        # plain ndarray view of the memory map
+        _values = np.asarray(np.load(_file + '.npy', mmap_mode='r'))
+        if _meta['kind'] == 'text':
+            _values = _text(_file, _values, _parse.get(_col), _dtypes.get(_col))
+        elif _meta['kind'] == 'blob':
+            _values = _blob(_file, _values)
+        elif _col in _parse and not np.issubdtype(_values.dtype, np.datetime64):
+            _values = pd.to_datetime(_values).values
+        data[_col] = _values
+
+    data = _frame(data, meta['rows'])
+    if index_col is not None:
+        data.set_index(index_col, inplace=True)
+    return data
@@ -1,13 +1,24 @@
 """
     Queries for Database
+
+    Views use standard SQL only (unquoted aliases, no rowid, every
+    selected column grouped or aggregated), so they run unchanged on
+    SQLite and on the optional DuckDB backend, see analytics.py.
 """
 
+from tables import (
+    NYTIMES_COUNTIES_TABLE,
+    NYTIMES_STATES_TABLE,
+    DOWNLOADS_TABLE,
+    STAGES_TABLE
+)
+
 COUNTIES_VIEW = ("""
     CREATE VIEW
             counties_view AS
     SELECT
         nytimes_counties.date,
-        us_map.name || ', ' || state_map.abbr AS 'county',
+        us_map.name || ', ' || state_map.abbr AS county,
         nytimes_counties.cases,
         nytimes_counties.deaths,
         nytimes_counties.case_level AS level
@@ -27,9 +38,11 @@ STATES_VIEW = ("""
     SELECT
         nytimes_states.date,
         state_map.state_id,
-        state_map.name AS 'state',
+        state_map.name AS state,
         nytimes_states.cases,
-        nytimes_states.deaths
+        nytimes_states.deaths,
+        nytimes_states.new_cases,
+        nytimes_states.new_deaths
     FROM
             nytimes_states
     INNER JOIN state_map ON state_map.state_id = nytimes_states.state_id
@@ -45,13 +58,13 @@ FLDEM_VIEW = ("""
     SELECT
         m.date,
         m.day,
-        m.male AS 'gender',
+        m.male AS gender,
         m.age,
-        us_map.aland AS 'land_area',
-        us_map.awater AS 'water_area',
-        us_map.pop AS 'population',
-        ROUND(us_map.pop / us_map.aland, 0) AS 'density',
-        IFNULL(e.died, 0) AS 'died'
+        us_map.aland AS land_area,
+        us_map.awater AS water_area,
+        us_map.pop AS population,
+        ROUND(us_map.pop * 1.0 / us_map.aland, 0) AS density,
+        IFNULL(e.died, 0) AS died
     FROM
         fldem_cases m
     INNER JOIN us_map ON us_map.county_id = m.county_id
@@ -59,7 +72,7 @@ FLDEM_VIEW = ("""
         (
             SELECT DISTINCT
                 fldem_cases.case_id,
-                fldem_cases.rowid/fldem_cases.rowid as 'died'
+                1 AS died
             FROM
                 fldem_cases
             INNER JOIN fldem_deaths ON
@@ -77,19 +90,19 @@ FLDEM_VIEW_TABLE = 'fldem_view'
 
 DROP_FLDEM_VIEW = 'DROP VIEW IF EXISTS fldem_view'
 
+# usa first, then states
 CREATE_OPTIONS_TABLE = ("""
     CREATE TABLE options AS
     SELECT
-        state_id AS 'id',
-        name AS 'state'
-    FROM state_map
-""")
-
-INSERT_USA_OPTION = ("""
-    INSERT INTO
-        options (rowid, id, state)
-    VALUES
-        (0, '00', 'USA')
+        id,
+        state
+    FROM
+        (
+            SELECT 0 AS n, '00' AS id, 'USA' AS state
+            UNION ALL
+            SELECT 1 AS n, state_id AS id, name AS state FROM state_map
+        ) o
+    ORDER BY n, id
 """)
 
 DROP_OPTIONS_TABLE = 'DROP TABLE IF EXISTS options'
@@ -102,30 +115,35 @@ US_MAP_VIEW = ("""
     SELECT
         us_map.county_id,
         state_map.state_id,
-        us_map.name || ', ' || state_map.abbr AS 'name',
+        us_map.name || ', ' || state_map.abbr AS name,
         us_map.geometry,
         us_map.pop,
-        nytimes_counties.cases AS 'c',
-        nytimes_counties.deaths AS 'd',
-        nytimes_counties.case_level AS 'm',
-        nytimes_counties.day
+        nytimes_counties.cases AS c,
+        nytimes_counties.deaths AS d,
+        nytimes_counties.case_level AS m,
+        latest.day - nytimes_counties.day AS day
     FROM
         us_map
+    CROSS JOIN (SELECT MAX(day) AS day FROM nytimes_counties) latest
     LEFT JOIN state_map ON state_map.state_id = us_map.state_id
     LEFT JOIN nytimes_counties ON
         nytimes_counties.county_id = us_map.county_id AND
-        nytimes_counties.day < 15
+        nytimes_counties.day > latest.day - 15
 """)
 
+US_MAP_VIEW_TABLE = 'us_map_view'
+
+DROP_US_MAP_VIEW = 'DROP VIEW IF EXISTS us_map_view'
+
 US_MAP_PIVOT_VIEW = ("""
     CREATE VIEW
         us_map_pivot_view AS
     SELECT
-        name,
-        state_id,
-        geometry,
-        pop,
-        day,
+        MAX(name) AS name,
+        MAX(state_id) AS state_id,
+        MAX(geometry) AS geometry,
+        MAX(pop) AS pop,
+        MIN(day) AS day,
         IFNULL(SUM(CASE WHEN day = 0 THEN c END), 0) as c,
         IFNULL(SUM(CASE WHEN day = 0 THEN d END), 0) as d,
         IFNULL(SUM(CASE WHEN day = 0 THEN m END), 0) as m,
@@ -182,6 +200,103 @@ US_MAP_PIVOT_VIEW_TABLE = 'us_map_pivot_view'
 
 DROP_US_MAP_PIVOT_VIEW = 'DROP VIEW IF EXISTS us_map_pivot_view'
 
+# pivot computed once per refresh, sessions read the table
+CREATE_US_MAP_PIVOT_TABLE = ('''
+    CREATE TABLE
+        us_map_pivot AS
+    SELECT * FROM us_map_pivot_view
+''')
+
+DROP_US_MAP_PIVOT_TABLE = 'DROP TABLE IF EXISTS us_map_pivot'
+
+DROP_TABLE = 'DROP TABLE IF EXISTS {name}'
+
 VACUUM = 'VACUUM'
 
 REINDEX = 'REINDEX'
+
+# fold write-ahead log into database file before publishing it
+WAL_CHECKPOINT = 'PRAGMA wal_checkpoint(TRUNCATE)'
+
+# rollback journal, published generations are read without WAL files
+JOURNAL_DELETE = 'PRAGMA journal_mode = DELETE'
+
+
+# columns matching a fldem death to a fldem case
+FLDEM_KEY = ['county_id', 'age', 'date', 'male', 'resident', 'traveled', 'place']
+
+# indexes by table, rebuilt by DataBase.add_table after each load
+# because to_sql(if_exists='replace') drops them with the table
+INDEXES = {
+    # us_map_view: join on county_id, filter last 15 days, covers c, d, m
+    # and finds the latest day
+    NYTIMES_COUNTIES_TABLE: [
+        ('ix_nytimes_counties_cover', ['county_id', 'day', 'cases', 'deaths', 'case_level']),
+        ('ix_nytimes_counties_day', ['day'])
+    ],
+    # states_view: covers all selected columns
+    NYTIMES_STATES_TABLE: [
+        ('ix_nytimes_states_cover', ['state_id', 'date', 'cases', 'deaths',
+                                     'new_cases', 'new_deaths'])
+    ]
+}
+
+# unique keys, needed by DataBase.upsert_table
+UNIQUE_INDEXES = {
+    NYTIMES_COUNTIES_TABLE: [
+        ('ux_nytimes_counties_key', ['county_id', 'date'])
+    ],
+    NYTIMES_STATES_TABLE: [
+        ('ux_nytimes_states_key', ['state_id', 'date'])
+    ],
+    DOWNLOADS_TABLE: [
+        ('ux_downloads_url', ['url'])
+    ],
+    STAGES_TABLE: [
+        ('ux_stages_name', ['name'])
+    ]
+}
+
+CREATE_INDEX = 'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'
+
+CREATE_UNIQUE_INDEX = 'CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({columns})'
+
+DROP_INDEX = 'DROP INDEX IF EXISTS {name}'
+
+EXPLAIN_QUERY_PLAN = 'EXPLAIN QUERY PLAN {query}'
+
+TABLE_COLUMNS = 'PRAGMA table_info({name})'
+
+TABLE_EXISTS = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = '{name}'"
+
+INDEX_NAMES = "SELECT name FROM sqlite_master WHERE type = 'index'"
+
+# duckdb catalog, see analytics.py
+DUCKDB_TABLE_EXISTS = ("SELECT table_name FROM information_schema.tables "
+                       "WHERE table_type = 'BASE TABLE' AND table_name = '{name}'")
+
+UPSERT = ('''
+    INSERT INTO {table} ({columns})
+    VALUES ({values})
+    ON CONFLICT ({keys}) DO UPDATE SET {updates}
+''')
+
+# keep last written row of each key, rows appended in chunks
+DEDUPLICATE = ('''
+    DELETE FROM {table}
+    WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table} GROUP BY {keys})
+''')
+
+# hot queries, number of full table scans allowed (driving tables) and
+# index uses their plans must have, every INDEXES entry is used by one
+QUERY_PLAN_CHECKS = [
+    ('SELECT * FROM counties_view', 1,
+     ['us_map USING INDEX ix_us_map_county_id',
+      'state_map USING INDEX ix_state_map_state_id']),
+    ('SELECT * FROM states_view', 1,
+     ['nytimes_states USING COVERING INDEX ix_nytimes_states_cover']),
+    ('SELECT * FROM us_map_pivot_view', 1,
+     ['nytimes_counties USING COVERING INDEX ix_nytimes_counties_day',
+      'nytimes_counties USING COVERING INDEX ix_nytimes_counties_cover'])
+]
+
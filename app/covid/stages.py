@@ -0,0 +1,181 @@
+"""
+    Content hashes of refresh stages
+
+    Each stage stores a hash of its inputs and of its outputs in the
+    stages table after a successful run. A stage whose inputs hash to
+    the value of its last run is skipped. Downstream stages hash the
+    outputs of the stages they read, so an upstream stage that ran but
+    produced the same rows does not rerun them either.
+
+        Example:
+        inputs = content_hash(data)
+        if unchanged('predict', inputs):
+            return
+        ...
+        save_stage('predict', inputs, content_hash(result))
+"""
+
+import hashlib
+from datetime import datetime
+
+import pandas as pd
+
+from database import DataBase
+from generations import temporary_database
+from tables import STAGES_TABLE
+
+# stage names, stages writing one table are named after it
+MAPS_STAGE = 'maps'
+ARIMA_STAGE = 'arima'
+
+
+def content_hash(*items):
+    """Return sha256 hex digest of items
+
+    DataFrames hash their index, columns and values, strings hash as
+    utf-8 and None as a marker, so an optional input can be passed.
+
+    Arguments:
+        items {bytes, String, DataFrame or None} -- stage inputs or outputs
+
+    Returns:
+        String -- hex digest
+    """
+    _hash = hashlib.sha256()
+    for _item in items:
+        if _item is None:
+            _hash.update(b'\0')
+        elif isinstance(_item, (bytes, bytearray, memoryview)):
+            _hash.update(_item)
+        elif isinstance(_item, pd.DataFrame):
+            _hash.update(repr(list(_item.columns)).encode('utf-8'))
+            _hash.update(pd.util.hash_pandas_object(_item, index=True).to_numpy().tobytes())
+        else:
+            _hash.update(str(_item).encode('utf-8'))
+        # separator, so ('ab', 'c') and ('a', 'bc') differ
+        _hash.update(b'\x1f')
+    return _hash.hexdigest()
+
+
+def file_hash(paths):
+    """Return content hash of files
+
+    Arguments:
+        paths {list} -- file names
+
+    Returns:
+        String -- hex digest
+    """
+    _hash = hashlib.sha256()
+    for _path in paths:
+        with open(_path, 'rb') as _file:
+            for _block in iter(lambda: _file.read(1 << 20), b''):
+                _hash.update(_block)
+        _hash.update(b'\x1f')
+    return _hash.hexdigest()
+
+
+def table_hash(names):
+    """Return content hash of tables as stored
+
+    Arguments:
+        names {list} -- table names
+
+    Returns:
+        String -- hex digest, None if a table is missing
+    """
+    _db = DataBase()
+    try:
+        if not all(_db.has_table(_name) for _name in names):
+            return None
+        return content_hash(*[pd.read_sql_query(sql=f"select * from {_name};", con=_db.conn)
+                              for _name in names])
+    finally:
+        _db.close()
+
+
+def last_stage(name):
+    """Return hashes of last successful run of stage
+
+    Arguments:
+        name {String} -- stage name
+
+    Returns:
+        tuple -- (inputs, outputs), (None, None) if stage never ran
+    """
+    _db = DataBase()
+    if not _db.has_table(STAGES_TABLE):
+        _db.close()
+        return None, None
+    data = _db.get_table(STAGES_TABLE)
+    _db.close()
+
+    data = data[data['name'] == name]
+    if data.empty:
+        return None, None
+    return data['inputs'].iat[0], data['outputs'].iat[0]
+
+
+def unchanged(name, inputs):
+    """Return True if stage inputs match its last successful run
+
+    Arguments:
+        name {String} -- stage name
+        inputs {String} -- hash of stage inputs, see content_hash
+
+    Returns:
+        bool -- stage can be skipped
+    """
+    return inputs is not None and last_stage(name)[0] == inputs
+
+
+def save_stage(name, inputs, outputs=None):
+    """Store hashes of a successful stage run
+
+    Call after the stage outputs are written, so a failed run is
+    retried.
+
+    Arguments:
+        name {String} -- stage name
+        inputs {String} -- hash of stage inputs
+
+    Keyword Arguments:
+        outputs {String} -- hash of stage outputs (default: {None})
+    """
+    data = pd.DataFrame({'name': [name], 'inputs': [inputs], 'outputs': [outputs],
+                         'updated': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')})
+
+    _db = DataBase()
+    _db.upsert_table(STAGES_TABLE, data, ['name'])
+    _db.close()
+
+
+def utest_stages():
+    """Test stage hashes and skips, in a temporary database
+
+    Returns:
+        bool -- True if test failed
+    """
+    data = pd.DataFrame({'state_id': ['12', '13'], 'cases': [1, 2]})
+
+    failed = False
+    failed |= content_hash(data) != content_hash(data.copy())
+    failed |= content_hash(data) == content_hash(data.assign(cases=[1, 3]))
+    failed |= content_hash('ab', 'c') == content_hash('a', 'bc')
+    failed |= content_hash(b'ab', None) == content_hash(b'ab')
+
+    with temporary_database():
+        inputs = content_hash(data)
+        failed |= unchanged('utest', inputs)
+        save_stage('utest', inputs, content_hash('out'))
+        failed |= not unchanged('utest', inputs)
+        failed |= unchanged('utest', content_hash('other'))
+        failed |= last_stage('utest')[1] != content_hash('out')
+
+    return failed
+
+
+if __name__ == "__main__":
+
+    # unit testing
+    assert not utest_stages()
@@ -0,0 +1,97 @@
+"""
+    Check server startup import time with `python -X importtime`
+
+    Imports the serving modules in a fresh interpreter and fails when
+    the import time is over budget or when a refresh-only library
+    (ML or GIS stack) is loaded by the serving process.
+
+    Usage:
+        python startup.py --budget-ms 2500
+"""
+
+import sys
+import argparse
+import subprocess
+
+from utilities import cwd
+
+
+# modules imported by run.py to start serving
+SERVING_MODULES = ['app', 'bkapp']
+
+# libraries only needed to refresh data
+REFRESH_ONLY = ['sklearn', 'pmdarima', 'statsmodels', 'matplotlib',
+                'geopandas', 'shapely', 'fiona', 'pyproj', 'PyPDF2', 'bs4']
+
+STARTUP_BUDGET_MS = 2500
+
+
+def import_times(modules=None):
+    """Import modules in a new interpreter and collect import times
+
+    Keyword Arguments:
+        modules {list} -- modules to import (default: {SERVING_MODULES})
+
+    Returns:
+        list -- (module, self us, cumulative us) for each imported module
+    """
+    modules = modules or SERVING_MODULES
+    command = [sys.executable, '-X', 'importtime', '-c',
+               'import ' + ', '.join(modules)]
+    result = subprocess.run(command, cwd=cwd(), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _self, _cumulative, _module = line[len('import time:'):].split('|')
+        times.append((_module.strip(), int(_self), int(_cumulative)))
+    return times
+
+
+def check_startup(budget_ms=STARTUP_BUDGET_MS, modules=None):
+    """Check import time budget and refresh-only imports
+
+    Keyword Arguments:
+        budget_ms {int} -- import time budget in ms (default: {STARTUP_BUDGET_MS})
+        modules {list} -- modules to import (default: {SERVING_MODULES})
+
+    Returns:
+        dict -- total import time, top imports and errors
+    """
+    times = import_times(modules)
+    total_ms = sum(_self for _, _self, _ in times) / 1000
+
+    loaded = {name.split('.')[0] for name, _, _ in times}
+    heavy = sorted(loaded.intersection(REFRESH_ONLY))
+
+    errors = []
+    if total_ms > budget_ms:
+        errors.append(f'import time {total_ms:.0f}ms over budget {budget_ms}ms')
+    if heavy:
+        errors.append(f"refresh-only libraries imported: {', '.join(heavy)}")
+
+    top = sorted([(name, cumulative) for name, _, cumulative in times
+                  if '.' not in name], key=lambda x: x[1], reverse=True)[:10]
+
+    return dict(total_ms=round(total_ms, 1),
+                top_ms=[(name, round(us / 1000, 1)) for name, us in top],
+                errors=errors)
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description='Server startup budget check')
+    PARSER.add_argument('--budget-ms', type=int, default=STARTUP_BUDGET_MS)
+    ARGS = PARSER.parse_args()
+
+    REPORT = check_startup(ARGS.budget_ms)
+
+    print(f"startup imports: {REPORT['total_ms']}ms (budget {ARGS.budget_ms}ms)")
+    for NAME, MS in REPORT['top_ms']:
+        print(f"  {NAME}: {MS}ms")
+    for ERROR in REPORT['errors']:
+        print(f"ERROR: {ERROR}")
+
+    sys.exit(1 if REPORT['errors'] else 0)
@@ -0,0 +1,79 @@
+"""
+    Database table names
+
+    Lightweight module shared by serving and refresh code, so
+    serving code can name tables without importing the modules
+    that build them (and their ML and GIS dependencies).
+"""
+
+# maps - wrangler.py
+US_MAP_TABLE = 'us_map'
+STATE_MAP_TABLE = 'state_map'
+COUNTY_LOOKUP_TABLE = 'county_lookup'
+
+# ny times - nytimes.py
+US_COUNTIES_TABLE = 'us_counties'
+US_STATES_TABLE = 'us_states'
+NYTIMES_COUNTIES_TABLE = 'nytimes_counties'
+NYTIMES_STATES_TABLE = 'nytimes_states'
+LEVELS_TABLE = 'levels'
+DATES_TABLE = 'dates'
+US_MAP_PIVOT_TABLE = 'us_map_pivot'
+
+# florida dem - fldem.py
+FL_CASES_TABLE = 'fl_cases'
+FL_DEATHS_TABLE = 'fl_deaths'
+FLDEM_CASES_TABLE = 'fldem_cases'
+FLDEM_DEATHS_TABLE = 'fldem_deaths'
+FLDEM_FEATURES_TABLE = 'fldem_features'
+
+# predictions - arima.py
+ARIMA_CASES_TABLE = 'arima_cases'
+ARIMA_DEATHS_TABLE = 'arima_deaths'
+
+# validators of downloaded files - downloads.py
+DOWNLOADS_TABLE = 'downloads'
+
+# content hashes of refresh stages - stages.py
+STAGES_TABLE = 'stages'
+
+# classification - clf.py
+MODELS_ROC_TABLE = 'models_roc'
+IMPORTANCE_TABLE = 'importance'
+
+# column types applied on read by DataBase.get_table, declare only
+# columns without missing values, dates are parsed with their format
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SCHEMAS = {
+    NYTIMES_COUNTIES_TABLE: dict(
+        dates=dict(date=DATE_FORMAT),
+        dtypes=dict(county_id='category', state_id='category',
+                    day='int32', case_level='uint8')),
+    NYTIMES_STATES_TABLE: dict(
+        dates=dict(date=DATE_FORMAT),
+        dtypes=dict(state_id='category', day='int32')),
+    DATES_TABLE: dict(
+        dates=dict(date=DATE_FORMAT),
+        dtypes=dict()),
+    ARIMA_CASES_TABLE: dict(
+        dates=dict(date=DATE_FORMAT),
+        dtypes=dict(state_id='category', state='category', actual='float64',
+                    predict='float64', lower='float64', upper='float64')),
+    ARIMA_DEATHS_TABLE: dict(
+        dates=dict(date=DATE_FORMAT),
+        dtypes=dict(state_id='category', state='category', actual='float64',
+                    predict='float64', lower='float64', upper='float64')),
+    FLDEM_FEATURES_TABLE: dict(
+        dates=dict(date=DATE_FORMAT),
+        dtypes=dict(day='int32', gender='uint8', age='uint8',
+                    land_area='int32', water_area='int32', died='uint8'))
+}
+
+# tables also written as columnar snapshots by refresh - snapshot.py
+SNAPSHOT_TABLES = [
+    ARIMA_CASES_TABLE,
+    ARIMA_DEATHS_TABLE,
+    NYTIMES_COUNTIES_TABLE,
+    US_MAP_PIVOT_TABLE
+]
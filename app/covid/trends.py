@@ -21,7 +21,7 @@ from bokeh.models import (
 
 from database import DataBase
 from utilities import cwd
-from arima import (
+from tables import (
     ARIMA_CASES_TABLE,
     ARIMA_DEATHS_TABLE
 )
@@ -30,22 +30,19 @@ from arima import (
 logging.basicConfig(level=logging.INFO)
 LOG = logging.getLogger(__name__)
 
+# columns of each state line source
+TREND_COLUMNS = ['date', 'actual', 'predict', 'lower', 'upper']
+
 
 class LinePlot:
     """Line plot for covid19 cases and deaths by state
     """
-    def __init__(self, table):
+    def __init__(self, table, data=None):
         # data
-        _db = DataBase()
-        self.data = _db.get_table(table, parse_dates=['date'])
-        _db.close()
-
-        # options
-        _ids = self.data['state_id'].unique()
-        _states = self.data['state'].unique()
-        self.options = list(zip(_ids, _states))
-
-        self.data.set_index('state_id', inplace=True)
+        if data is None:
+            data = self.load(table)
+        self.data = data['data']
+        self.options = data['options']
 
         self.plot = None
 
@@ -57,6 +54,46 @@ class LinePlot:
         self.upper = dict()
         self.area = dict()
 
+    @staticmethod
+    def load(table):
+        """Read line plot data from database
+
+        No bokeh models are built here, so sessions can call it from
+        a worker thread.
+
+        Arguments:
+            table {String} -- arima table
+
+        Returns:
+            dict -- data indexed by state id and state options
+        """
+        _db = DataBase(cache=True, readonly=True)
+        data = _db.get_table(table)
+        _db.close()
+
+        # options
+        _ids = data['state_id'].unique()
+        _states = data['state'].unique()
+        options = list(zip(_ids, _states))
+
+        data.set_index('state_id', inplace=True)
+
+        return dict(data=data, options=options)
+
+    def source_data(self, state_id):
+        """Return line source data of one state
+
+        Only plotted columns are sent, state columns are categorical.
+
+        Arguments:
+            state_id {String} -- state id
+
+        Returns:
+            dict -- column name: array
+        """
+        _slice = self.data.loc[[state_id], TREND_COLUMNS]
+        return {_col: _slice[_col].to_numpy() for _col in TREND_COLUMNS}
+
     def _add_figure(self):
         _args = dict(x_axis_type='datetime', tools='save')
         self.plot = figure(**_args)
@@ -203,8 +240,11 @@ class LinePlot:
 class Trends:
     """Trends layout
     """
-    def __init__(self, palette=Purples[3]):
-        self.cases = LinePlot(ARIMA_CASES_TABLE)
+    def __init__(self, palette=Purples[3], data=None):
+        if data is None:
+            data = self.load()
+
+        self.cases = LinePlot(ARIMA_CASES_TABLE, data['cases'])
         self.cases.render_figure()
         self.cases.title("Cumulative Cases by State")
         self.cases.axis_label('Date', 'Cases')
@@ -212,7 +252,7 @@ class Trends:
 
         LOG.debug('state cases')
 
-        self.deaths = LinePlot(ARIMA_DEATHS_TABLE)
+        self.deaths = LinePlot(ARIMA_DEATHS_TABLE, data['deaths'])
         self.deaths.render_figure()
         self.deaths.title("Cumulative Deaths by State")
         self.deaths.axis_label('Date', 'Deaths')
@@ -226,6 +266,16 @@ class Trends:
 
         LOG.debug('render default states')
 
+    @staticmethod
+    def load():
+        """Read cases and deaths line plot data, see LinePlot.load
+
+        Returns:
+            dict -- cases and deaths data
+        """
+        return dict(cases=LinePlot.load(ARIMA_CASES_TABLE),
+                    deaths=LinePlot.load(ARIMA_DEATHS_TABLE))
+
     def _add_multiselect(self):
         self.multiselect = MultiSelect(title='States:', value=['01'],
                                        options=self.cases.options)
@@ -245,8 +295,7 @@ class Trends:
 
         for _id in new:
             if not self.cases.actual[_id].visible:
-                _slice = self.cases.data.loc[_id, :]
-                self.cases.source[_id].data = ColumnDataSource.from_df(data=_slice)
+                self.cases.source[_id].data = self.cases.source_data(_id)
 
                 self.cases.actual[_id].visible = True
                 self.cases.predict[_id].visible = True
@@ -265,8 +314,7 @@ class Trends:
 
         for _id in new:
             if not self.deaths.actual[_id].visible:
-                _slice = self.deaths.data.loc[_id, :]
-                self.deaths.source[_id].data = ColumnDataSource.from_df(data=_slice)
+                self.deaths.source[_id].data = self.deaths.source_data(_id)
 
                 self.deaths.actual[_id].visible = True
                 self.deaths.predict[_id].visible = True
@@ -2,7 +2,8 @@
    Data cleaning and formating module
 """
 
-from os.path import join
+from os.path import join, splitext
+from glob import glob
 from warnings import simplefilter
 import re
 
@@ -17,16 +18,40 @@ from shapely.wkt import loads
 
 from utilities import cwd
 from database import DataBase
+from nytimes import county_index, add_metadata
+from tables import (
+    US_MAP_TABLE,
+    STATE_MAP_TABLE,
+    COUNTY_LOOKUP_TABLE,
+    NYTIMES_COUNTIES_TABLE
+)
 
 
 # inputs
 COUNTY_SHAPES = join(cwd(), 'shapes', 'counties_500k', 'cb_2018_us_county_500k.shx')
 STATE_SHAPES = join(cwd(), 'shapes', 'states_500k', 'cb_2018_us_state_500k.shx')
+COUNTY_POP = join(cwd(), 'input', 'fips_county_pop.csv')
+STATE_POP = join(cwd(), 'input', 'state_name_pop.csv')
+
 
-# outputs
-US_MAP_TABLE = 'us_map'
-STATE_MAP_TABLE = 'state_map'
+def map_inputs():
+    """Return input files of maps_to_database
 
+    Returns:
+        list -- file names, a shapefile is all files with its base name
+    """
+    files = []
+    for _shapes in [COUNTY_SHAPES, STATE_SHAPES]:
+        files += sorted(glob(splitext(_shapes)[0] + '.*'))
+    return files + [COUNTY_POP, STATE_POP]
+
+# new york city counties, grouped as new york county
+NYC_COUNTIES = {'Queens': '36081',
+                'Bronx': '36005',
+                'Richmond': '36085',
+                'New York': '36061',
+                'Kings': '36047'}
+NYC_COUNTY_ID = '36061'
 
 def remove_islands(map_file, min_area=100000000):
     """Remove small polygons
@@ -113,22 +138,15 @@ def group_nyc_counties(us_map):
     Returns:
         {GeoDataFrame} -- county metadata
     """
-    # new york city counties
-    nyc_counties = {'Queens': '36081',
-                    'Bronx': '36005',
-                    'Richmond': '36085',
-                    'New York': '36061',
-                    'Kings': '36047'}
-
-    nyc = us_map.loc[us_map['county_id'].isin(nyc_counties.values()), :]
+    nyc = us_map.loc[us_map['county_id'].isin(NYC_COUNTIES.values()), :]
     nyc = nyc.copy(deep=True)
 
-    nyc['county_id'] = '36061'
+    nyc['county_id'] = NYC_COUNTY_ID
     nyc = nyc.dissolve(by='county_id', aggfunc='sum').reset_index()
     nyc['name'] = 'New York City'
     nyc['state_id'] = '36'
 
-    counties = us_map.loc[~us_map['county_id'].isin(nyc_counties.values()), :]
+    counties = us_map.loc[~us_map['county_id'].isin(NYC_COUNTIES.values()), :]
     counties = counties.copy(deep=True)
     counties = counties.append(nyc, ignore_index=True)
 
@@ -206,12 +224,12 @@ def get_maps(us_map, state_map):
     us_map['fips'] = us_map['GEOID'].astype(int)
 
     # add population data from lookup
-    pop = pd.read_csv(join(cwd(), 'input', 'fips_county_pop.csv'))
+    pop = pd.read_csv(COUNTY_POP)
     pop = pop.set_index('fips')['population'].to_dict()
     us_map['pop'] = us_map['fips'].map(pop)
     us_map['pop'].fillna(0)
 
-    pop = pd.read_csv(join(cwd(), 'input', 'state_name_pop.csv'))
+    pop = pd.read_csv(STATE_POP)
     pop = pop.set_index('state')['pop'].to_dict()
     state_map['pop'] = state_map['NAME'].map(pop)
 
@@ -243,6 +261,9 @@ def get_maps(us_map, state_map):
 
 def maps_to_database():
     """Refresh database with counties and states map
+
+    The map pivot and options are built from the maps, they are
+    rebuilt here once NY Times counties are loaded.
     """
     us_map = gpd.read_file(COUNTY_SHAPES, encoding='UTF-8')
     state_map = gpd.read_file(STATE_SHAPES, encoding='UTF-8')
@@ -254,8 +275,16 @@ def maps_to_database():
     _db = DataBase()
     _db.add_geotable(US_MAP_TABLE, us_map.set_index('county_id'))
     _db.add_geotable(STATE_MAP_TABLE, state_map.set_index('state_id'))
+    _db.add_table(COUNTY_LOOKUP_TABLE,
+                  county_index(us_map, state_map,
+                               aliases={fips: NYC_COUNTY_ID for fips in NYC_COUNTIES.values()}),
+                  index=False)
+    counties = _db.has_table(NYTIMES_COUNTIES_TABLE)
     _db.close()
 
+    if counties:
+        add_metadata()
+
 
 if __name__ == "__main__":
 